@@ -1,6 +1,8 @@
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.admin import SimpleListFilter
 from address.models import *
+from address.prefix import locality_index
 
 class UnidentifiedListFilter(SimpleListFilter):
     title = 'unidentified'
@@ -21,11 +23,34 @@ class CountryAdmin(admin.ModelAdmin):
 class StateAdmin(admin.ModelAdmin):
     search_fields = ('name', 'code')
 
+    def get_queryset(self, request):
+        return super(StateAdmin, self).get_queryset(request).with_hierarchy()
+
 @admin.register(Locality)
 class LocalityAdmin(admin.ModelAdmin):
     search_fields = ('name', 'postal_code')
 
+    # The most matches from the prefix index searched for by primary key.
+    index_limit = 500
+
+    def get_queryset(self, request):
+        return super(LocalityAdmin, self).get_queryset(request).with_hierarchy()
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        With the `ADDRESS_LOCALITY_INDEX` setting, search by prefix using the
+        locality index rather than scanning the table.
+        """
+        if search_term and getattr(settings, 'ADDRESS_LOCALITY_INDEX', False):
+            pks = locality_index.search(search_term, self.index_limit + 1)
+            if len(pks) <= self.index_limit:
+                return queryset.filter(pk__in=pks), False
+        return super(LocalityAdmin, self).get_search_results(request, queryset, search_term)
+
 @admin.register(Address)
 class AddressAdmin(admin.ModelAdmin):
     search_fields = ('name',)
     list_filter = (UnidentifiedListFilter,)
+
+    def get_queryset(self, request):
+        return super(AddressAdmin, self).get_queryset(request).with_hierarchy()
@@ -1,4 +1,6 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_save, post_delete
+from django.test.signals import setting_changed
 
 
 class AddressConfig(AppConfig):
@@ -6,3 +8,29 @@ class AddressConfig(AppConfig):
     Define config for the member app so that we can hook in signals.
     """
     name = 'address'
+
+    def ready(self):
+        from . import cache, metrics, prefix, resolvers
+        from .models import hierarchy_saved
+
+        for name in ('Country', 'State', 'Locality'):
+            model = self.get_model(name)
+
+            # Keep the hierarchy cache in step with the database.
+            post_save.connect(cache.invalidate_hierarchy, sender=model, dispatch_uid='address_cache_%s'%name)
+            post_delete.connect(cache.invalidate_hierarchy, sender=model, dispatch_uid='address_cache_%s'%name)
+
+            # Follow renames in the denormalized address columns.
+            post_save.connect(hierarchy_saved, sender=model, dispatch_uid='address_denormalize_%s'%name)
+
+            # Keep the locality prefix index in step too.
+            if name == 'Locality':
+                post_save.connect(prefix.locality_saved, sender=model, dispatch_uid='address_prefix_%s'%name)
+                post_delete.connect(prefix.locality_deleted, sender=model, dispatch_uid='address_prefix_%s'%name)
+            else:
+                post_save.connect(prefix.hierarchy_changed, sender=model, dispatch_uid='address_prefix_%s'%name)
+                post_delete.connect(prefix.hierarchy_changed, sender=model, dispatch_uid='address_prefix_%s'%name)
+
+        setting_changed.connect(cache.setting_changed, dispatch_uid='address_cache_setting')
+        setting_changed.connect(resolvers.setting_changed, dispatch_uid='address_resolver_setting')
+        setting_changed.connect(metrics.setting_changed, dispatch_uid='address_metrics_setting')
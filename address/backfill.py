@@ -0,0 +1,226 @@
+from collections import Counter, OrderedDict
+import time
+
+from django.db import models, transaction
+from django.utils import timezone
+
+from .models import (Address, Locality, BackfillCheckpoint, bulk_attach, make_dedupe_key, make_geohash,
+                     update_denormalized)
+from .normalize import prefix_key
+from .resolvers import RateLimiter, get_resolver, resolve_concurrently
+
+__all__ = ['BackfillTask', 'register', 'get_task', 'tasks', 'run_backfill']
+
+tasks = OrderedDict()
+
+##
+## Register a backfill task class under its `name`.
+##
+def register(cls):
+    tasks[cls.name] = cls
+    return cls
+
+def get_task(name):
+    try:
+        return tasks[name]()
+    except KeyError:
+        raise KeyError('Unknown backfill task: %s'%name)
+
+##
+## A backfill task processes the rows of a queryset in primary key order,
+## one batch per transaction.
+##
+class BackfillTask(object):
+    name = None
+    help = ''
+    model = Address
+    batch_size = 1000
+
+    def get_queryset(self):
+        return self.model._default_manager.all()
+
+    def process(self, objs):
+        """
+        Process a batch of rows, in primary key order.
+        """
+        raise NotImplementedError
+
+##
+## Run a backfill task, resuming from its checkpoint unless `restart` is
+## set. Progress is written to `stdout` after each batch and `sleep` seconds
+## are spent between batches to spare the database. Returns the checkpoint.
+##
+def run_backfill(task, batch_size=None, sleep=0, restart=False, limit=None, stdout=None):
+    if not isinstance(task, BackfillTask):
+        task = get_task(task)
+    batch_size = batch_size or task.batch_size
+    checkpoint, created = BackfillCheckpoint.objects.get_or_create(task=task.name)
+    if restart and not created:
+        checkpoint.last_pk = 0
+        checkpoint.rows = 0
+        checkpoint.started = timezone.now()
+        checkpoint.finished = None
+        checkpoint.save()
+
+    qs = task.get_queryset().order_by('pk')
+    start = time.time()
+    done = 0
+    while limit is None or done < limit:
+        size = batch_size if limit is None else min(batch_size, limit - done)
+        objs = list(qs.filter(pk__gt=checkpoint.last_pk)[:size])
+        if not objs:
+            checkpoint.finished = timezone.now()
+            checkpoint.save()
+            break
+        with transaction.atomic():
+            task.process(objs)
+            checkpoint.last_pk = objs[-1].pk
+            checkpoint.rows += len(objs)
+            checkpoint.save()
+        done += len(objs)
+        if stdout is not None:
+            elapsed = time.time() - start
+            stdout.write('%s: %d rows, last pk %s (%.1f rows/sec)\n'%(
+                task.name, checkpoint.rows, checkpoint.last_pk, done/elapsed if elapsed else 0.0
+            ))
+        if sleep:
+            time.sleep(sleep)
+    return checkpoint
+
+##
+## Set column `name` of the rows of `model` to `values`, a dictionary of
+## values by primary key, in one `UPDATE`.
+##
+def _set_values(model, name, values):
+    if values:
+        model.objects.filter(pk__in=list(values)).update(**{name: models.Case(
+            *[models.When(pk=pk, then=models.Value(value)) for pk, value in values.items()],
+            output_field=model._meta.get_field(name)
+        )})
+
+##
+## Built in tasks.
+##
+@register
+class DedupeKeyTask(BackfillTask):
+    name = 'dedupe_key'
+    help = 'Recompute the deduplication key of each address.'
+
+    def get_queryset(self):
+        return Address.objects.only('street_number', 'route', 'locality_id', 'raw', 'dedupe_key')
+
+    def process(self, objs):
+        keys = dict((o.pk, make_dedupe_key(o.street_number, o.route, o.locality_id, o.raw)) for o in objs)
+
+        # Addresses already holding their key keep it, others duplicating
+        # one seen before lose theirs.
+        taken = set(Address.objects.filter(dedupe_key__in=set(keys.values()))
+                    .exclude(pk__in=list(keys)).values_list('dedupe_key', flat=True))
+        taken.update(o.dedupe_key for o in objs if o.dedupe_key == keys[o.pk])
+        todo = {}
+        for obj in objs:
+            key = keys[obj.pk]
+            if key == obj.dedupe_key:
+                continue
+            if key in taken:
+                key = None
+            taken.add(key)
+            if key != obj.dedupe_key:
+                todo[obj.pk] = key
+
+        # Clear the keys changing first, as a row may take the key another
+        # row of the batch gives up.
+        if todo:
+            Address.objects.filter(pk__in=list(todo)).update(dedupe_key=None)
+        _set_values(Address, 'dedupe_key', dict((pk, key) for pk, key in todo.items() if key is not None))
+
+@register
+class DenormalizeTask(BackfillTask):
+    name = 'denormalize'
+    help = 'Rebuild the denormalized hierarchy columns of each address.'
+
+    def get_queryset(self):
+        return Address.objects.only('locality_id')
+
+    def process(self, objs):
+        batch = Address.objects.filter(pk__gte=objs[0].pk, pk__lte=objs[-1].pk)
+        localities = Locality.objects.filter(pk__in=set(o.locality_id for o in objs)).with_hierarchy()
+        for locality in list(localities) + [None]:
+            update_denormalized(batch, locality)
+
+@register
+class GeohashTask(BackfillTask):
+    name = 'geohash'
+    help = 'Compute the geohash of each address with coordinates.'
+
+    def get_queryset(self):
+        return Address.objects.exclude(latitude=None).exclude(longitude=None).only('latitude', 'longitude', 'geohash')
+
+    def process(self, objs):
+        todo = {}
+        for obj in objs:
+            value = make_geohash(obj.latitude, obj.longitude)
+            if value != obj.geohash:
+                todo[obj.pk] = value
+        _set_values(Address, 'geohash', todo)
+
+@register
+class RouteKeyTask(BackfillTask):
+    name = 'route_key'
+    help = 'Compute the folded route of each address, searched by the autocomplete view.'
+
+    def get_queryset(self):
+        return Address.objects.only('route', 'route_key')
+
+    def process(self, objs):
+        todo = {}
+        for obj in objs:
+            value = prefix_key(obj.route)[:100]
+            if value != obj.route_key:
+                todo[obj.pk] = value
+        _set_values(Address, 'route_key', todo)
+
+@register
+class LocalityKeyTask(BackfillTask):
+    name = 'locality_keys'
+    help = 'Compute the folded name and postal code of each locality, searched by the autocomplete view.'
+    model = Locality
+
+    def get_queryset(self):
+        return Locality.objects.only('name', 'postal_code', 'name_key', 'postal_code_key')
+
+    def process(self, objs):
+        names = {}
+        postal_codes = {}
+        for obj in objs:
+            name_key, postal_code_key = obj.name_key, obj.postal_code_key
+            obj.denormalize()
+            if obj.name_key != name_key:
+                names[obj.pk] = obj.name_key
+            if obj.postal_code_key != postal_code_key:
+                postal_codes[obj.pk] = obj.postal_code_key
+        _set_values(Locality, 'name_key', names)
+        _set_values(Locality, 'postal_code_key', postal_codes)
+
+@register
+class ResolveTask(BackfillTask):
+    name = 'resolve'
+    help = 'Resolve the addresses without a locality with the configured resolver.'
+
+    def __init__(self, resolver=None, concurrency=1, rate=None):
+        self.resolver = resolver
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rate) if rate else None
+        self.stats = Counter()
+
+    def get_queryset(self):
+        return Address.objects.filter(locality=None).exclude(raw='').only('raw', 'formatted')
+
+    def process(self, objs):
+        resolver = self.resolver or get_resolver()
+        if resolver is None:
+            raise ValueError('No resolver configured, see ADDRESS_RESOLVER.')
+        values = resolve_concurrently(resolver, [o.raw for o in objs], self.concurrency, self.limiter)
+        resolved = len(bulk_attach(objs, values))
+        self.stats['resolved'] += resolved
+        self.stats['unresolved'] += len(objs) - resolved
@@ -0,0 +1,17 @@
+import time
+
+##
+## Time `func` over each of `items`, returning the count, elapsed seconds
+## and throughput.
+##
+def measure(name, func, items):
+    start = time.time()
+    for item in items:
+        func(item)
+    elapsed = time.time() - start
+    return dict(
+        name=name,
+        count=len(items),
+        seconds=elapsed,
+        per_second=len(items)/elapsed if elapsed else 0.0,
+    )
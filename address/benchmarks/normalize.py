@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark address normalization, e.g.:
+
+    python -m address.benchmarks.normalize 1000000
+"""
+from __future__ import unicode_literals
+import random
+import sys
+
+from address.benchmarks import measure
+from address.normalize import normalize, fingerprint
+
+STREETS = ('Some', 'Queen', 'Château', 'Rue de la Paix', 'Müller', 'Amphitheatre', 'O\'Connell', 'Saint-Honoré')
+TYPES = ('St', 'Street', 'Rd', 'Ave', 'Pkwy', 'Blvd', 'Str.', 'Pde')
+LOCALITIES = ('Northcote', 'Mountain View', 'Paris', 'München', 'Dublin', 'Québec')
+
+##
+## Generate `count` raw addresses mixing case, accents, abbreviations and
+## punctuation. The same `seed` gives the same addresses.
+##
+def make_addresses(count, seed=0):
+    rnd = random.Random(seed)
+    res = []
+    for ii in range(count):
+        txt = '%d %s %s, %s %04d'%(rnd.randint(1, 2000), rnd.choice(STREETS), rnd.choice(TYPES),
+                                   rnd.choice(LOCALITIES), rnd.randint(0, 9999))
+        res.append(txt.upper() if ii%3 == 0 else txt)
+    return res
+
+def run(count=100000):
+    items = make_addresses(count)
+    return [
+        measure('normalize', normalize, items),
+        measure('fingerprint', fingerprint, items),
+    ]
+
+if __name__ == '__main__':
+    for result in run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000):
+        sys.stdout.write('%(name)s: %(count)d strings in %(seconds).2fs (%(per_second).0f/sec)\n'%result)
@@ -0,0 +1,175 @@
+"""
+Benchmark the entry points converting and displaying addresses against a
+synthetic hierarchy of `scale` addresses, e.g.:
+
+    manage.py address_benchmark --scale 10000 --scale 1000000 --output results.json
+
+or from `manage.py shell`:
+
+    from address.benchmarks import resolution
+    resolution.run(10000)
+
+The data is committed, so that the hierarchy cache is filled as it would
+be in use, and deleted afterwards. Use a scratch database. Each entry
+point is called with the same values for the same `seed`, and reported
+with its queries per call, latency percentiles and throughput.
+"""
+from __future__ import division
+import random
+from timeit import default_timer
+
+import django
+from django.db import connection, transaction
+
+from address.cache import hierarchy_cache
+from address.models import Country, State, Locality, Address, make_dedupe_key, to_python, _to_python
+
+# Hierarchy rows per row of the level below.
+ADDRESSES_PER_LOCALITY = 20
+LOCALITIES_PER_STATE = 50
+STATES_PER_COUNTRY = 8
+
+BATCH_SIZE = 1000
+
+def _count(scale, per):
+    return max(1, scale//per)
+
+##
+## Create `scale` addresses, and the countries, states and localities
+## holding them, with `bulk_create`.
+##
+@transaction.atomic
+def populate(scale, seed=0):
+    n_localities = _count(scale, ADDRESSES_PER_LOCALITY)
+    n_states = _count(n_localities, LOCALITIES_PER_STATE)
+    n_countries = _count(n_states, STATES_PER_COUNTRY)
+    Country.objects.bulk_create([
+        Country(name='Benchmark Country %d'%ii, code='%02d'%(ii%100)) for ii in range(n_countries)
+    ], batch_size=BATCH_SIZE)
+    countries = list(Country.objects.filter(name__startswith='Benchmark Country ').order_by('pk'))
+    State.objects.bulk_create([
+        State(name='Benchmark State %d'%ii, code='S%d'%(ii%100), country=countries[ii%n_countries])
+        for ii in range(n_states)
+    ], batch_size=BATCH_SIZE)
+    states = list(State.objects.filter(name__startswith='Benchmark State ').with_hierarchy().order_by('pk'))
+    localities = [Locality(name='Benchmark Locality %d'%ii, postal_code='%05d'%ii, state=states[ii%n_states])
+                  for ii in range(n_localities)]
+    for obj in localities:
+        obj.denormalize()
+    Locality.objects.bulk_create(localities, batch_size=BATCH_SIZE)
+    localities = list(Locality.objects.filter(name__startswith='Benchmark Locality ').with_hierarchy().order_by('pk'))
+    rnd = random.Random(seed)
+    for start in range(0, scale, BATCH_SIZE):
+        objs = []
+        for ii in range(start, min(scale, start + BATCH_SIZE)):
+            obj = Address(street_number=str(ii), route='Benchmark Street', locality=localities[ii%n_localities],
+                          raw='%d Benchmark Street'%ii, latitude=rnd.uniform(-45, -10), longitude=rnd.uniform(113, 154))
+            obj.dedupe_key = make_dedupe_key(obj.street_number, obj.route, obj.locality.pk, obj.raw)
+            obj.denormalize()
+            objs.append(obj)
+        Address.objects.bulk_create(objs)
+
+##
+## Delete the rows created by `populate`, and the addresses created in
+## their localities.
+##
+def cleanup():
+    countries = Country.objects.filter(name__startswith='Benchmark Country ')
+    Address.objects.filter(locality__state__country__in=countries).delete()
+    Locality.objects.filter(state__country__in=countries).delete()
+    State.objects.filter(country__in=countries).delete()
+    countries.delete()
+
+def _value(obj):
+    return dict(
+        raw=obj.raw, street_number=obj.street_number, route=obj.route,
+        locality=obj.locality_name, postal_code=obj.postal_code,
+        state=obj.state_name, state_code=obj.state_code,
+        country=obj.country_name, country_code=obj.country_code,
+    )
+
+def _percentile(values, q):
+    return values[min(len(values) - 1, int(round(q*(len(values) - 1))))]
+
+##
+## Call `func` with each of `items`, counting the queries of each call.
+##
+def measure(name, func, items):
+    times = []
+    queries = 0
+    hierarchy_cache.clear()
+    debug = connection.force_debug_cursor
+    connection.force_debug_cursor = True
+    try:
+        for item in items:
+            connection.queries_log.clear()
+            start = default_timer()
+            func(item)
+            times.append(default_timer() - start)
+            queries += len(connection.queries_log)
+    finally:
+        connection.force_debug_cursor = debug
+        connection.queries_log.clear()
+    elapsed = sum(times)
+    times.sort()
+    return dict(
+        name=name,
+        count=len(items),
+        queries_per_call=queries/len(items) if items else 0.0,
+        p50_ms=_percentile(times, 0.5)*1000 if times else 0.0,
+        p99_ms=_percentile(times, 0.99)*1000 if times else 0.0,
+        seconds=elapsed,
+        per_second=len(items)/elapsed if elapsed else 0.0,
+    )
+
+##
+## The entry points timed, each a function of the sample addresses giving
+## the function to call and the values to call it with.
+##
+def _entry_points():
+    from address.forms import AddressField, AddressWidget
+    field = AddressField()
+    widget = AddressWidget()
+
+    def form_value(obj):
+        return dict(_value(obj), latitude=str(obj.latitude), longitude=str(obj.longitude))
+
+    def new_value(obj):
+        return dict(_value(obj), street_number='%s-new'%obj.street_number, raw='%s new'%obj.raw)
+
+    return [
+        ('to_python', lambda objs: (to_python, [_value(o) for o in objs])),
+        ('to_python (new)', lambda objs: (to_python, [new_value(o) for o in objs])),
+        ('_to_python', lambda objs: (_to_python, [_value(o) for o in objs])),
+        ('Address.as_dict', lambda objs: (Address.as_dict, objs)),
+        ('AddressWidget.render', lambda objs: (lambda o: widget.render('address', o), objs)),
+        ('forms.AddressField.to_python', lambda objs: (field.to_python, [form_value(o) for o in objs])),
+    ]
+
+##
+## Seed `scale` addresses and time `calls` calls of each entry point, with
+## addresses sampled at random.
+##
+def run(scale=10000, calls=1000, seed=0):
+    rnd = random.Random(seed)
+    res = dict(
+        scale=scale,
+        calls=calls,
+        seed=seed,
+        database=connection.vendor,
+        django=django.get_version(),
+        results=[],
+    )
+    start = default_timer()
+    populate(scale, seed)
+    res['seed_seconds'] = default_timer() - start
+    try:
+        pks = list(Address.objects.filter(route='Benchmark Street').values_list('pk', flat=True))
+        sample = [rnd.choice(pks) for ii in range(calls)]
+        for name, prepare in _entry_points():
+            objs = Address.objects.in_bulk(set(sample))
+            func, items = prepare([objs[pk] for pk in sample])
+            res['results'].append(measure(name, func, items))
+    finally:
+        cleanup()
+    return res
@@ -0,0 +1,78 @@
+"""
+Benchmark radius searches using the geohash index against a scan of every
+address, e.g. from `manage.py shell`:
+
+    from address.benchmarks import spatial
+    spatial.run(100000)
+
+The addresses are created inside a transaction that is rolled back.
+`run_index` times nearest neighbour queries in bulk with
+`AddressSpatialIndex`, which needs NumPy.
+"""
+import random
+import time
+
+from django.db import transaction
+
+from address.geo import distance
+from address.models import Address
+from address.spatial import AddressSpatialIndex, _xyz
+
+##
+## Radius searches by scanning every address, as done without an index.
+##
+def naive_within_radius(latitude, longitude, km):
+    res = []
+    for obj in Address.objects.exclude(latitude=None).exclude(longitude=None):
+        obj.distance = distance(latitude, longitude, obj.latitude, obj.longitude)
+        if obj.distance <= km:
+            res.append(obj)
+    res.sort(key=lambda o: o.distance)
+    return res
+
+def _time(name, func, points, km):
+    start = time.time()
+    found = 0
+    for lat, lng in points:
+        found += len(func(lat, lng, km))
+    elapsed = time.time() - start
+    return dict(name=name, count=len(points), seconds=elapsed,
+                per_second=len(points)/elapsed if elapsed else 0.0, found=found)
+
+##
+## Time `queries` searches of `km` kilometres among `count` addresses
+## scattered over a region around Melbourne.
+##
+def run(count=10000, queries=20, km=5.0, seed=0):
+    rnd = random.Random(seed)
+    point = lambda: (rnd.uniform(-38.5, -37.0), rnd.uniform(144.0, 146.0))
+    points = [point() for ii in range(queries)]
+    with transaction.atomic():
+        objs = []
+        for ii in range(count):
+            lat, lng = point()
+            obj = Address(raw='benchmark %d'%ii, latitude=lat, longitude=lng)
+            obj.denormalize()
+            objs.append(obj)
+        Address.objects.bulk_create(objs, batch_size=500)
+        res = [
+            _time('within_radius', Address.objects.within_radius, points, km),
+            _time('naive scan', naive_within_radius, points, km),
+        ]
+        transaction.set_rollback(True)
+    return res
+
+##
+## Time nearest neighbour queries for `queries` random points among `count`
+## indexed points, in one batch.
+##
+def run_index(count=50000, queries=100000, k=1, seed=0):
+    import numpy as np
+    rnd = np.random.RandomState(seed)
+    index = AddressSpatialIndex(np.arange(count), _xyz(rnd.uniform(-45, -10, count), rnd.uniform(113, 154, count)))
+    latitudes, longitudes = rnd.uniform(-45, -10, queries), rnd.uniform(113, 154, queries)
+    start = time.time()
+    index.query(latitudes, longitudes, k=k)
+    elapsed = time.time() - start
+    return dict(name='AddressSpatialIndex.query', count=queries, seconds=elapsed,
+                per_second=queries/elapsed if elapsed else 0.0)
@@ -0,0 +1,60 @@
+"""
+Benchmark rendering a formset of address fields, with and without the
+addresses prefetched, e.g. from `manage.py shell`:
+
+    from address.benchmarks import widgets
+    widgets.run(200)
+
+The addresses are created inside a transaction that is rolled back.
+"""
+import time
+
+from django import forms
+from django.db import transaction
+
+from address.forms import AddressField, prefetch_addresses
+from address.models import Country, State, Locality, Address
+
+class AddressForm(forms.Form):
+    address = AddressField()
+
+AddressFormSet = forms.formset_factory(AddressForm, extra=0)
+
+def _time(name, func, repeat):
+    start = time.time()
+    for ii in range(repeat):
+        func()
+    elapsed = time.time() - start
+    return dict(name=name, count=repeat, seconds=elapsed,
+                per_second=repeat/elapsed if elapsed else 0.0)
+
+def render(initial):
+    return AddressFormSet(initial=initial).as_table()
+
+def render_prefetched(initial):
+    formset = AddressFormSet(initial=initial)
+    prefetch_addresses(formset)
+    return formset.as_table()
+
+##
+## Time rendering `repeat` formsets of `count` address fields.
+##
+def run(count=200, repeat=10):
+    with transaction.atomic():
+        country = Country.objects.create(name='Benchmark', code='BM')
+        state = State.objects.create(name='Benchmark', code='BM', country=country)
+        locality = Locality.objects.create(name='Benchmark', postal_code='0000', state=state)
+        objs = []
+        for ii in range(count):
+            obj = Address(street_number=str(ii), route='Benchmark Street', locality=locality,
+                          raw='%d Benchmark Street'%ii)
+            obj.denormalize()
+            objs.append(obj)
+        Address.objects.bulk_create(objs)
+        initial = [{'address': pk} for pk in Address.objects.filter(locality=locality).values_list('pk', flat=True)]
+        res = [
+            _time('formset', lambda: render(initial), repeat),
+            _time('formset prefetched', lambda: render_prefetched(initial), repeat),
+        ]
+        transaction.set_rollback(True)
+    return res
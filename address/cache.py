@@ -0,0 +1,239 @@
+from collections import OrderedDict
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import router, transaction
+from django.utils.encoding import force_bytes
+
+__all__ = ['LRUCache', 'HierarchyCache', 'hierarchy_cache']
+
+DEFAULT_SIZE = 1000
+
+# Bump when the layout of the shared cache entries changes.
+KEY_VERSION = 1
+
+##
+## A bounded, thread safe, least recently used mapping.
+##
+class LRUCache(object):
+
+    def __init__(self, size):
+        self.size = size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+##
+## Cache of the Country, State and Locality rows used when converting values
+## to addresses. Rows are cached on their natural keys, which are:
+##
+##   Country:  (name,)
+##   State:    (name, country_id)
+##   Locality: (name, postal_code, state_id)
+##
+## Entries are the field values of the rows, not the instances, so each
+## hit gets a fresh instance that can't carry a stale related object, nor
+## be changed by its caller under another.
+##
+## There are two layers. The first is a per-process LRU, with the size of
+## each model's cache taken from the setting `ADDRESS_HIERARCHY_CACHE_SIZE`
+## (zero disables it). The second, optional, layer is shared between
+## processes and lives in the Django cache named by the setting
+## `ADDRESS_HIERARCHY_CACHE_ALIAS`, with entries expiring after
+## `ADDRESS_HIERARCHY_CACHE_TIMEOUT` seconds, or the cache's default.
+##
+## Saves and deletes invalidate the entries of the row in this process's
+## LRU and in the shared layer, but other processes' LRUs can't be reached
+## directly. So the shared layer also holds a generation per model, bumped
+## on each invalidation. Entries of the LRU record the generation they
+## were cached under and are only used while it's current.
+##
+class HierarchyCache(object):
+
+    def __init__(self, size=None):
+        self._size = size
+        self._caches = {}
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        if self._size is not None:
+            return self._size
+        return getattr(settings, 'ADDRESS_HIERARCHY_CACHE_SIZE', DEFAULT_SIZE)
+
+    def _cache(self, model):
+        label = model._meta.label_lower
+        try:
+            return self._caches[label], self._keys[label]
+        except KeyError:
+            with self._lock:
+                if label not in self._caches:
+                    self._keys[label] = LRUCache(self.size)
+                    self._caches[label] = LRUCache(self.size)
+                return self._caches[label], self._keys[label]
+
+    def _shared(self):
+        alias = getattr(settings, 'ADDRESS_HIERARCHY_CACHE_ALIAS', None)
+        return caches[alias] if alias else None
+
+    def _shared_key(self, model, key):
+        digest = hashlib.md5(force_bytes(repr(key))).hexdigest()
+        return 'address:%s:%s'%(model._meta.label_lower, digest)
+
+    def _shared_pk_key(self, model, pk):
+        return 'address:%s:pk:%s'%(model._meta.label_lower, pk)
+
+    def _generation_key(self, model):
+        return 'address:%s:generation'%model._meta.label_lower
+
+    def _generation(self, model):
+        shared = self._shared()
+        if shared is None:
+            return None
+        key = self._generation_key(model)
+        generation = shared.get(key, version=KEY_VERSION)
+        if generation is None:
+            # Start from the clock rather than zero, so an evicted counter
+            # doesn't come back at a generation entries were cached under.
+            shared.add(key, int(time.time()*1000), timeout=None, version=KEY_VERSION)
+            generation = shared.get(key, version=KEY_VERSION)
+        return generation
+
+    def _bump(self, model):
+        shared = self._shared()
+        if shared is None:
+            return
+        try:
+            shared.incr(self._generation_key(model), version=KEY_VERSION)
+        except ValueError:
+            self._generation(model)
+
+    def _values(self, model, obj):
+        return [getattr(obj, f.attname) for f in model._meta.concrete_fields]
+
+    def _build(self, model, values):
+        fields = [f.attname for f in model._meta.concrete_fields]
+        if values is None or len(values) != len(fields):
+            return None
+        return model.from_db(router.db_for_read(model), fields, values)
+
+    def _shared_get(self, model, key):
+        shared = self._shared()
+        if shared is None:
+            return None
+        return shared.get(self._shared_key(model, key), version=KEY_VERSION)
+
+    def _shared_set(self, model, key, values, pk):
+        shared = self._shared()
+        if shared is None:
+            return
+        timeout = getattr(settings, 'ADDRESS_HIERARCHY_CACHE_TIMEOUT', None)
+        if timeout is None:
+            timeout = DEFAULT_TIMEOUT
+        shared.set_many({
+            self._shared_key(model, key): values,
+            self._shared_pk_key(model, pk): key,
+        }, timeout=timeout, version=KEY_VERSION)
+
+    def _shared_delete(self, model, pk):
+        shared = self._shared()
+        if shared is None:
+            return
+        pk_key = self._shared_pk_key(model, pk)
+        key = shared.get(pk_key, version=KEY_VERSION)
+        if key is not None:
+            shared.delete_many([self._shared_key(model, key), pk_key], version=KEY_VERSION)
+
+    def get(self, model, key):
+        generation = self._generation(model)
+        if self.size:
+            cache, keys = self._cache(model)
+            entry = cache.get(key)
+            if entry is not None and entry[0] == generation:
+                return self._build(model, entry[1])
+        obj = self._build(model, self._shared_get(model, key))
+        if obj is not None and self.size:
+            cache.set(key, (generation, self._values(model, obj)))
+            keys.set(obj.pk, key)
+        return obj
+
+    def set(self, model, key, obj):
+        """
+        Cache `obj` once the current transaction commits, so that rows
+        rolled back are never cached.
+        """
+        values, pk = self._values(model, obj), obj.pk
+        generation = self._generation(model)
+        def _set():
+            if self.size:
+                cache, keys = self._cache(model)
+                cache.set(key, (generation, values))
+                keys.set(pk, key)
+            self._shared_set(model, key, values, pk)
+        transaction.on_commit(_set)
+
+    def invalidate(self, model, pk):
+        cache, keys = self._cache(model)
+        key = keys.get(pk)
+        if key is not None:
+            cache.delete(key)
+            keys.delete(pk)
+        self._shared_delete(model, pk)
+        self._bump(model)
+
+        # Other processes may repopulate the caches before we commit.
+        def _invalidate():
+            self._shared_delete(model, pk)
+            self._bump(model)
+        transaction.on_commit(_invalidate)
+
+    def clear(self):
+        with self._lock:
+            self._caches = {}
+            self._keys = {}
+
+hierarchy_cache = HierarchyCache()
+
+##
+## Signal handlers. New rows can't be cached yet, so are ignored.
+##
+def invalidate_hierarchy(sender, instance, created=False, **kwargs):
+    if not created:
+        hierarchy_cache.invalidate(sender, instance.pk)
+
+def setting_changed(setting, **kwargs):
+    if setting in ('ADDRESS_HIERARCHY_CACHE_SIZE', 'ADDRESS_HIERARCHY_CACHE_ALIAS', 'CACHES'):
+        hierarchy_cache.clear()
@@ -0,0 +1,187 @@
+from collections import Counter, OrderedDict, namedtuple
+from difflib import SequenceMatcher
+from itertools import groupby
+
+from django.db import transaction
+
+from .backfill import DedupeKeyTask
+from .models import State, Locality, Address, update_denormalized
+from .normalize import normalize, fingerprint
+
+__all__ = ['LEVELS', 'MergeError', 'similarity', 'find_duplicates', 'merge', 'dedupe']
+
+##
+## Raised when rows can't be merged without losing data.
+##
+class MergeError(Exception):
+    pass
+
+##
+## How to find the duplicates of each model: the columns fetched (primary
+## key first), the leading columns that candidates must share, which the
+## rows are streamed in the order of, and the text compared between
+## candidates. Rows are only held in memory a block at a time.
+##
+Level = namedtuple('Level', 'model fields block text compatible')
+
+LEVELS = OrderedDict((
+    ('states', Level(
+        State, ('pk', 'country_id', 'name', 'code'), 1,
+        lambda r: fingerprint(r[2]),
+        lambda a, b: not (a[3] and b[3] and a[3].lower() != b[3].lower()),
+    )),
+    ('localities', Level(
+        Locality, ('pk', 'state_id', 'postal_code', 'name'), 2,
+        lambda r: fingerprint(r[3]),
+        lambda a, b: True,
+    )),
+    ('addresses', Level(
+        Address, ('pk', 'locality_id', 'street_number', 'route'), 2,
+        lambda r: normalize(r[3]),
+        lambda a, b: normalize(a[2]) == normalize(b[2]),
+    )),
+))
+
+def similarity(a, b):
+    if a == b:
+        return 1.0
+    return SequenceMatcher(None, a, b).ratio()
+
+##
+## Cluster the rows of a block, each joining the first cluster whose
+## oldest row it is similar enough to. Returns `(survivor, duplicates)`
+## pairs, duplicates being `(row, score)` pairs.
+##
+def _cluster(level, rows, threshold):
+    clusters = []
+    for row in sorted(rows):
+        text = level.text(row)
+        for survivor, survivor_text, dups in clusters:
+            if level.compatible(survivor, row):
+                score = similarity(survivor_text, text)
+                if score >= threshold:
+                    dups.append((row, score))
+                    break
+        else:
+            clusters.append((row, text, []))
+    return [(survivor, dups) for survivor, text, dups in clusters if dups]
+
+##
+## Stream the duplicates of a level as `(survivor, duplicates)` pairs.
+## Addresses without a locality aren't considered.
+##
+def find_duplicates(name, threshold=0.9):
+    level = LEVELS[name]
+    qs = level.model._base_manager.all()
+    if level.model is Address:
+        qs = qs.exclude(locality=None)
+    block = level.fields[1:level.block + 1]
+    rows = qs.order_by(*block + ('pk',)).values_list(*level.fields).iterator()
+    for key, group in groupby(rows, lambda r: r[1:level.block + 1]):
+        group = list(group)
+        if len(group) > 1:
+            for pair in _cluster(level, group, threshold):
+                yield pair
+
+def _chunks(qs, batch_size):
+    while True:
+        pks = list(qs.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            break
+        yield pks
+
+##
+## Point every foreign key and one to one field to the duplicates of
+## `model`, found by introspection, at the survivor instead, in batches.
+## Raises `MergeError` when more than one row would be left pointing at
+## the survivor by a one to one field.
+##
+def _repoint(model, survivor, duplicates, batch_size):
+    for rel in model._meta.get_fields(include_hidden=True):
+        if not (rel.auto_created and not rel.concrete and (rel.one_to_many or rel.one_to_one)):
+            continue
+        name = rel.field.name
+        manager = rel.related_model._base_manager
+        if rel.one_to_one and manager.filter(**{'%s__in'%name: [survivor] + list(duplicates)}).count() > 1:
+            raise MergeError('%s %s and its duplicates are each referred to by a %s.'%(
+                model.__name__, survivor, rel.related_model.__name__
+            ))
+        for pks in _chunks(manager.filter(**{'%s__in'%name: duplicates}), batch_size):
+            manager.filter(pk__in=pks).update(**{name: survivor})
+
+def _rekey(qs, batch_size):
+    task = DedupeKeyTask()
+    last = 0
+    while True:
+        objs = list(task.get_queryset().filter(pk__in=qs.values('pk'), pk__gt=last).order_by('pk')[:batch_size])
+        if not objs:
+            break
+        task.process(objs)
+        last = objs[-1].pk
+
+##
+## Merge the `duplicates` (primary keys) of `model` into `survivor`: the
+## rows referring to them are moved to the survivor and the duplicates
+## deleted. States are merged one duplicate at a time, their localities
+## that clash with a locality of the surviving state being merged first.
+## Addresses moved to a new locality are rekeyed and their denormalized
+## columns rebuilt. Raises `MergeError`, merging nothing, when the
+## duplicates can't be merged.
+##
+def merge(model, survivor, duplicates, batch_size=1000):
+    with transaction.atomic():
+        if model is State:
+            moved = []
+            for dup in duplicates:
+                for loc in Locality.objects.filter(state=dup):
+                    target = Locality.objects.filter(state=survivor, name=loc.name,
+                                                     postal_code=loc.postal_code).first()
+                    if target is not None:
+                        merge(Locality, target.pk, [loc.pk], batch_size)
+                moved.extend(Locality.objects.filter(state=dup).values_list('pk', flat=True))
+                _repoint(model, survivor, [dup], batch_size)
+        else:
+            _repoint(model, survivor, duplicates, batch_size)
+        model._base_manager.filter(pk__in=duplicates).delete()
+
+        if model is State:
+            for loc in Locality.objects.filter(pk__in=moved).with_hierarchy():
+                update_denormalized(Address.objects.filter(locality=loc), loc)
+        elif model is Locality:
+            loc = Locality.objects.with_hierarchy().get(pk=survivor)
+            addresses = Address.objects.filter(locality=loc)
+            update_denormalized(addresses, loc)
+            _rekey(addresses, batch_size)
+
+##
+## Find and, unless `dry_run` is set, merge the duplicates of each of
+## `levels` in turn. Each merge, and each refused with `MergeError`, is
+## written to `stdout`. Returns a `Counter` of the rows merged per level.
+##
+def dedupe(levels=None, threshold=0.9, dry_run=False, batch_size=1000, stdout=None):
+    stats = Counter()
+    for name in levels or LEVELS:
+        level = LEVELS[name]
+        for survivor, dups in find_duplicates(name, threshold):
+            if stdout is not None:
+                for row, score in dups:
+                    stdout.write('%s %s %s into %s (%.2f)\n'%(
+                        'Would merge' if dry_run else 'Merging', level.model.__name__,
+                        _label(level, row), _label(level, survivor), score
+                    ))
+            if not dry_run:
+                try:
+                    merge(level.model, survivor[0], [r[0] for r, s in dups], batch_size)
+                except MergeError as e:
+                    if stdout is not None:
+                        stdout.write('Skipped: %s\n'%e)
+                    continue
+            stats[name] += len(dups)
+    return stats
+
+def _label(level, row):
+    if level.model is Address:
+        return '%s "%s %s"'%(row[0], row[2], row[3])
+    elif level.model is Locality:
+        return '%s "%s %s"'%(row[0], row[3], row[2])
+    return '%s "%s"'%(row[0], row[2])
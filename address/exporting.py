@@ -0,0 +1,95 @@
+import csv
+import io
+import json
+
+import django
+from django.utils import six
+
+from .models import Address
+
+__all__ = ['FIELDS', 'iter_addresses', 'export_addresses']
+
+# The columns written, in the shape of `Address.as_dict`.
+FIELDS = ('raw', 'formatted', 'street_number', 'route', 'locality', 'postal_code', 'state',
+          'state_code', 'country', 'country_code', 'latitude', 'longitude')
+
+##
+## Stream the addresses of `queryset` as dictionaries in the shape of
+## `Address.as_dict`. The hierarchy is joined in the same query and rows are
+## fetched with `iterator`, which uses a server-side cursor where the
+## database supports one, so memory use doesn't grow with the table.
+##
+def iter_addresses(queryset=None, chunk_size=2000):
+    if queryset is None:
+        queryset = Address.objects.all()
+    queryset = queryset.with_hierarchy().order_by('pk')
+    if django.VERSION >= (2, 0):
+        rows = queryset.iterator(chunk_size=chunk_size)
+    else:
+        rows = queryset.iterator()
+    for obj in rows:
+        yield obj.as_dict()
+
+##
+## A CSV writer onto a text stream. On Python 2 the csv module only writes
+## bytes, so each row is encoded as UTF-8 into a buffer and decoded onto
+## the stream.
+##
+class _CSVWriter(object):
+
+    def __init__(self, stream):
+        self.stream = stream
+        if six.PY2:
+            self.buffer = io.BytesIO()
+            self.writer = csv.DictWriter(self.buffer, FIELDS, extrasaction='ignore', lineterminator='\n')
+        else:
+            self.writer = csv.DictWriter(stream, FIELDS, extrasaction='ignore', lineterminator='\n')
+
+    def _flush(self):
+        if six.PY2:
+            self.stream.write(self.buffer.getvalue().decode('utf-8'))
+            self.buffer.seek(0)
+            self.buffer.truncate()
+
+    def writeheader(self):
+        self.writer.writeheader()
+        self._flush()
+
+    def writerow(self, row):
+        if six.PY2:
+            row = dict((k, v.encode('utf-8') if isinstance(v, six.text_type) else v) for k, v in row.items())
+        self.writer.writerow(row)
+        self._flush()
+
+def _write_csv(rows, stream):
+    writer = _CSVWriter(stream)
+    writer.writeheader()
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+def _write_jsonl(rows, stream):
+    count = 0
+    for row in rows:
+        stream.write(six.text_type(json.dumps(row, sort_keys=True)) + '\n')
+        count += 1
+    return count
+
+WRITERS = {
+    'csv': _write_csv,
+    'jsonl': _write_jsonl,
+    'ndjson': _write_jsonl,
+}
+
+##
+## Write the addresses of `queryset` to a text stream as CSV or JSON lines.
+## Returns the number of addresses written.
+##
+def export_addresses(stream, format='jsonl', queryset=None, chunk_size=2000):
+    try:
+        writer = WRITERS[format]
+    except KeyError:
+        raise ValueError('Unknown format: %s'%format)
+    return writer(iter_addresses(queryset, chunk_size=chunk_size), stream)
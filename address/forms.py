@@ -1,7 +1,10 @@
 from django import forms
 # from uni_form.helpers import *
+from django.forms.utils import flatatt
+from django.utils.html import escape
 from django.utils.safestring import mark_safe
 from django.conf import settings
+from django.shortcuts import resolve_url
 from django.core.exceptions import ImproperlyConfigured
 from .models import Address, to_python
 import logging
@@ -16,12 +19,18 @@ if sys.version > '3':
 
 logger = logging.getLogger(__name__)
 
-__all__ = ['AddressWidget', 'AddressField']
+__all__ = ['AddressWidget', 'AddressField', 'prefetch_addresses']
 
-if not settings.GOOGLE_API_KEY:
+if getattr(settings, 'ADDRESS_USE_GOOGLE', True) and not getattr(settings, 'GOOGLE_API_KEY', None):
     raise ImproperlyConfigured("GOOGLE_API_KEY is not configured in settings.py")
 
 
+def _escape(value):
+    if value is None:
+        return ''
+    return escape(value)
+
+
 class AddressWidget(forms.TextInput):
     components = [('country', 'country'), ('country_code', 'country_short'),
                   ('locality', 'locality'), ('sublocality', 'sublocality'),
@@ -32,13 +41,12 @@ class AddressWidget(forms.TextInput):
                   ('formatted', 'formatted_address'),
                   ('latitude', 'lat'), ('longitude', 'lng')]
 
-    class Media:
-        js = (
-            'https://maps.googleapis.com/maps/api/js?libraries=places&key=%s' % settings.GOOGLE_API_KEY,
-            'js/jquery.geocomplete.min.js',
-            'address/js/address.js')
-
+    # Suggestions may come from the autocomplete view (see `address.urls`),
+    # from Google, or from the view first and Google after. Both default to
+    # the `ADDRESS_AUTOCOMPLETE_URL` and `ADDRESS_USE_GOOGLE` settings.
     def __init__(self, *args, **kwargs):
+        self.autocomplete_url = kwargs.pop('autocomplete_url', None)
+        self.use_google = kwargs.pop('use_google', None)
         attrs = kwargs.get('attrs', {})
         classes = attrs.get('class', '')
         classes += (' ' if classes else '') + 'address'
@@ -46,6 +54,51 @@ class AddressWidget(forms.TextInput):
         kwargs['attrs'] = attrs
         super(AddressWidget, self).__init__(*args, **kwargs)
 
+    def get_autocomplete_url(self):
+        url = self.autocomplete_url
+        if url is None:
+            url = getattr(settings, 'ADDRESS_AUTOCOMPLETE_URL', None)
+        return url and resolve_url(url)
+
+    def get_use_google(self):
+        if self.use_google is None:
+            return getattr(settings, 'ADDRESS_USE_GOOGLE', True)
+        return self.use_google
+
+    @property
+    def media(self):
+        js = ()
+        if self.get_use_google():
+            js = (
+                'https://maps.googleapis.com/maps/api/js?libraries=places&key=%s' % settings.GOOGLE_API_KEY,
+                'js/jquery.geocomplete.min.js')
+        return forms.Media(js=js + ('address/js/address.js',))
+
+    def build_attrs(self, *args, **kwargs):
+        attrs = super(AddressWidget, self).build_attrs(*args, **kwargs)
+        url = self.get_autocomplete_url()
+        if url:
+            attrs['data-autocomplete-url'] = url
+        return attrs
+
+    @classmethod
+    def hidden_template(cls):
+        """
+        The hidden inputs of the components, compiled once per class into a
+        single template filled in with `%`.
+        """
+        template = cls.__dict__.get('_hidden_template')
+        if template is None:
+            elems = ['<div id="%(name)s_components">']
+            for com in cls.components:
+                elems.append('<input type="hidden" name="%%(name)s_%s" data-geo="%s" value="%%(%s)s" />' % (
+                    com[0], com[1], com[0])
+                )
+            elems.append('</div>')
+            template = '\n'.join(elems)
+            cls._hidden_template = template
+        return template
+
     def render(self, name, value, attrs=None, **kwargs):
 
         # Can accept None, a dictionary of values or an Address object.
@@ -54,23 +107,27 @@ class AddressWidget(forms.TextInput):
         elif isinstance(value, dict):
             ad = value
         elif isinstance(value, (int, long)):
-            ad = Address.objects.get(pk=value)
+            ad = Address.objects.with_hierarchy().get(pk=value)
             ad = ad.as_dict()
         else:
             ad = value.as_dict()
 
         # Generate the elements. We should create a suite of hidden fields
         # For each individual component, and a visible field for the raw
-        # input. Begin by generating the raw input.
-        elems = [super(AddressWidget, self).render(name, ad.get('formatted', None), attrs, **kwargs)]
-
-        # Now add the hidden fields.
-        elems.append('<div id="%s_components">' % name)
-        for com in self.components:
-            elems.append('<input type="hidden" name="%s_%s" data-geo="%s" value="%s" />' % (
-                name, com[0], com[1], ad.get(com[0], ''))
-            )
-        elems.append('</div>')
+        # input. Begin by generating the raw input, directly rather than
+        # through the template engine.
+        final_attrs = self.build_attrs(self.attrs, attrs)
+        final_attrs['type'] = self.input_type
+        final_attrs['name'] = name
+        formatted = self.format_value(ad.get('formatted', None))
+        if formatted is not None:
+            final_attrs['value'] = formatted
+        elems = ['<input%s />' % flatatt(final_attrs)]
+
+        # Now add the hidden fields, escaping every value.
+        values = dict((com[0], _escape(ad.get(com[0]))) for com in self.components)
+        values['name'] = _escape(name)
+        elems.append(self.hidden_template() % values)
 
         return mark_safe(unicode('\n'.join(elems)))
 
@@ -90,6 +147,14 @@ class AddressField(forms.ModelChoiceField):
         kwargs['queryset'] = Address.objects.none()
         super(AddressField, self).__init__(*args, **kwargs)
 
+    def prepare_value(self, value):
+
+        # Addresses are rendered from their components, don't reduce them
+        # to primary keys.
+        if isinstance(value, (Address, dict)):
+            return value
+        return super(AddressField, self).prepare_value(value)
+
     def to_python(self, value):
 
         # Treat `None`s and empty strings as empty.
@@ -109,3 +174,26 @@ class AddressField(forms.ModelChoiceField):
                     value[field] = None
 
         return to_python(value)
+
+
+##
+## Replace the primary keys given as the initial values of address fields
+## in `forms` (a formset, say) with their addresses, loaded in one query,
+## so that rendering doesn't need a query per field. `names` limits the
+## fields considered.
+##
+def prefetch_addresses(forms, *names):
+    forms = list(forms)
+    found = []
+    for form in forms:
+        for name, field in form.fields.items():
+            if isinstance(field, AddressField) and (not names or name in names):
+                value = form.get_initial_for_field(field, name)
+                if isinstance(value, (int, long)):
+                    found.append((form, name, value))
+    if found:
+        objs = Address.objects.with_hierarchy().in_bulk(set(v for f, n, v in found))
+        for form, name, value in found:
+            if value in objs:
+                form.initial[name] = objs[value]
+    return forms
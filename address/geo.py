@@ -0,0 +1,95 @@
+import math
+
+__all__ = ['EARTH_RADIUS', 'encode', 'distance', 'bounding_box', 'cover']
+
+EARTH_RADIUS = 6371.0088
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# The largest number of geohash cells used to cover a search area.
+MAX_CELLS = 16
+
+##
+## The geohash of a point, to `precision` characters.
+##
+def encode(latitude, longitude, precision=12):
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    chars = []
+    bit = n = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lng_lo + lng_hi)/2
+            if longitude >= mid:
+                n = n*2 + 1
+                lng_lo = mid
+            else:
+                n *= 2
+                lng_hi = mid
+        else:
+            mid = (lat_lo + lat_hi)/2
+            if latitude >= mid:
+                n = n*2 + 1
+                lat_lo = mid
+            else:
+                n *= 2
+                lat_hi = mid
+        even = not even
+        bit += 1
+        if bit == 5:
+            chars.append(_BASE32[n])
+            bit = n = 0
+    return ''.join(chars)
+
+##
+## The great circle distance between two points, in kilometres.
+##
+def distance(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1)/2)**2 + math.cos(lat1)*math.cos(lat2)*math.sin((lng2 - lng1)/2)**2
+    return 2*EARTH_RADIUS*math.asin(min(1.0, math.sqrt(a)))
+
+##
+## The box around a circle of `km` kilometres, as `(min_lat, min_lng,
+## max_lat, max_lng)`. Longitudes wrap, so `min_lng` may be greater than
+## `max_lng` when the box crosses the antimeridian.
+##
+def bounding_box(latitude, longitude, km):
+    dlat = math.degrees(km/EARTH_RADIUS)
+    min_lat, max_lat = latitude - dlat, latitude + dlat
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90.0), -180.0, min(max_lat, 90.0), 180.0
+    dlng = math.degrees(math.asin(min(1.0, math.sin(km/EARTH_RADIUS)/math.cos(math.radians(latitude)))))
+    if dlng >= 180:
+        return min_lat, -180.0, max_lat, 180.0
+    return min_lat, _wrap(longitude - dlng), max_lat, _wrap(longitude + dlng)
+
+def _wrap(longitude):
+    return (longitude + 180.0)%360.0 - 180.0
+
+def _cell_size(precision):
+    bits = 5*precision
+    return 180.0/2**(bits//2), 360.0/2**((bits + 1)//2)
+
+def _steps(lo, hi, size):
+    count = int(math.ceil((hi - lo)/size)) + 1
+    return [min(lo + ii*size, hi) for ii in range(count)]
+
+##
+## The geohash cells covering a bounding box, at the finest precision
+## needing no more than `max_cells` of them.
+##
+def cover(min_lat, min_lng, max_lat, max_lng, max_cells=MAX_CELLS):
+    width = max_lng - min_lng if max_lng >= min_lng else max_lng - min_lng + 360.0
+    for precision in range(12, 0, -1):
+        height, size = _cell_size(precision)
+        if (int(math.ceil((max_lat - min_lat)/height)) + 1)*(int(math.ceil(width/size)) + 1) <= max_cells:
+            break
+    cells = set()
+    for lat in _steps(min_lat, max_lat, height):
+        for lng in _steps(min_lng, min_lng + width, size):
+            if lng > 180.0:
+                lng -= 360.0
+            cells.add(encode(lat, min(lng, 180.0 - 1e-9), precision))
+    return sorted(cells)
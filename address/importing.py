@@ -0,0 +1,132 @@
+from collections import Counter
+import csv
+import io
+import json
+import time
+
+from django.core.exceptions import ValidationError
+from django.db import transaction, DatabaseError
+
+from .models import bulk_to_python
+
+__all__ = ['COMPONENTS', 'read_rows', 'map_row', 'import_rows']
+
+# The keys understood by `to_python`.
+COMPONENTS = ('raw', 'country', 'country_code', 'state', 'state_code', 'locality', 'sublocality',
+              'postal_code', 'street_number', 'route', 'formatted', 'latitude', 'longitude')
+
+##
+## Stream the rows of a CSV (with a header line) or JSON lines file as
+## dictionaries, one at a time. The format is taken from the file extension
+## unless given.
+##
+def read_rows(path, format=None, encoding='utf-8', delimiter=','):
+    if format is None:
+        format = 'csv' if path.lower().endswith('.csv') else 'jsonl'
+    with io.open(path, encoding=encoding, newline='') as f:
+        if format == 'csv':
+            for row in csv.DictReader(f, delimiter=delimiter):
+                yield row
+        elif format in ('jsonl', 'ndjson', 'json'):
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        yield None
+        else:
+            raise ValueError('Unknown format: %s'%format)
+
+##
+## Map the columns of a row onto address components. `mapping` maps column
+## names to component names; other columns named after a component are
+## used as is, the rest are ignored.
+##
+def map_row(row, mapping=None):
+    if not isinstance(row, dict):
+        raise ValidationError('Invalid row.')
+    mapping = mapping or {}
+    value = {}
+    for column, cell in row.items():
+        name = mapping.get(column, column)
+        if name not in COMPONENTS:
+            continue
+        if cell is None:
+            cell = ''
+        value[name] = cell if isinstance(cell, (int, float)) else '%s'%cell
+    for name in ('latitude', 'longitude'):
+        if value.get(name, '') == '':
+            value[name] = None
+        else:
+            try:
+                value[name] = float(value[name])
+            except ValueError:
+                raise ValidationError('Invalid value for %(field)s', params={'field': name})
+    return value
+
+def _message(e):
+    if isinstance(e, ValidationError):
+        return ' '.join(e.messages)
+    return '%s'%e
+
+def _convert_batch(batch, stats, errors):
+    values = [v for n, v in batch]
+    try:
+        counts = Counter()
+        res = bulk_to_python(values, batch_size=len(values), stats=counts)
+    except (ValueError, ValidationError, DatabaseError):
+
+        # Isolate the failing rows.
+        counts = Counter()
+        res = []
+        for line, value in batch:
+            try:
+                with transaction.atomic():
+                    res.append(bulk_to_python([value], stats=counts)[0])
+            except (ValueError, ValidationError, DatabaseError) as e:
+                errors.append((line, _message(e)))
+    stats.update(counts)
+    stats['skipped'] += sum(1 for r in res if r is None)
+
+##
+## Import rows of address components in batches. `rows` is any iterable of
+## dictionaries, such as `read_rows`. Returns a `Counter` of the rows read,
+## addresses created and reused, and rows skipped or in error, along with a
+## list of `(row number, message)` errors. Progress is written to `stdout`
+## after each batch.
+##
+def import_rows(rows, mapping=None, batch_size=1000, stdout=None):
+    stats = Counter()
+    errors = []
+    batch = []
+    reported = [0]
+    start = time.time()
+
+    def flush():
+        _convert_batch(batch, stats, errors)
+        stats['errors'] = len(errors)
+        if stdout is not None:
+            for line, msg in errors[reported[0]:]:
+                stdout.write('row %d: %s\n'%(line, msg))
+            reported[0] = len(errors)
+            elapsed = time.time() - start
+            stdout.write('%d rows (%.1f rows/sec): %d created, %d reused, %d skipped, %d errors\n'%(
+                stats['rows'], stats['rows']/elapsed if elapsed else 0.0,
+                stats['created'], stats['reused'], stats['skipped'], stats['errors']
+            ))
+        del batch[:]
+
+    for ii, row in enumerate(rows, 1):
+        stats['rows'] += 1
+        try:
+            batch.append((ii, map_row(row, mapping)))
+        except ValidationError as e:
+            errors.append((ii, _message(e)))
+            stats['errors'] = len(errors)
+            continue
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return stats, errors
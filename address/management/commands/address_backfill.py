@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from address.backfill import tasks, get_task, run_backfill
+
+
+class Command(BaseCommand):
+    help = 'Run a backfill task over the address tables in resumable batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('task', nargs='?', help='Name of the task to run.')
+        parser.add_argument('--list', action='store_true', help='List the available tasks.')
+        parser.add_argument('--batch-size', type=int, default=None, help='Rows per batch (transaction).')
+        parser.add_argument('--sleep', type=float, default=0, help='Seconds to sleep between batches.')
+        parser.add_argument('--limit', type=int, default=None, help='Stop after this many rows.')
+        parser.add_argument('--restart', action='store_true', help='Ignore any checkpoint and start over.')
+
+    def handle(self, *args, **options):
+        if options['list'] or not options['task']:
+            for name, cls in tasks.items():
+                self.stdout.write('%s: %s'%(name, cls.help))
+            return
+        try:
+            task = get_task(options['task'])
+        except KeyError as e:
+            raise CommandError(e.args[0])
+        verbose = options['verbosity'] > 0
+        checkpoint = run_backfill(
+            task,
+            batch_size=options['batch_size'],
+            sleep=options['sleep'],
+            restart=options['restart'],
+            limit=options['limit'],
+            stdout=self.stdout if verbose else None,
+        )
+        if checkpoint.finished and verbose:
+            self.stdout.write('%s: finished, %d rows'%(task.name, checkpoint.rows))
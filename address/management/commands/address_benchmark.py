@@ -0,0 +1,41 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils.six.moves import input
+
+from address.benchmarks import resolution
+
+
+class Command(BaseCommand):
+    help = 'Time the address conversion entry points against synthetic data, deleted afterwards.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=int, action='append',
+                            help='Number of addresses to create, may be repeated. By default 10000.')
+        parser.add_argument('--calls', type=int, default=1000, help='Calls timed per entry point.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the sampled addresses.')
+        parser.add_argument('--output', default='-', help='File to write the JSON results to, by default stdout.')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive', default=True,
+                            help='Do not ask for confirmation before writing to the database.')
+
+    def handle(self, *args, **options):
+        scales = options['scale'] or [10000]
+        if options['interactive']:
+            confirm = input('This commits up to %d synthetic addresses to the database "%s" and deletes them '
+                            'afterwards. Use a scratch database.\n'
+                            'Type \'yes\' to continue, or \'no\' to cancel: '%(
+                                max(scales), connection.settings_dict['NAME']))
+            if confirm != 'yes':
+                raise CommandError('Benchmark cancelled.')
+        runs = []
+        for scale in scales:
+            if options['verbosity'] > 1:
+                self.stderr.write('Benchmarking %d addresses'%scale)
+            runs.append(resolution.run(scale, calls=options['calls'], seed=options['seed']))
+        output = json.dumps({'runs': runs}, indent=2, sort_keys=True)
+        if options['output'] == '-':
+            self.stdout.write(output)
+        else:
+            with open(options['output'], 'w') as out:
+                out.write(output + '\n')
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from address.dedupe import LEVELS, dedupe
+
+
+class Command(BaseCommand):
+    help = 'Find and merge duplicate states, localities and addresses.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('levels', nargs='*', metavar='level',
+                            help='Levels to deduplicate, of %s. By default all of them in turn.'%', '.join(LEVELS))
+        parser.add_argument('--threshold', type=float, default=0.9,
+                            help='Similarity, between 0 and 1, above which candidates are merged.')
+        parser.add_argument('--dry-run', action='store_true', help='Report the merges without making them.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows repointed per UPDATE.')
+
+    def handle(self, *args, **options):
+        levels = options['levels'] or list(LEVELS)
+        for name in levels:
+            if name not in LEVELS:
+                raise CommandError('Unknown level "%s", levels are: %s'%(name, ', '.join(LEVELS)))
+        verbosity = options['verbosity']
+        dry_run = options['dry_run']
+        stats = dedupe(
+            levels,
+            threshold=options['threshold'],
+            dry_run=dry_run,
+            batch_size=options['batch_size'],
+            stdout=self.stdout if verbosity > 1 or (dry_run and verbosity > 0) else None,
+        )
+        if verbosity > 0:
+            for name in levels:
+                self.stdout.write('%s: %d %s'%(name, stats[name], 'to merge' if dry_run else 'merged'))
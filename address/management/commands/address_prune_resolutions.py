@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from address.models import prune_resolutions
+
+
+class Command(BaseCommand):
+    help = 'Prune the resolution cache by age and by number of entries.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl', type=int, default=None,
+                            help='Remove entries older than this many seconds, by default '
+                                 'ADDRESS_RESOLUTION_CACHE_TTL.')
+        parser.add_argument('--max-entries', type=int, default=None,
+                            help='Keep at most this many of the most recently used entries, by default '
+                                 'ADDRESS_RESOLUTION_CACHE_MAX_ENTRIES.')
+
+    def handle(self, *args, **options):
+        ttl = options['ttl']
+        if ttl is None:
+            ttl = getattr(settings, 'ADDRESS_RESOLUTION_CACHE_TTL', None)
+        max_entries = options['max_entries']
+        if max_entries is None:
+            max_entries = getattr(settings, 'ADDRESS_RESOLUTION_CACHE_MAX_ENTRIES', None)
+        removed = prune_resolutions(ttl=ttl, max_entries=max_entries)
+        if options['verbosity'] > 0:
+            self.stdout.write('Removed %d entries'%removed)
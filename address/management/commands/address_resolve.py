@@ -0,0 +1,51 @@
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from address.backfill import ResolveTask, run_backfill
+from address.resolvers import get_resolver
+
+
+class Command(BaseCommand):
+    help = 'Resolve the addresses without a locality, in resumable batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--resolver', default=None,
+                            help='Dotted path of the resolver class, by default ADDRESS_RESOLVER.')
+        parser.add_argument('--concurrency', type=int, default=1, help='Lookups in flight at once.')
+        parser.add_argument('--rate', type=float, default=None, help='Maximum lookups per second.')
+        parser.add_argument('--batch-size', type=int, default=None, help='Rows per batch (transaction).')
+        parser.add_argument('--sleep', type=float, default=0, help='Seconds to sleep between batches.')
+        parser.add_argument('--limit', type=int, default=None, help='Stop after this many rows.')
+        parser.add_argument('--restart', action='store_true', help='Ignore any checkpoint and start over.')
+
+    def handle(self, *args, **options):
+        try:
+            if options['resolver']:
+                resolver = import_string(options['resolver'])()
+            else:
+                resolver = get_resolver()
+        except (ImportError, ImproperlyConfigured) as e:
+            raise CommandError(e)
+        if resolver is None:
+            raise CommandError('No resolver configured, set ADDRESS_RESOLVER or use --resolver.')
+        task = ResolveTask(resolver, concurrency=options['concurrency'], rate=options['rate'])
+        verbose = options['verbosity'] > 0
+        start = time.time()
+        checkpoint = run_backfill(
+            task,
+            batch_size=options['batch_size'],
+            sleep=options['sleep'],
+            restart=options['restart'],
+            limit=options['limit'],
+            stdout=self.stdout if verbose else None,
+        )
+        if verbose:
+            elapsed = time.time() - start
+            rows = task.stats['resolved'] + task.stats['unresolved']
+            self.stdout.write('%s %d rows: %d resolved, %d unresolved (%.1f rows/sec)'%(
+                'Finished,' if checkpoint.finished else 'Stopped after', rows,
+                task.stats['resolved'], task.stats['unresolved'], rows/elapsed if elapsed else 0.0
+            ))
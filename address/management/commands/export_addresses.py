@@ -0,0 +1,34 @@
+import io
+
+from django.core.management.base import BaseCommand, CommandError
+
+from address.exporting import WRITERS, export_addresses
+
+
+class Command(BaseCommand):
+    help = 'Export addresses as CSV or JSON lines, streaming them from the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-',
+                            help='File to write, by default standard output.')
+        parser.add_argument('--format', choices=sorted(WRITERS), default=None,
+                            help='Output format, by default taken from the extension or JSON lines.')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Rows fetched from the database at a time.')
+        parser.add_argument('--encoding', default='utf-8')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format']
+        if format is None:
+            format = 'csv' if path.lower().endswith('.csv') else 'jsonl'
+        if path == '-':
+            export_addresses(self.stdout, format=format, chunk_size=options['chunk_size'])
+            return
+        try:
+            with io.open(path, 'w', encoding=options['encoding'], newline='') as f:
+                count = export_addresses(f, format=format, chunk_size=options['chunk_size'])
+        except IOError as e:
+            raise CommandError(e)
+        if options['verbosity'] > 0:
+            self.stdout.write('Exported %d addresses to %s'%(count, path))
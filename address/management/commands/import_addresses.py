@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from address.importing import COMPONENTS, read_rows, import_rows
+
+
+class Command(BaseCommand):
+    help = 'Import addresses from a CSV or JSON lines file, streaming it in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV (with a header line) or JSON lines file.')
+        parser.add_argument('--format', choices=('csv', 'jsonl', 'ndjson'), default=None,
+                            help='File format, by default taken from the extension.')
+        parser.add_argument('--map', action='append', default=[], metavar='COLUMN=COMPONENT',
+                            help='Read an address component from a differently named column.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows resolved per batch.')
+        parser.add_argument('--encoding', default='utf-8')
+        parser.add_argument('--delimiter', default=',', help='CSV delimiter.')
+
+    def handle(self, *args, **options):
+        mapping = {}
+        for item in options['map']:
+            column, sep, name = item.partition('=')
+            if not sep or name not in COMPONENTS:
+                raise CommandError('Invalid mapping "%s", components are: %s'%(item, ', '.join(COMPONENTS)))
+            mapping[column] = name
+        rows = read_rows(options['path'], format=options['format'], encoding=options['encoding'],
+                         delimiter=options['delimiter'])
+        try:
+            stats, errors = import_rows(rows, mapping=mapping, batch_size=options['batch_size'],
+                                        stdout=self.stdout if options['verbosity'] > 0 else None)
+        except (IOError, ValueError) as e:
+            raise CommandError(e)
+        if options['verbosity'] > 0:
+            self.stdout.write('Imported %d rows: %d created, %d reused, %d skipped, %d errors'%(
+                stats['rows'], stats['created'], stats['reused'], stats['skipped'], stats['errors']
+            ))
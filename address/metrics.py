@@ -0,0 +1,216 @@
+from collections import Counter
+from contextlib import contextmanager
+import logging
+import socket
+import threading
+from timeit import default_timer
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+__all__ = ['BaseMetrics', 'NullMetrics', 'LoggingMetrics', 'StatsdMetrics', 'PrometheusMetrics', 'MemoryMetrics',
+           'get_metrics', 'timer']
+
+##
+## Metrics record what converting addresses does. The events emitted are:
+##
+##   hierarchy_cache     counter, tags `level` and `result` (hit or miss)
+##   resolution_cache    counter, tag `result` (hit or miss)
+##   created             counter, tag `level` (country, state, locality or address)
+##   reused              counter, tag `level`
+##   inconsistent_dict   counter, dictionaries converted from their raw value
+##   level_seconds       timing, tag `level`
+##   to_python_seconds   timing of `to_python`
+##
+class BaseMetrics(object):
+
+    def incr(self, name, value=1, **tags):
+        raise NotImplementedError
+
+    def timing(self, name, seconds, **tags):
+        raise NotImplementedError
+
+##
+## Discard every event, with `ADDRESS_METRICS = None`.
+##
+class NullMetrics(BaseMetrics):
+
+    def incr(self, name, value=1, **tags):
+        pass
+
+    def timing(self, name, seconds, **tags):
+        pass
+
+##
+## Log each event to the `address.models` logger, at debug level.
+##
+class LoggingMetrics(BaseMetrics):
+
+    def __init__(self, logger='address.models', level=logging.DEBUG):
+        self.logger = logging.getLogger(logger)
+        self.level = level
+
+    def incr(self, name, value=1, **tags):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, 'metric %s +%s %s', name, value, _format_tags(tags))
+
+    def timing(self, name, seconds, **tags):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, 'metric %s %.3fms %s', name, seconds*1000, _format_tags(tags))
+
+def _format_tags(tags):
+    return ','.join('%s=%s'%(k, tags[k]) for k in sorted(tags))
+
+##
+## Send events as statsd lines, over UDP to `host` and `port`, or to
+## `sink`, a function called with each line, when given. Tag values are
+## appended to the metric name, ordered by tag.
+##
+class StatsdMetrics(BaseMetrics):
+
+    def __init__(self, host='localhost', port=8125, prefix='address', sink=None):
+        self.prefix = prefix
+        self.address = (host, port)
+        self.sink = sink
+        self._socket = None
+
+    def _name(self, name, tags):
+        return '.'.join([p for p in (self.prefix, name) if p] + ['%s'%tags[k] for k in sorted(tags)])
+
+    def send(self, line):
+        if self.sink is not None:
+            self.sink(line)
+            return
+        if self._socket is None:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self._socket.sendto(line.encode('utf-8'), self.address)
+        except socket.error:
+            pass
+
+    def incr(self, name, value=1, **tags):
+        self.send('%s:%s|c'%(self._name(name, tags), value))
+
+    def timing(self, name, seconds, **tags):
+        self.send('%s:%.3f|ms'%(self._name(name, tags), seconds*1000))
+
+##
+## Accumulate counters and histograms in memory, rendered in the
+## Prometheus text format by `render`, e.g. from a view.
+##
+class PrometheusMetrics(BaseMetrics):
+    buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    def __init__(self, prefix='address', buckets=None):
+        self.prefix = prefix
+        if buckets is not None:
+            self.buckets = tuple(sorted(buckets))
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def _key(self, name, tags):
+        return ('%s_%s'%(self.prefix, name) if self.prefix else name, tuple(sorted(tags.items())))
+
+    def incr(self, name, value=1, **tags):
+        key = self._key(name, tags)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def timing(self, name, seconds, **tags):
+        key = self._key(name, tags)
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = [[0]*len(self.buckets), 0, 0.0]
+            for ii, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    hist[0][ii] += 1
+            hist[1] += 1
+            hist[2] += seconds
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name in sorted(set(n for n, t in self.counters)):
+                lines.append('# TYPE %s_total counter'%name)
+                for key in sorted(k for k in self.counters if k[0] == name):
+                    lines.append('%s_total%s %s'%(name, _labels(key[1]), self.counters[key]))
+            for name in sorted(set(n for n, t in self.histograms)):
+                lines.append('# TYPE %s histogram'%name)
+                for key in sorted(k for k in self.histograms if k[0] == name):
+                    counts, count, total = self.histograms[key]
+                    for bound, n in zip(self.buckets, counts):
+                        lines.append('%s_bucket%s %d'%(name, _labels(key[1] + (('le', repr(bound)),)), n))
+                    lines.append('%s_bucket%s %d'%(name, _labels(key[1] + (('le', '+Inf'),)), count))
+                    lines.append('%s_sum%s %r'%(name, _labels(key[1]), total))
+                    lines.append('%s_count%s %d'%(name, _labels(key[1]), count))
+        return '\n'.join(lines) + '\n' if lines else ''
+
+def _labels(tags):
+    if not tags:
+        return ''
+    return '{%s}'%','.join('%s="%s"'%(k, ('%s'%v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in tags)
+
+##
+## Keep every event, for tests. `counters` sums the counters by name and
+## sorted tags.
+##
+class MemoryMetrics(BaseMetrics):
+
+    def __init__(self):
+        self.events = []
+        self.counters = Counter()
+
+    def incr(self, name, value=1, **tags):
+        self.events.append(('incr', name, value, tags))
+        self.counters[(name,) + tuple(sorted(tags.items()))] += value
+
+    def timing(self, name, seconds, **tags):
+        self.events.append(('timing', name, seconds, tags))
+
+    def count(self, name, **tags):
+        return self.counters[(name,) + tuple(sorted(tags.items()))]
+
+_metrics = {}
+_lock = threading.Lock()
+
+##
+## The metrics backend configured by the `ADDRESS_METRICS` setting, a
+## dotted path to a `BaseMetrics` subclass instantiated with
+## `ADDRESS_METRICS_OPTIONS`, or an instance. Defaults to `LoggingMetrics`.
+##
+def get_metrics():
+    try:
+        return _metrics['default']
+    except KeyError:
+        pass
+    with _lock:
+        if 'default' not in _metrics:
+            backend = getattr(settings, 'ADDRESS_METRICS', 'address.metrics.LoggingMetrics')
+            if backend is None:
+                backend = NullMetrics()
+            elif not isinstance(backend, BaseMetrics):
+                try:
+                    cls = import_string(backend)
+                except ImportError as e:
+                    raise ImproperlyConfigured('Invalid ADDRESS_METRICS: %s'%e)
+                backend = cls(**getattr(settings, 'ADDRESS_METRICS_OPTIONS', {}))
+            _metrics['default'] = backend
+        return _metrics['default']
+
+##
+## Time the block as `name`.
+##
+@contextmanager
+def timer(name, **tags):
+    start = default_timer()
+    try:
+        yield
+    finally:
+        get_metrics().timing(name, default_timer() - start, **tags)
+
+def setting_changed(setting, **kwargs):
+    if setting in ('ADDRESS_METRICS', 'ADDRESS_METRICS_OPTIONS'):
+        _metrics.clear()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+import re
+import unicodedata
+
+from django.db import models, migrations, transaction
+from django.utils.encoding import force_bytes, force_text
+
+CHUNK_SIZE = 2000
+
+ABBREVIATIONS = {
+    'st': 'street', 'rd': 'road', 'ave': 'avenue', 'av': 'avenue', 'blvd': 'boulevard',
+    'dr': 'drive', 'ln': 'lane', 'ct': 'court', 'pl': 'place', 'sq': 'square',
+    'hwy': 'highway', 'pkwy': 'parkway', 'fwy': 'freeway', 'cres': 'crescent',
+    'cct': 'circuit', 'cir': 'circle', 'tce': 'terrace', 'ter': 'terrace', 'pde': 'parade',
+    'esp': 'esplanade', 'cl': 'close', 'gr': 'grove', 'gdns': 'gardens', 'mt': 'mount',
+    'apt': 'apartment', 'ste': 'suite', 'fl': 'floor', 'bldg': 'building',
+    'n': 'north', 's': 'south', 'e': 'east', 'w': 'west',
+    'ne': 'northeast', 'nw': 'northwest', 'se': 'southeast', 'sw': 'southwest',
+}
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+_COMBINING = re.compile('[\u0300-\u036f]')
+_FOLDS = {0xdf: 'ss', 0x1e9e: 'ss', 0x3c2: '\u03c3'}
+
+
+def normalize(value):
+    value = unicodedata.normalize('NFKC', force_text(value)).lower().translate(_FOLDS)
+    try:
+        value.encode('ascii')
+    except UnicodeEncodeError:
+        value = _COMBINING.sub('', unicodedata.normalize('NFKD', value))
+    return ' '.join(ABBREVIATIONS.get(t, t) for t in _TOKEN.findall(value))
+
+
+def make_dedupe_key(street_number, route, locality_id, raw):
+    """
+    The key as defined when this migration was written, frozen here with
+    `address.normalize.normalize` so the migration doesn't change with
+    `address.models.make_dedupe_key`. Keys from later definitions are
+    applied with `address_backfill dedupe_key`.
+    """
+    if street_number or route or locality_id:
+        parts = ('c', normalize(street_number), normalize(route), locality_id or '')
+    else:
+        parts = ('r', normalize(raw))
+    return hashlib.sha1(force_bytes('\x1f'.join('%s'%p for p in parts))).hexdigest()
+
+
+def backfill_dedupe_key(apps, schema_editor):
+    """
+    Key the existing addresses in primary key order, one chunk per
+    transaction. Where there are duplicates only the first address is keyed.
+    """
+    Address = apps.get_model('address', 'Address')
+    db = schema_editor.connection.alias
+    qs = Address.objects.using(db).filter(dedupe_key__isnull=True).order_by('pk')
+    last = 0
+    while True:
+        rows = list(qs.filter(pk__gt=last).values_list('pk', 'street_number', 'route', 'locality_id', 'raw')[:CHUNK_SIZE])
+        if not rows:
+            break
+        last = rows[-1][0]
+        keys = {}
+        for pk, street_number, route, locality_id, raw in rows:
+            keys.setdefault(make_dedupe_key(street_number, route, locality_id, raw), pk)
+        with transaction.atomic(using=db):
+            taken = set(Address.objects.using(db).filter(dedupe_key__in=list(keys)).values_list('dedupe_key', flat=True))
+            todo = dict((pk, key) for key, pk in keys.items() if key not in taken)
+            if todo:
+                Address.objects.using(db).filter(pk__in=list(todo)).update(dedupe_key=models.Case(
+                    *[models.When(pk=pk, then=models.Value(key)) for pk, key in todo.items()],
+                    output_field=models.CharField()
+                ))
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('address', '0002_auto_20160213_1726'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='address',
+            name='dedupe_key',
+            field=models.CharField(max_length=40, unique=True, null=True, blank=True, editable=False),
+        ),
+        migrations.RunPython(backfill_dedupe_key, migrations.RunPython.noop),
+    ]
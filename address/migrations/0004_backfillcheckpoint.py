@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('address', '0003_address_dedupe_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackfillCheckpoint',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('task', models.CharField(unique=True, max_length=100)),
+                ('last_pk', models.BigIntegerField(default=0)),
+                ('rows', models.BigIntegerField(default=0)),
+                ('started', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('finished', models.DateTimeField(null=True, blank=True)),
+            ],
+        ),
+    ]
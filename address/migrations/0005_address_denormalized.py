@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('address', '0004_backfillcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='address',
+            name='locality_name',
+            field=models.CharField(max_length=165, null=True, blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='address',
+            name='postal_code',
+            field=models.CharField(max_length=10, null=True, blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='address',
+            name='state_name',
+            field=models.CharField(max_length=165, null=True, blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='address',
+            name='state_code',
+            field=models.CharField(max_length=3, null=True, blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='address',
+            name='country_name',
+            field=models.CharField(max_length=40, null=True, blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='address',
+            name='country_code',
+            field=models.CharField(max_length=2, null=True, blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='address',
+            name='display',
+            field=models.TextField(null=True, blank=True, editable=False),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('address', '0005_address_denormalized'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResolvedRaw',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('key', models.CharField(unique=True, max_length=40)),
+                ('raw', models.TextField()),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_used', models.DateTimeField(default=django.utils.timezone.now, db_index=True)),
+                ('address', models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.CASCADE, to='address.Address')),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('address', '0007_address_geohash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='locality',
+            name='name_key',
+            field=models.CharField(max_length=165, null=True, blank=True, editable=False, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='locality',
+            name='postal_code_key',
+            field=models.CharField(max_length=10, null=True, blank=True, editable=False, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='address',
+            name='route_key',
+            field=models.CharField(max_length=100, null=True, blank=True, editable=False, db_index=True),
+        ),
+    ]
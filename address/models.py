@@ -1,13 +1,29 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction, connections, router, IntegrityError
+from django.db.models import Q, F, Case, When, Value, signals
+from django.db.models.functions import Concat
 from django.core.exceptions import ValidationError
 from django.db.models.fields.related import ForeignObject
 try:
     from django.db.models.fields.related_descriptors import ForwardManyToOneDescriptor
 except ImportError:
     from django.db.models.fields.related import ReverseSingleRelatedObjectDescriptor as ForwardManyToOneDescriptor
-from django.utils.encoding import python_2_unicode_compatible
+from django.utils import timezone
+from django.utils import six
+from django.utils.encoding import python_2_unicode_compatible, force_bytes
+from .cache import hierarchy_cache
+from .metrics import get_metrics, timer
+from . import geo
+from .normalize import normalize, prefix_key
+from .resolvers import get_resolver
 
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timedelta
+import hashlib
 import logging
+import math
+import threading
 logger = logging.getLogger(__name__)
 
 # Python 3 fixes.
@@ -17,100 +33,313 @@ if sys.version > '3':
     basestring = (str, bytes)
     unicode = str
 
-__all__ = ['Country', 'State', 'Locality', 'Address', 'AddressField']
+__all__ = ['Country', 'State', 'Locality', 'Address', 'AddressField', 'AddressAwareQuerySet', 'AddressAwareManager']
 
 class InconsistentDictError(Exception):
     pass
 
-def _to_python(value):
-    raw = value.get('raw', '')
-    country = value.get('country', '')
-    country_code = value.get('country_code', '')
-    state = value.get('state', '')
-    state_code = value.get('state_code', '')
-    locality = value.get('locality', '')
-    sublocality = value.get('sublocality', '')
-    postal_code = value.get('postal_code', '')
-    street_number = value.get('street_number', '')
-    route = value.get('route', '')
-    formatted = value.get('formatted', '')
-    latitude = value.get('latitude', None)
-    longitude = value.get('longitude', None)
+_COMPONENTS = ('raw', 'country', 'country_code', 'state', 'state_code', 'locality',
+               'postal_code', 'street_number', 'route', 'formatted', 'latitude', 'longitude')
+
+##
+## Extract the address components from a dictionary. Returns `None` if
+## there is no raw value.
+##
+def _components(value):
+    cmps = dict((k, value.get(k, '')) for k in _COMPONENTS)
+    cmps['latitude'] = value.get('latitude', None)
+    cmps['longitude'] = value.get('longitude', None)
 
     # If there is no value (empty raw) then return None.
-    if not raw:
+    if not cmps['raw']:
         return None
 
     # Fix issue with NYC boroughs (https://code.google.com/p/gmaps-api-issues/issues/detail?id=635)
-    if not locality and sublocality:
-        locality = sublocality
+    if not cmps['locality'] and value.get('sublocality', ''):
+        cmps['locality'] = value['sublocality']
 
     # If we have an inconsistent set of value bail out now.
-    if (country or state or locality) and not (country and state and locality):
+    if (cmps['country'] or cmps['state'] or cmps['locality']) and \
+       not (cmps['country'] and cmps['state'] and cmps['locality']):
         raise InconsistentDictError
 
-    # Handle the country.
+    return cmps
+
+##
+## Resolve raw strings to address components with the configured resolver.
+## Returns a list with a dictionary of components, or `None` where the
+## string couldn't be resolved consistently.
+##
+def _resolve_many(raws):
+    resolver = get_resolver()
+    if resolver is None or not raws:
+        return [None]*len(raws)
+    res = []
+    for raw, value in zip(raws, resolver.resolve_many(raws)):
+        if value:
+            value = dict(value, raw=raw)
+            try:
+                _components(value)
+            except InconsistentDictError:
+                value = None
+        res.append(value or None)
+    return res
+
+def _resolve(raw):
+    return _resolve_many([raw])[0]
+
+def _valid_code(model, code, name, label):
+    if len(code) > model._meta.get_field('code').max_length:
+        if code != name:
+            raise ValueError('Invalid %s code (too long): %s'%(label, code))
+        code = ''
+    return code
+
+def _pk(obj):
+    return obj.pk if obj is not None else None
+
+##
+## A unit of work is a transaction in which addresses are converted and
+## committed once, at the end, rather than a commit per row inserted.
+## Units nest, the inner ones using savepoints. A `lazy` unit only starts
+## its transaction when `_begin` is called before a first write, so
+## conversions that find everything they need don't open one.
+##
+## The hierarchy cache only takes rows once they're committed, so the rows
+## found or created in a unit are remembered by the unit until then, and
+## forgotten if it rolls back.
+##
+_units = threading.local()
+
+class _Unit(object):
+
+    def __init__(self, using):
+        self.using = using
+        self.atomic = None
+        self.rows = {}
+
+@contextmanager
+def unit_of_work(using=None, lazy=False):
+    stack = getattr(_units, 'stack', None)
+    if stack is None:
+        stack = _units.stack = []
+    unit = _Unit(using)
+    stack.append(unit)
     try:
-        country_obj = Country.objects.get(name=country)
-    except Country.DoesNotExist:
-        if country:
-            if len(country_code) > Country._meta.get_field('code').max_length:
-                if country_code != country:
-                    raise ValueError('Invalid country code (too long): %s'%country_code)
-                country_code = ''
-            country_obj = Country.objects.create(name=country, code=country_code)
-        else:
-            country_obj = None
+        if not lazy:
+            _begin()
+        yield
+    except:
+        exc_info = sys.exc_info()
+        stack.pop()
+        if unit.atomic is not None:
+            unit.atomic.__exit__(*exc_info)
+        six.reraise(*exc_info)
+    stack.pop()
+    if unit.atomic is not None:
+        unit.atomic.__exit__(None, None, None)
+    if stack:
+        stack[-1].rows.update(unit.rows)
+
+def _begin():
+    for unit in getattr(_units, 'stack', ()):
+        if unit.atomic is None:
+            unit.atomic = transaction.atomic(using=unit.using)
+            unit.atomic.__enter__()
+
+def _unit_get(model, key):
+    for unit in reversed(getattr(_units, 'stack', ())):
+        obj = unit.rows.get((model, key))
+        if obj is not None:
+            return obj
+    return None
+
+def _cache_set(model, key, obj):
+    stack = getattr(_units, 'stack', None)
+    if stack:
+        stack[-1].rows[(model, key)] = obj
+    hierarchy_cache.set(model, key, obj)
+
+##
+## Get a hierarchy object by its natural key, trying the cache first. Raises
+## `DoesNotExist` as per `get`. The parent given in `kwargs` is attached to
+## the object, so walking up the hierarchy sees the rows just looked up.
+##
+def _cached_get(model, key, **kwargs):
+
+    # States and localities can't exist without their parent.
+    if model is not Country and key[-1] is None:
+        raise model.DoesNotExist
+    metrics = get_metrics()
+    level = model._meta.model_name
+    obj = _unit_get(model, key) or hierarchy_cache.get(model, key)
+    if obj is None:
+        metrics.incr('hierarchy_cache', level=level, result='miss')
+        obj = model.objects.get(**kwargs)
+        _cache_set(model, key, obj)
+    else:
+        metrics.incr('hierarchy_cache', level=level, result='hit')
+    for name, value in kwargs.items():
+        if isinstance(value, models.Model):
+            setattr(obj, name, value)
+    metrics.incr('reused', level=level)
+    return obj
+
+##
+## Insert a hierarchy row, or fetch the existing one if a concurrent request
+## beat us to it, using the natural key `fields` for the lookup. PostgreSQL
+## does this with a single statement; elsewhere a savepoint guards the
+## insert so the surrounding transaction survives the conflict.
+##
+def _create_or_get(obj, fields):
+    _begin()
+    model = type(obj)
+    db = router.db_for_write(model, instance=obj)
+    connection = connections[db]
+    if connection.vendor == 'postgresql' and getattr(connection, 'pg_version', 0) >= 90500:
+        if _insert_on_conflict(obj, connection):
+            return obj, True
+    else:
+        try:
+            with transaction.atomic(using=db):
+                obj.save(using=db, force_insert=True)
+            return obj, True
+        except IntegrityError:
+            pass
+    return model.objects.using(db).get(**dict((f, getattr(obj, f)) for f in fields)), False
+
+def _insert_on_conflict(obj, connection):
+    model = type(obj)
+    opts = model._meta
+    qn = connection.ops.quote_name
+    fields = [f for f in opts.concrete_fields if not f.primary_key]
+    sql = 'INSERT INTO %s (%s) VALUES (%s) ON CONFLICT DO NOTHING RETURNING %s'%(
+        qn(opts.db_table),
+        ', '.join(qn(f.column) for f in fields),
+        ', '.join(['%s']*len(fields)),
+        qn(opts.pk.column),
+    )
+    params = [f.get_db_prep_save(f.pre_save(obj, True), connection) for f in fields]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+    if row is None:
+        return False
+    obj.pk = row[0]
+    obj._state.adding = False
+    obj._state.db = connection.alias
+    signals.post_save.send(sender=model, instance=obj, created=True, update_fields=None,
+                           raw=False, using=connection.alias)
+    return True
+
+def _cached_create(obj, fields):
+    obj, created = _create_or_get(obj, fields)
+    get_metrics().incr('created' if created else 'reused', level=obj._meta.model_name)
+    _cache_set(type(obj), tuple(getattr(obj, f) for f in fields), obj)
+    return obj
+
+##
+## The key identifying an address: a hash of its normalized street
+## components and locality or, when there are none, of the normalized raw
+## value. Word order is kept, so "Unit 3, 12 Main St" and "Unit 12, 3 Main
+## St" aren't the same address. Abbreviations are expanded with the tables
+## common to all countries, so keys don't change with the hierarchy.
+##
+def make_dedupe_key(street_number, route, locality_id, raw):
+    if street_number or route or locality_id:
+        parts = ('c', normalize(street_number), normalize(route), locality_id or '')
+    else:
+        parts = ('r', normalize(raw))
+    return hashlib.sha1(force_bytes('\x1f'.join('%s'%p for p in parts))).hexdigest()
+
+##
+## The geohash stored for a point, or `None` without one.
+##
+def make_geohash(latitude, longitude):
+    if latitude is None or longitude is None:
+        return None
+    return geo.encode(latitude, longitude)
+
+def _to_python(value):
+    cmps = _components(value)
+    if cmps is None:
+        return None
+    raw = cmps['raw']
+    country = cmps['country']
+    country_code = cmps['country_code']
+    state = cmps['state']
+    state_code = cmps['state_code']
+    locality = cmps['locality']
+    postal_code = cmps['postal_code']
+    street_number = cmps['street_number']
+    route = cmps['route']
+    formatted = cmps['formatted']
+    latitude = cmps['latitude']
+    longitude = cmps['longitude']
+
+    # Handle the country.
+    with timer('level_seconds', level='country'):
+        try:
+            country_obj = _cached_get(Country, (country,), name=country)
+        except Country.DoesNotExist:
+            if country:
+                country_code = _valid_code(Country, country_code, country, 'country')
+                country_obj = _cached_create(Country(name=country, code=country_code), ('name',))
+            else:
+                country_obj = None
 
     # Handle the state.
-    try:
-        state_obj = State.objects.get(name=state, country=country_obj)
-    except State.DoesNotExist:
-        if state:
-            if len(state_code) > State._meta.get_field('code').max_length:
-                if state_code != state:
-                    raise ValueError('Invalid state code (too long): %s'%state_code)
-                state_code = ''
-            state_obj = State.objects.create(name=state, code=state_code, country=country_obj)
-        else:
-            state_obj = None
+    with timer('level_seconds', level='state'):
+        try:
+            state_obj = _cached_get(State, (state, _pk(country_obj)), name=state, country=country_obj)
+        except State.DoesNotExist:
+            if state:
+                state_code = _valid_code(State, state_code, state, 'state')
+                state_obj = _cached_create(State(name=state, code=state_code, country=country_obj),
+                                           ('name', 'country_id'))
+            else:
+                state_obj = None
 
     # Handle the locality.
-    try:
-        locality_obj = Locality.objects.get(name=locality, postal_code=postal_code, state=state_obj)
-    except Locality.DoesNotExist:
-        if locality:
-            locality_obj = Locality.objects.create(name=locality, postal_code=postal_code, state=state_obj)
-        else:
-            locality_obj = None
+    with timer('level_seconds', level='locality'):
+        try:
+            locality_obj = _cached_get(Locality, (locality, postal_code, _pk(state_obj)),
+                                       name=locality, postal_code=postal_code, state=state_obj)
+        except Locality.DoesNotExist:
+            if locality:
+                locality_obj = Locality(name=locality, postal_code=postal_code, state=state_obj)
+                locality_obj.denormalize()
+                locality_obj = _cached_create(locality_obj, ('name', 'postal_code', 'state_id'))
+            else:
+                locality_obj = None
 
-    # Handle the address.
-    try:
-        if not (street_number or route or locality):
-            address_obj = Address.objects.get(raw=raw)
-        else:
-            address_obj = Address.objects.get(
+    # Handle the address, found by its components or, when there are none,
+    # by the raw value.
+    with timer('level_seconds', level='address'):
+        key = make_dedupe_key(street_number, route, _pk(locality_obj), raw)
+        try:
+            address_obj = Address.objects.get(dedupe_key=key)
+            created = False
+        except Address.DoesNotExist:
+            address_obj = Address(
                 street_number=street_number,
                 route=route,
-                locality=locality_obj
+                raw=raw,
+                locality=locality_obj,
+                formatted=formatted,
+                latitude=latitude,
+                longitude=longitude,
+                dedupe_key=key,
             )
-    except Address.DoesNotExist:
-        address_obj = Address(
-            street_number=street_number,
-            route=route,
-            raw=raw,
-            locality=locality_obj,
-            formatted=formatted,
-            latitude=latitude,
-            longitude=longitude,
-        )
 
-        # If "formatted" is empty try to construct it from other values.
-        if not address_obj.formatted:
-            address_obj.formatted = unicode(address_obj)
+            # If "formatted" is empty try to construct it from other values.
+            if not address_obj.formatted:
+                address_obj.formatted = unicode(address_obj)
+            address_obj.denormalize()
 
-        # Need to save.
-        address_obj.save()
+            # Need to save.
+            address_obj, created = _create_or_get(address_obj, ('dedupe_key',))
+        get_metrics().incr('created' if created else 'reused', level='address')
 
     # Done.
     return address_obj
@@ -133,8 +362,28 @@ def to_python(value):
     elif isinstance(value, (int, long)):
         return value
 
-    # A string is considered a raw value.
-    elif isinstance(value, basestring):
+    # Strings and dictionaries, looking them up in the resolution cache
+    # first. All the rows needed are written in one transaction.
+    elif isinstance(value, (basestring, dict)):
+        with timer('to_python_seconds'), unit_of_work(router.db_for_write(Address), lazy=True):
+            obj = _cached_resolution(value)
+            if obj is None:
+                obj = _convert(value)
+                _remember_resolution(value, obj)
+        return obj
+
+    # Not in any of the formats I recognise.
+    raise ValidationError('Invalid address value.')
+
+def _convert(value):
+
+    # A string is considered a raw value, unless a resolver can make
+    # sense of it.
+    if isinstance(value, basestring):
+        resolved = _resolve(value)
+        if resolved is not None:
+            return _to_python(resolved)
+        _begin()
         obj = Address(raw=value)
         obj.save()
         return obj
@@ -142,23 +391,449 @@ def to_python(value):
     # A dictionary of named address components.
     elif isinstance(value, dict):
 
-        # Attempt a conversion.
+        # Attempt a conversion, resolving the raw value if there's no
+        # locality.
         try:
+            cmps = _components(value)
+            if cmps is not None and not cmps['locality']:
+                resolved = _resolve(cmps['raw'])
+                if resolved is not None:
+                    return _to_python(resolved)
             return _to_python(value)
         except InconsistentDictError:
+            get_metrics().incr('inconsistent_dict')
+            resolved = _resolve(value['raw'])
+            if resolved is not None:
+                return _to_python(resolved)
+            _begin()
             return Address.objects.create(raw=value['raw'])
 
-    # Not in any of the formats I recognise.
-    raise ValidationError('Invalid address value.')
+##
+## The resolution cache maps normalized raw values to the addresses they
+## were converted to, see `ResolvedRaw`. Dictionaries with components are
+## keyed by their components too, so they never get the address of a bare
+## raw value. It's off unless the `ADDRESS_RESOLUTION_CACHE` setting is
+## set. Hits and misses are counted in `resolution_stats`.
+##
+resolution_stats = Counter()
+
+_KEYED_COMPONENTS = ('street_number', 'route', 'locality', 'sublocality', 'postal_code',
+                     'state', 'state_code', 'country', 'country_code')
+
+def _raw(value):
+    return value if isinstance(value, basestring) else value.get('raw')
+
+def _resolution_key(value):
+    if isinstance(value, dict):
+        cmps = [normalize(value.get(k) or '') for k in _KEYED_COMPONENTS]
+        if any(cmps):
+            parts = ['d', normalize(value.get('raw') or '')] + cmps
+            return hashlib.sha1(force_bytes('\x1f'.join(parts))).hexdigest()
+        value = value.get('raw') or ''
+    return hashlib.sha1(force_bytes(normalize(value))).hexdigest()
+
+def _cached_resolution(value):
+    if not _raw(value) or not getattr(settings, 'ADDRESS_RESOLUTION_CACHE', False):
+        return None
+    try:
+        entry = ResolvedRaw.objects.select_related('address').get(key=_resolution_key(value))
+    except ResolvedRaw.DoesNotExist:
+        resolution_stats['misses'] += 1
+        get_metrics().incr('resolution_cache', result='miss')
+        return None
+    now = timezone.now()
+    ttl = getattr(settings, 'ADDRESS_RESOLUTION_CACHE_TTL', None)
+    if ttl is not None and entry.created < now - timedelta(seconds=ttl):
+        entry.delete()
+        resolution_stats['misses'] += 1
+        get_metrics().incr('resolution_cache', result='miss')
+        return None
+    ResolvedRaw.objects.filter(pk=entry.pk).update(hits=F('hits') + 1, last_used=now)
+    resolution_stats['hits'] += 1
+    get_metrics().incr('resolution_cache', result='hit')
+    return entry.address
+
+def _remember_resolution(value, address):
+    raw = _raw(value)
+    if not raw or address is None or not getattr(settings, 'ADDRESS_RESOLUTION_CACHE', False):
+        return
+    _create_or_get(ResolvedRaw(key=_resolution_key(value), raw=raw, address=address), ('key',))
+
+##
+## Prune the resolution cache, removing the entries created more than `ttl`
+## seconds ago and all but the `max_entries` most recently used. Returns the
+## number of entries removed.
+##
+def prune_resolutions(ttl=None, max_entries=None):
+    removed = 0
+    if ttl is not None:
+        removed += ResolvedRaw.objects.filter(created__lt=timezone.now() - timedelta(seconds=ttl)).delete()[0]
+    if max_entries is not None:
+        last = ResolvedRaw.objects.order_by('-last_used', '-pk').values_list('last_used', 'pk')[max_entries:max_entries + 1]
+        for last_used, pk in last:
+            removed += ResolvedRaw.objects.filter(Q(last_used__lt=last_used) |
+                                                  Q(last_used=last_used, pk__lte=pk)).delete()[0]
+    return removed
+
+##
+## Fetch the rows of `model` matching any of `keys`, where each key is a
+## tuple of values for `fields`. A single `IN` query is issued and the exact
+## matching is done here. Where there are several matches the lowest
+## primary key wins.
+##
+def _bulk_fetch(model, fields, keys, qs=None):
+    found = {}
+    if not keys:
+        return found
+    if qs is None:
+        qs = model.objects.all()
+    for ii, f in enumerate(fields):
+        vals = set(k[ii] for k in keys)
+        if None in vals:
+            vals.discard(None)
+            qs = qs.filter(Q(**{'%s__in'%f: vals}) | Q(**{'%s__isnull'%f: True}))
+        else:
+            qs = qs.filter(**{'%s__in'%f: vals})
+    for obj in qs.order_by('-pk'):
+        key = tuple(getattr(obj, f) for f in fields)
+        if key in keys:
+            found[key] = obj
+    return found
+
+##
+## As `_bulk_fetch`, inserting the missing rows found in `new` (a map from
+## key to unsaved instance) with `bulk_create`. Returns the rows found and
+## the set of keys inserted. As `bulk_create` sends no signals, `post_save`
+## is sent for each hierarchy row inserted, keeping the caches and indexes
+## listening for saves up to date.
+##
+def _bulk_get_or_create(model, fields, keys, new, qs=None):
+    found = _bulk_fetch(model, fields, keys, qs)
+    missing = [k for k in keys if k not in found and k in new]
+    created = set()
+    if missing:
+        try:
+            with transaction.atomic():
+                model.objects.bulk_create([new[k] for k in missing])
+        except IntegrityError:
+
+            # Lost a race with a concurrent insert, go row by row.
+            for k in missing:
+                found[k], was_created = _create_or_get(new[k], fields)
+                if was_created:
+                    created.add(k)
+        else:
+            found.update(_bulk_fetch(model, fields, set(missing), qs))
+            created.update(missing)
+            if issubclass(model, HierarchyModel):
+                db = router.db_for_write(model)
+                for k in missing:
+                    signals.post_save.send(sender=model, instance=found[k], created=True, update_fields=None,
+                                           raw=False, using=db)
+    return found, created
+
+##
+## Insert addresses that are never shared (raw strings). Backends unable to
+## return primary keys from a bulk insert need a save per object.
+##
+def _bulk_insert(objs):
+    if not objs:
+        return
+    connection = connections[router.db_for_write(Address)]
+    if getattr(connection.features, 'can_return_ids_from_bulk_insert', False):
+        for obj in objs:
+            obj.denormalize()
+        Address.objects.bulk_create(objs)
+    else:
+        for obj in objs:
+            obj.save()
+
+##
+## Resolve the country/state/locality hierarchy of parsed components, a
+## list of `(index, components)`, creating what's missing. Returns the
+## localities by index.
+##
+def _bulk_localities(parsed):
+    # Countries. As with `_to_python` the first value seen for a new
+    # country or state decides its code.
+    keys, new = {}, {}
+    for ii, c in parsed:
+        key = keys[ii] = (c['country'],)
+        if c['country'] and key not in new:
+            code = _valid_code(Country, c['country_code'], c['country'], 'country')
+            new[key] = Country(name=c['country'], code=code)
+    countries, created = _bulk_get_or_create(Country, ('name',), set(keys.values()), new)
+    parents = dict((ii, countries.get(k)) for ii, k in keys.items())
+
+    # States.
+    keys, new = {}, {}
+    for ii, c in parsed:
+        if parents.get(ii) is None:
+            continue
+        key = keys[ii] = (c['state'], parents[ii].pk)
+        if c['state'] and key not in new:
+            code = _valid_code(State, c['state_code'], c['state'], 'state')
+            new[key] = State(name=c['state'], code=code, country=parents[ii])
+    states, created = _bulk_get_or_create(State, ('name', 'country_id'), set(keys.values()), new,
+                                 State.objects.with_hierarchy())
+    parents = dict((ii, states.get(k)) for ii, k in keys.items())
+
+    # Localities.
+    keys, new = {}, {}
+    for ii, c in parsed:
+        if parents.get(ii) is None:
+            continue
+        key = keys[ii] = (c['locality'], c['postal_code'], parents[ii].pk)
+        if c['locality'] and key not in new:
+            new[key] = Locality(name=c['locality'], postal_code=c['postal_code'], state=parents[ii])
+            new[key].denormalize()
+    localities, created = _bulk_get_or_create(Locality, ('name', 'postal_code', 'state_id'), set(keys.values()), new,
+                                     Locality.objects.with_hierarchy())
+    parents = dict((ii, localities.get(k)) for ii, k in keys.items())
+    return parents
+
+def _bulk_to_python(values, stats=None):
+    results = [None]*len(values)
+    parsed = []
+    fresh = []
+    unresolved = []
+
+    # Sort the values into those we can answer directly, raw strings that
+    # always get a new address, and dictionaries needing resolution.
+    for ii, value in enumerate(values):
+        if value is None:
+            continue
+        elif isinstance(value, (Address, int, long)):
+            results[ii] = value
+        elif isinstance(value, basestring):
+            unresolved.append((ii, value, None))
+        elif isinstance(value, dict):
+            try:
+                cmps = _components(value)
+            except InconsistentDictError:
+                get_metrics().incr('inconsistent_dict')
+                unresolved.append((ii, value['raw'], None))
+            else:
+                if cmps is None:
+                    continue
+                elif not cmps['locality']:
+                    unresolved.append((ii, cmps['raw'], cmps))
+                else:
+                    parsed.append((ii, cmps))
+        else:
+            raise ValidationError('Invalid address value.')
+
+    # Resolve the raw values without a locality in one go where possible.
+    resolved = _resolve_many([raw for ii, raw, cmps in unresolved])
+    for (ii, raw, cmps), value in zip(unresolved, resolved):
+        if value is not None:
+            parsed.append((ii, _components(value)))
+        elif cmps is not None:
+            parsed.append((ii, cmps))
+        else:
+            results[ii] = Address(raw=raw)
+            fresh.append(results[ii])
+    parsed.sort(key=lambda p: p[0])
+
+    parents = _bulk_localities(parsed)
+
+    # Addresses.
+    keys, new = {}, {}
+    for ii, c in parsed:
+        locality_obj = parents.get(ii)
+        key = keys[ii] = (make_dedupe_key(c['street_number'], c['route'], _pk(locality_obj), c['raw']),)
+        if key not in new:
+            obj = Address(
+                street_number=c['street_number'],
+                route=c['route'],
+                raw=c['raw'],
+                locality=locality_obj,
+                formatted=c['formatted'],
+                latitude=c['latitude'],
+                longitude=c['longitude'],
+                dedupe_key=key[0],
+            )
+            if not obj.formatted:
+                obj.formatted = unicode(obj)
+            obj.denormalize()
+            new[key] = obj
+    found, created = _bulk_get_or_create(Address, ('dedupe_key',), set(keys.values()), new,
+                                         Address.objects.with_hierarchy())
+    for ii, key in sorted(keys.items()):
+        results[ii] = found[key]
+        if stats is not None:
+            if key in created:
+                stats['created'] += 1
+                created.discard(key)
+            else:
+                stats['reused'] += 1
+
+    _bulk_insert(fresh)
+    if stats is not None:
+        stats['created'] += len(fresh)
+    return results
+
+##
+## Convert many values to addresses, as per `to_python`, but resolving the
+## country/state/locality hierarchy and the addresses themselves with a
+## handful of queries per batch. Addresses are returned in input order. If
+## given, `stats` (a `collections.Counter`) counts the addresses `created`
+## and `reused`.
+##
+def bulk_to_python(values, batch_size=500, stats=None):
+    results = []
+    batch = []
+    for value in values:
+        batch.append(value)
+        if len(batch) >= batch_size:
+            with transaction.atomic():
+                results.extend(_bulk_to_python(batch, stats))
+            batch = []
+    if batch:
+        with transaction.atomic():
+            results.extend(_bulk_to_python(batch, stats))
+    return results
+
+_ATTACHED_FIELDS = ('street_number', 'route', 'locality', 'latitude', 'longitude', 'formatted', 'dedupe_key',
+                   'locality_name', 'postal_code', 'state_name', 'state_code', 'country_name', 'country_code',
+                   'display', 'geohash', 'route_key')
+
+##
+## Attach resolved components to existing addresses, typically raw ones,
+## updating them in place. `values` holds a dictionary of components, or
+## `None`, for each address. The hierarchy is resolved as per
+## `bulk_to_python`. An address resolving to the same key as another one
+## is left without a key. Returns the addresses updated.
+##
+def bulk_attach(objs, values):
+    parsed = []
+    for ii, (obj, value) in enumerate(zip(objs, values)):
+        if not value:
+            continue
+        try:
+            cmps = _components(dict(value, raw=obj.raw))
+        except InconsistentDictError:
+            continue
+        if cmps is not None and cmps['locality']:
+            parsed.append((ii, cmps))
+    localities = _bulk_localities(parsed)
+
+    updated = []
+    for ii, c in parsed:
+        obj = objs[ii]
+        obj.street_number = c['street_number']
+        obj.route = c['route']
+        obj.locality = localities[ii]
+        obj.latitude = c['latitude']
+        obj.longitude = c['longitude']
+        obj.formatted = c['formatted'] or obj.formatted
+        obj.dedupe_key = make_dedupe_key(obj.street_number, obj.route, obj.locality_id, obj.raw)
+        updated.append(obj)
+
+    taken = set(Address.objects.filter(dedupe_key__in=[o.dedupe_key for o in updated])
+                .exclude(pk__in=[o.pk for o in updated]).values_list('dedupe_key', flat=True))
+    for obj in updated:
+        if obj.dedupe_key in taken:
+            obj.dedupe_key = None
+        taken.add(obj.dedupe_key)
+        obj.denormalize()
+        if not obj.formatted:
+            obj.formatted = unicode(obj)
+        Address.objects.filter(pk=obj.pk).update(**dict((n, getattr(obj, n)) for n in _ATTACHED_FIELDS))
+    return updated
+
+##
+## Querysets able to join the hierarchy above each model, so rendering
+## many rows doesn't need a query per row.
+##
+class StateQuerySet(models.QuerySet):
+
+    def with_hierarchy(self):
+        return self.select_related('country')
+
+class LocalityQuerySet(models.QuerySet):
+
+    def with_hierarchy(self):
+        return self.select_related('state__country')
+
+class AddressQuerySet(models.QuerySet):
+
+    def with_hierarchy(self):
+        return self.select_related('locality__state__country')
+
+    def near(self, latitude, longitude, km):
+        """
+        Addresses possibly within `km` kilometres of a point: those in the
+        geohash cells and bounding box covering the circle.
+        """
+        min_lat, min_lng, max_lat, max_lng = geo.bounding_box(latitude, longitude, km)
+        cells = Q()
+        for cell in geo.cover(min_lat, min_lng, max_lat, max_lng):
+            cells |= Q(geohash__gte=cell, geohash__lt=cell + '~')
+        if min_lng <= max_lng:
+            lngs = Q(longitude__gte=min_lng, longitude__lte=max_lng)
+        else:
+            lngs = Q(longitude__gte=min_lng) | Q(longitude__lte=max_lng)
+        return self.filter(cells, lngs, latitude__gte=min_lat, latitude__lte=max_lat)
+
+    def within_radius(self, latitude, longitude, km):
+        """
+        The addresses within `km` kilometres of a point, nearest first, as a
+        list. Each has its `distance` in kilometres set.
+        """
+        res = []
+        for obj in self.near(latitude, longitude, km):
+            obj.distance = geo.distance(latitude, longitude, obj.latitude, obj.longitude)
+            if obj.distance <= km:
+                res.append(obj)
+        res.sort(key=lambda o: o.distance)
+        return res
+
+    def nearest(self, latitude, longitude, k=1, km=1.0):
+        """
+        The `k` addresses nearest a point, nearest first, as a list. The
+        search starts within `km` kilometres and doubles until enough are
+        found.
+        """
+        while km < math.pi*geo.EARTH_RADIUS:
+            res = self.within_radius(latitude, longitude, km)
+            if len(res) >= k:
+                return res[:k]
+            km *= 2
+        return self.within_radius(latitude, longitude, math.pi*geo.EARTH_RADIUS)[:k]
+
+##
+## The levels of the hierarchy remember the values of their `tracked`
+## fields as loaded or last saved, so saves that leave them unchanged don't
+## touch the addresses below. Deferred fields count as changed.
+##
+_UNKNOWN = object()
+
+class HierarchyModel(models.Model):
+    tracked = ()
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        obj = super(HierarchyModel, cls).from_db(db, field_names, values)
+        obj._tracked = obj.tracked_values()
+        return obj
+
+    def tracked_values(self):
+        return tuple(self.__dict__.get(f, _UNKNOWN) for f in self.tracked)
 
 ##
 ## A country.
 ##
 @python_2_unicode_compatible
-class Country(models.Model):
+class Country(HierarchyModel):
     name = models.CharField(max_length=40, unique=True, blank=True)
     code = models.CharField(max_length=2, blank=True) # not unique as there are duplicates (IT)
 
+    tracked = ('name', 'code')
+
     class Meta:
         verbose_name_plural = 'Countries'
         ordering = ('name',)
@@ -170,11 +845,14 @@ class Country(models.Model):
 ## A state. Google refers to this as `administration_level_1`.
 ##
 @python_2_unicode_compatible
-class State(models.Model):
+class State(HierarchyModel):
     name = models.CharField(max_length=165, blank=True)
     code = models.CharField(max_length=3, blank=True)
     country = models.ForeignKey(Country, on_delete=models.CASCADE, related_name='states')
 
+    objects = StateQuerySet.as_manager()
+    tracked = ('name', 'code', 'country_id')
+
     class Meta:
         unique_together = ('name', 'country')
         ordering = ('country', 'name')
@@ -194,16 +872,36 @@ class State(models.Model):
 ## A locality (suburb).
 ##
 @python_2_unicode_compatible
-class Locality(models.Model):
+class Locality(HierarchyModel):
     name = models.CharField(max_length=165, blank=True)
     postal_code = models.CharField(max_length=10, blank=True)
     state = models.ForeignKey(State, on_delete=models.CASCADE, related_name='localities')
 
+    # The name and postal code folded with `prefix_key`, so they can be
+    # searched by prefix with a range of the index. `None` means they have
+    # not been filled in yet.
+    name_key = models.CharField(max_length=165, null=True, blank=True, editable=False, db_index=True)
+    postal_code_key = models.CharField(max_length=10, null=True, blank=True, editable=False, db_index=True)
+
+    objects = LocalityQuerySet.as_manager()
+    tracked = ('name', 'postal_code', 'state_id')
+
     class Meta:
         verbose_name_plural = 'Localities'
         unique_together = ('name', 'postal_code', 'state')
         ordering = ('state', 'name')
 
+    def save(self, *args, **kwargs):
+        self.denormalize()
+        super(Locality, self).save(*args, **kwargs)
+
+    def denormalize(self):
+        """
+        Fill in the folded keys of the name and postal code.
+        """
+        self.name_key = prefix_key(self.name)[:165]
+        self.postal_code_key = prefix_key(self.postal_code)[:10]
+
     def __str__(self):
         txt = '%s'%self.name
         state = self.state.to_str() if self.state else ''
@@ -230,16 +928,62 @@ class Address(models.Model):
     formatted = models.CharField(max_length=200, blank=True)
     latitude = models.FloatField(blank=True, null=True)
     longitude = models.FloatField(blank=True, null=True)
+    dedupe_key = models.CharField(max_length=40, unique=True, null=True, blank=True, editable=False)
+    geohash = models.CharField(max_length=12, null=True, blank=True, editable=False, db_index=True)
+
+    # Copies of the hierarchy, kept in sync on save and when the hierarchy
+    # is renamed, so addresses can be displayed without joins. `None` means
+    # they have not been filled in yet.
+    locality_name = models.CharField(max_length=165, null=True, blank=True, editable=False)
+    postal_code = models.CharField(max_length=10, null=True, blank=True, editable=False)
+    state_name = models.CharField(max_length=165, null=True, blank=True, editable=False)
+    state_code = models.CharField(max_length=3, null=True, blank=True, editable=False)
+    country_name = models.CharField(max_length=40, null=True, blank=True, editable=False)
+    country_code = models.CharField(max_length=2, null=True, blank=True, editable=False)
+    display = models.TextField(null=True, blank=True, editable=False)
+
+    # The route folded with `prefix_key`, to be searched by prefix.
+    route_key = models.CharField(max_length=100, null=True, blank=True, editable=False, db_index=True)
+
+    objects = AddressQuerySet.as_manager()
 
     class Meta:
         verbose_name_plural = 'Addresses'
         ordering = ('locality', 'route', 'street_number')
         # unique_together = ('locality', 'route', 'street_number')
 
+    def save(self, *args, **kwargs):
+
+        # Addresses made of a raw value alone are only keyed by `to_python`,
+        # strings assigned directly may be repeated.
+        if self.dedupe_key is not None or \
+           (self._state.adding and (self.street_number or self.route or self.locality_id)):
+            self.dedupe_key = make_dedupe_key(self.street_number, self.route, self.locality_id, self.raw)
+        self.denormalize()
+        super(Address, self).save(*args, **kwargs)
+
+    def denormalize(self):
+        """
+        Copy the hierarchy, the geohash of the coordinates and the folded
+        route into the denormalized columns.
+        """
+        for name, value in _denormalized_values(self.locality).items():
+            setattr(self, name, value)
+        self.display = self._display()
+        self.geohash = make_geohash(self.latitude, self.longitude)
+        self.route_key = prefix_key(self.route)[:100]
+
     def __str__(self):
         if self.formatted != '':
             txt = '%s'%self.formatted
-        elif self.locality:
+        elif self.display is not None:
+            txt = self.display
+        else:
+            txt = self._display()
+        return txt
+
+    def _display(self):
+        if self.locality:
             txt = ''
             if self.street_number:
                 txt = '%s'%self.street_number
@@ -267,7 +1011,14 @@ class Address(models.Model):
             latitude=self.latitude if self.latitude else '',
             longitude=self.longitude if self.longitude else '',
         )
-        if self.locality:
+        if self.locality_id and self.locality_name is not None:
+            ad['locality'] = self.locality_name
+            ad['postal_code'] = self.postal_code
+            ad['state'] = self.state_name
+            ad['state_code'] = self.state_code
+            ad['country'] = self.country_name
+            ad['country_code'] = self.country_code
+        elif self.locality:
             ad['locality'] = self.locality.name
             ad['postal_code'] = self.locality.postal_code
             if self.locality.state:
@@ -278,10 +1029,198 @@ class Address(models.Model):
                     ad['country_code'] = self.locality.state.country.code
         return ad
 
+##
+## The denormalized columns of the addresses of `locality`. The display
+## string is an expression, as it depends on each address's street.
+##
+def _denormalized_values(locality):
+    if locality is None:
+        return dict(locality_name='', postal_code='', state_name='', state_code='',
+                    country_name='', country_code='')
+    state = locality.state
+    return dict(
+        locality_name=locality.name,
+        postal_code=locality.postal_code,
+        state_name=state.name,
+        state_code=state.code,
+        country_name=state.country.name,
+        country_code=state.country.code,
+    )
+
+##
+## Bring the denormalized columns of the addresses in `queryset`, all of
+## which belong to `locality`, up to date with a single UPDATE.
+##
+def update_denormalized(queryset, locality):
+    values = _denormalized_values(locality)
+    if locality is None:
+        values['display'] = F('raw')
+    else:
+        txt = unicode(locality)
+        sep = ', ' if txt else ''
+        values['display'] = Case(
+            When(street_number='', then=Value(txt)),
+            When(route='', then=Concat('street_number', Value(sep + txt))),
+            default=Concat('street_number', Value(' '), 'route', Value(sep + txt)),
+            output_field=models.TextField(),
+        )
+    return queryset.filter(locality=locality).update(**values)
+
+##
+## The display string of addresses with a locality, as an expression of
+## their denormalized columns. See `Address._display` and
+## `Locality.__str__`.
+##
+def _display_expression():
+    def text(cases, default):
+        return Case(*[When(q, then=v) for q, v in cases], default=default, output_field=models.TextField())
+    no_locality = Q(locality_name='', state_name='', state_code='', postal_code='', country_name='', country_code='')
+    return Concat(
+        text([(Q(street_number=''), Value('')), (Q(route=''), F('street_number'))],
+             Concat('street_number', Value(' '), 'route')),
+        text([(Q(street_number='') | no_locality, Value(''))], Value(', ')),
+        'locality_name',
+        text([(Q(locality_name='') | Q(state_name='', state_code=''), Value(''))], Value(', ')),
+        text([(Q(state_name=''), F('state_code'))], F('state_name')),
+        text([(Q(postal_code=''), Value(''))], Concat(Value(' '), 'postal_code')),
+        text([(Q(country_name='', country_code=''), Value('')), (Q(country_name=''), Concat(Value(', '), 'country_code'))],
+             Concat(Value(', '), 'country_name')),
+        output_field=models.TextField(),
+    )
+
+##
+## Signal handler to follow renames in the hierarchy. The addresses below
+## are updated with an UPDATE for the changed columns and another for the
+## display string, however many localities there are. Addresses whose
+## columns haven't been filled in yet are left to the backfill.
+##
+def hierarchy_saved(sender, instance, created=False, raw=False, **kwargs):
+    loaded = getattr(instance, '_tracked', None)
+    instance._tracked = instance.tracked_values()
+    if created or raw or loaded == instance._tracked:
+        return
+    if sender is Locality:
+        addresses = Address.objects.filter(locality=instance)
+        values = _denormalized_values(instance)
+    elif sender is State:
+        addresses = Address.objects.filter(locality__state=instance)
+        values = dict(state_name=instance.name, state_code=instance.code,
+                      country_name=instance.country.name, country_code=instance.country.code)
+    else:
+        addresses = Address.objects.filter(locality__state__country=instance)
+        values = dict(country_name=instance.name, country_code=instance.code)
+    addresses = addresses.exclude(locality_name=None)
+    addresses.update(**values)
+    addresses.update(display=_display_expression())
+
+##
+## Progress of a backfill task, see `address.backfill`.
+##
+@python_2_unicode_compatible
+class BackfillCheckpoint(models.Model):
+    task = models.CharField(max_length=100, unique=True)
+    last_pk = models.BigIntegerField(default=0)
+    rows = models.BigIntegerField(default=0)
+    started = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+    finished = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return '%s: %d rows, last pk %s'%(self.task, self.rows, self.last_pk)
+
+##
+## An entry of the resolution cache: the address a raw value, keyed by a
+## hash of its normalized form, was converted to.
+##
+@python_2_unicode_compatible
+class ResolvedRaw(models.Model):
+    key = models.CharField(max_length=40, unique=True)
+    raw = models.TextField()
+    address = models.ForeignKey(Address, on_delete=models.CASCADE, related_name='+')
+    hits = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(default=timezone.now)
+    last_used = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return '%s: %s'%(self.raw, self.address_id)
+
+##
+## Strings and dictionaries assigned to lazy address fields are kept as
+## pending values instead of being converted straight away, and converted
+## when the address is next read or the instance is saved. See
+## `resolve_pending` for converting the pending values of many instances
+## together.
+##
 class AddressDescriptor(ForwardManyToOneDescriptor):
 
+    def __get__(self, inst, cls=None):
+        if inst is not None and self.field.pending_name in inst.__dict__:
+            self._set(inst, to_python(inst.__dict__.pop(self.field.pending_name)))
+        return super(AddressDescriptor, self).__get__(inst, cls)
+
     def __set__(self, inst, value):
-        super(AddressDescriptor, self).__set__(inst, to_python(value))
+        inst.__dict__.pop(self.field.pending_name, None)
+        if isinstance(value, (basestring, dict)) and self.field.is_lazy():
+            self._set(inst, None)
+            inst.__dict__[self.field.pending_name] = value
+        else:
+            self._set(inst, to_python(value))
+
+    def _set(self, inst, value):
+        super(AddressDescriptor, self).__set__(inst, value)
+
+##
+## Convert the pending values of the address fields of `objs` with
+## `bulk_to_python`, so the addresses of many instances are found or
+## created with a handful of queries. Returns the number converted.
+##
+def resolve_pending(objs, batch_size=500):
+    pending = []
+    for obj in objs:
+        for field in obj._meta.concrete_fields:
+            if isinstance(field, AddressField) and field.pending_name in obj.__dict__:
+                pending.append((obj, field, obj.__dict__.pop(field.pending_name)))
+    addresses = bulk_to_python([v for o, f, v in pending], batch_size=batch_size)
+    for (obj, field, value), address in zip(pending, addresses):
+        setattr(obj, field.name, address)
+    return len(pending)
+
+##
+## A queryset for models with address fields, whose `bulk_create` and
+## `bulk_update` convert the pending addresses of all the instances
+## together before writing them. The address fields of models using it as
+## their default manager are lazy unless created with `lazy=False`.
+##
+class AddressAwareQuerySet(models.QuerySet):
+
+    def bulk_create(self, objs, batch_size=None):
+        objs = list(objs)
+        resolve_pending(objs)
+        return super(AddressAwareQuerySet, self).bulk_create(objs, batch_size=batch_size)
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        """
+        Update `fields` of `objs` with a query per batch, as the
+        `bulk_update` of later Django versions.
+        """
+        objs = list(objs)
+        resolve_pending(objs)
+        fields = [self.model._meta.get_field(name) for name in fields]
+        batch_size = batch_size or len(objs) or 1
+        updated = 0
+        with transaction.atomic(using=self.db, savepoint=False):
+            for start in range(0, len(objs), batch_size):
+                batch = objs[start:start + batch_size]
+                values = {}
+                for field in fields:
+                    values[field.name] = Case(*[
+                        When(pk=obj.pk, then=Value(getattr(obj, field.attname), output_field=field))
+                        for obj in batch
+                    ], output_field=field)
+                updated += self.filter(pk__in=[obj.pk for obj in batch]).update(**values)
+        return updated
+
+AddressAwareManager = models.Manager.from_queryset(AddressAwareQuerySet)
 
 ##
 ## A field for addresses in other models.
@@ -290,13 +1229,31 @@ class AddressField(models.ForeignKey):
     description = 'An address'
 
     def __init__(self, *args, **kwargs):
-        kwargs['to'] = 'address.Address'
+        kwargs.setdefault('to', 'address.Address')
+        self.lazy = kwargs.pop('lazy', None)
         super(AddressField, self).__init__(**kwargs)
 
     def contribute_to_class(self, cls, name, virtual_only=False):
         super(ForeignObject, self).contribute_to_class(cls, name, virtual_only=virtual_only)
         setattr(cls, self.name, AddressDescriptor(self))
 
+    @property
+    def pending_name(self):
+        return '_%s_pending'%self.name
+
+    def is_lazy(self):
+        if self.lazy is None:
+            return getattr(settings, 'ADDRESS_LAZY', False) or \
+                issubclass(self.model._default_manager._queryset_class, AddressAwareQuerySet)
+        return self.lazy
+
+    def pre_save(self, model_instance, add):
+
+        # Reading the address converts any pending value.
+        if self.pending_name in model_instance.__dict__:
+            getattr(model_instance, self.name)
+        return super(AddressField, self).pre_save(model_instance, add)
+
     # def deconstruct(self):
     #     name, path, args, kwargs = super(AddressField, self).deconstruct()
     #     del kwargs['to']
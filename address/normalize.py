@@ -0,0 +1,94 @@
+import re
+import unicodedata
+
+from django.utils.encoding import force_text
+
+__all__ = ['ABBREVIATIONS', 'tokens', 'normalize', 'fingerprint', 'prefix_key']
+
+##
+## Abbreviations expanded when normalizing, by country code. The `None`
+## table applies everywhere, country tables add to or override it.
+##
+ABBREVIATIONS = {
+    None: {
+        'st': 'street', 'rd': 'road', 'ave': 'avenue', 'av': 'avenue', 'blvd': 'boulevard',
+        'dr': 'drive', 'ln': 'lane', 'ct': 'court', 'pl': 'place', 'sq': 'square',
+        'hwy': 'highway', 'pkwy': 'parkway', 'fwy': 'freeway', 'cres': 'crescent',
+        'cct': 'circuit', 'cir': 'circle', 'tce': 'terrace', 'ter': 'terrace', 'pde': 'parade',
+        'esp': 'esplanade', 'cl': 'close', 'gr': 'grove', 'gdns': 'gardens', 'mt': 'mount',
+        'apt': 'apartment', 'ste': 'suite', 'fl': 'floor', 'bldg': 'building',
+        'n': 'north', 's': 'south', 'e': 'east', 'w': 'west',
+        'ne': 'northeast', 'nw': 'northwest', 'se': 'southeast', 'sw': 'southwest',
+    },
+    'US': {
+        'expy': 'expressway', 'tpke': 'turnpike', 'trl': 'trail', 'cv': 'cove', 'jct': 'junction',
+    },
+    'GB': {
+        'gdn': 'garden', 'wy': 'way',
+    },
+    'FR': {
+        'r': 'rue', 'bd': 'boulevard', 'ch': 'chemin', 'imp': 'impasse', 'all': 'allee',
+        'pl': 'place', 'fbg': 'faubourg', 'st': 'saint', 'ste': 'sainte',
+    },
+    'DE': {
+        'str': 'strasse', 'pl': 'platz',
+    },
+}
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+_COMBINING = re.compile(u'[\u0300-\u036f]')
+
+# Case folds beyond `lower`, applied explicitly rather than with
+# `str.casefold`, which Python 2 lacks, so every interpreter gives the
+# same keys.
+_FOLDS = {0xdf: u'ss', 0x1e9e: u'ss', 0x3c2: u'\u03c3'}
+_tables = {}
+
+def _table(country):
+    try:
+        return _tables[country]
+    except KeyError:
+        table = dict(ABBREVIATIONS[None])
+        table.update(ABBREVIATIONS.get(country and country.upper(), {}))
+        _tables[country] = table
+        return table
+
+def _fold(value):
+    value = unicodedata.normalize('NFKC', force_text(value)).lower().translate(_FOLDS)
+
+    # Only strings with non-ASCII characters need accents removed.
+    try:
+        value.encode('ascii')
+    except UnicodeEncodeError:
+        value = _COMBINING.sub('', unicodedata.normalize('NFKD', value))
+    return value
+
+##
+## The words of an address: case folded, NFKC normalized and without
+## accents or punctuation, with abbreviations expanded per `country`.
+##
+def tokens(value, country=None):
+    table = _table(country)
+    return [table.get(t, t) for t in _TOKEN.findall(_fold(value))]
+
+##
+## Normalize an address for comparison, keeping the order of its words.
+##
+def normalize(value, country=None):
+    return ' '.join(tokens(value, country))
+
+##
+## A fingerprint of an address: its normalized words in sorted order, so
+## that reordered parts of a raw address compare equal. Different addresses
+## may share a fingerprint, so it's for finding candidates, not identity.
+##
+def fingerprint(value, country=None):
+    return ' '.join(sorted(tokens(value, country)))
+
+##
+## The key a value is searched by prefix under: its words case folded and
+## without accents or punctuation, but with abbreviations kept, so partly
+## typed words still match.
+##
+def prefix_key(value):
+    return ' '.join(_TOKEN.findall(_fold(value)))
@@ -0,0 +1,180 @@
+from array import array
+from bisect import bisect_left, bisect_right
+import threading
+
+from .models import Locality
+from .normalize import prefix_key
+
+__all__ = ['PrefixIndex', 'LocalityIndex', 'locality_index']
+
+##
+## A sorted array of keys, each with the primary key of the row it came
+## from, searched by prefix with a binary search. Rows may be indexed under
+## several keys.
+##
+class PrefixIndex(object):
+
+    def __init__(self, entries=()):
+        entries = sorted(entries)
+        self.keys = [k for k, pk in entries]
+        self.pks = array('l', [pk for k, pk in entries])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _find(self, key, pk):
+        lo = bisect_left(self.keys, key)
+        hi = bisect_right(self.keys, key, lo)
+        return lo + bisect_left(self.pks[lo:hi], pk)
+
+    def add(self, key, pk):
+        ii = self._find(key, pk)
+        self.keys.insert(ii, key)
+        self.pks.insert(ii, pk)
+
+    def remove(self, key, pk):
+        ii = self._find(key, pk)
+        if ii < len(self.keys) and self.keys[ii] == key and self.pks[ii] == pk:
+            del self.keys[ii]
+            del self.pks[ii]
+
+    def search(self, prefix, limit=None):
+        """
+        The primary keys of the rows with a key starting with `prefix`, in
+        key order and without repeats.
+        """
+        res = []
+        seen = set()
+        ii = bisect_left(self.keys, prefix)
+        while ii < len(self.keys) and self.keys[ii].startswith(prefix):
+            pk = self.pks[ii]
+            if pk not in seen:
+                seen.add(pk)
+                res.append(pk)
+                if limit is not None and len(res) >= limit:
+                    break
+            ii += 1
+        return res
+
+##
+## An in-process index of the locality names and postal codes, built from
+## the database on first use and kept up to date by the signal handlers
+## below. Each locality is held as a tuple of its name, postal code and the
+## names and codes of its state and country, with repeated strings shared,
+## so suggestions can be made without touching the database.
+##
+class LocalityIndex(object):
+    fields = ('name', 'postal_code', 'state__name', 'state__code',
+              'state__country__name', 'state__country__code')
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        """
+        Drop the index, which is rebuilt when next used.
+        """
+        with self._lock:
+            self._built = False
+            self.names = self.postal_codes = self.rows = self._strings = None
+
+    def _intern(self, value):
+        return self._strings.setdefault(value, value)
+
+    def _row(self, values):
+        return tuple(self._intern(v or '') for v in values)
+
+    def build(self):
+        with self._lock:
+            self._strings = {}
+            self.rows = {}
+            names = []
+            postal_codes = []
+            qs = Locality.objects.order_by().values_list('pk', *self.fields)
+            for values in qs.iterator():
+                row = self._row(values[1:])
+                self.rows[values[0]] = row
+                names.append((self._intern(prefix_key(row[0])), values[0]))
+                postal_codes.append((self._intern(prefix_key(row[1])), values[0]))
+            self.names = PrefixIndex(names)
+            self.postal_codes = PrefixIndex(postal_codes)
+            self._built = True
+
+    def _ensure(self):
+        if not self._built:
+            self.build()
+
+    def __len__(self):
+        with self._lock:
+            self._ensure()
+            return len(self.rows)
+
+    def get(self, pk):
+        with self._lock:
+            self._ensure()
+            return self.rows.get(pk)
+
+    def search(self, prefix, limit=None):
+        """
+        The primary keys of the localities whose postal code, if `prefix`
+        starts with a digit, or else name starts with `prefix`, ordered by
+        name or postal code.
+        """
+        key = prefix_key(prefix)
+        if not key:
+            return []
+        with self._lock:
+            self._ensure()
+            index = self.postal_codes if key[0].isdigit() else self.names
+            return index.search(key, limit)
+
+    def suggest(self, prefix, limit=None):
+        """
+        The rows, as tuples of `fields`, of the localities found by `search`.
+        """
+        with self._lock:
+            return [self.rows[pk] for pk in self.search(prefix, limit)]
+
+    def _remove(self, pk):
+        row = self.rows.pop(pk, None)
+        if row is not None:
+            self.names.remove(prefix_key(row[0]), pk)
+            self.postal_codes.remove(prefix_key(row[1]), pk)
+
+    def update(self, obj):
+        with self._lock:
+            if not self._built:
+                return
+            self._remove(obj.pk)
+            state = obj.state
+            country = state.country
+            row = self._row((obj.name, obj.postal_code, state.name, state.code, country.name, country.code))
+            self.rows[obj.pk] = row
+            self.names.add(self._intern(prefix_key(row[0])), obj.pk)
+            self.postal_codes.add(self._intern(prefix_key(row[1])), obj.pk)
+
+    def remove(self, pk):
+        with self._lock:
+            if self._built:
+                self._remove(pk)
+
+locality_index = LocalityIndex()
+
+##
+## Signal handlers. Changes to states and countries, being rare and able to
+## affect many localities, drop the index instead of updating it. New ones
+## have no localities yet, so are ignored.
+##
+def locality_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        locality_index.clear()
+    else:
+        locality_index.update(instance)
+
+def locality_deleted(sender, instance, **kwargs):
+    locality_index.remove(instance.pk)
+
+def hierarchy_changed(sender, instance, created=False, **kwargs):
+    if not created:
+        locality_index.clear()
@@ -0,0 +1,96 @@
+from multiprocessing.pool import ThreadPool
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+__all__ = ['BaseResolver', 'RateLimiter', 'get_resolver', 'resolve_concurrently']
+
+##
+## A resolver turns a raw address string into a dictionary of address
+## components, as accepted by `AddressField`, or `None` when it can't.
+##
+class BaseResolver(object):
+
+    def resolve(self, raw):
+        raise NotImplementedError
+
+    def resolve_many(self, raws):
+        """
+        Resolve a sequence of raw strings, returning a list of the same
+        length. Backends able to batch lookups should override this.
+        """
+        return [self.resolve(raw) for raw in raws]
+
+_resolvers = {}
+_lock = threading.Lock()
+
+##
+## The resolver configured by the `ADDRESS_RESOLVER` setting, a dotted path
+## to a `BaseResolver` subclass instantiated with `ADDRESS_RESOLVER_OPTIONS`.
+## Returns `None` when no resolver is configured.
+##
+def get_resolver():
+    try:
+        return _resolvers['default']
+    except KeyError:
+        pass
+    with _lock:
+        if 'default' not in _resolvers:
+            path = getattr(settings, 'ADDRESS_RESOLVER', None)
+            resolver = None
+            if path:
+                try:
+                    cls = import_string(path)
+                except ImportError as e:
+                    raise ImproperlyConfigured('Invalid ADDRESS_RESOLVER: %s'%e)
+                resolver = cls(**getattr(settings, 'ADDRESS_RESOLVER_OPTIONS', {}))
+            _resolvers['default'] = resolver
+        return _resolvers['default']
+
+def setting_changed(setting, **kwargs):
+    if setting in ('ADDRESS_RESOLVER', 'ADDRESS_RESOLVER_OPTIONS'):
+        _resolvers.clear()
+
+##
+## Space out calls to at most `rate` per second, across threads.
+##
+class RateLimiter(object):
+
+    def __init__(self, rate):
+        self.interval = 1.0/rate
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.time()
+            at = max(self._next, now)
+            self._next = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+##
+## Resolve raw strings with up to `concurrency` lookups in flight, for
+## resolvers bound by network latency, and an optional `RateLimiter`.
+## Returns a list in input order.
+##
+def resolve_concurrently(resolver, raws, concurrency=1, limiter=None):
+    if concurrency <= 1 and limiter is None:
+        return resolver.resolve_many(raws)
+
+    def resolve(raw):
+        if limiter is not None:
+            limiter.wait()
+        return resolver.resolve(raw)
+
+    if concurrency <= 1:
+        return [resolve(raw) for raw in raws]
+    pool = ThreadPool(concurrency)
+    try:
+        return pool.map(resolve, raws)
+    finally:
+        pool.close()
+        pool.join()
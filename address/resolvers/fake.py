@@ -0,0 +1,30 @@
+import time
+
+from . import BaseResolver
+
+__all__ = ['FakeResolver']
+
+##
+## A resolver for tests and benchmarks, needing no data. Addresses of the
+## form "<number> <route>, <locality>, <state>, <country>" are split on
+## commas, anything else is unresolved. `delay` seconds are spent on each
+## lookup to stand in for a remote service.
+##
+class FakeResolver(BaseResolver):
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.calls = 0
+
+    def resolve(self, raw):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        parts = [p.strip() for p in raw.split(',')]
+        if len(parts) != 4 or not all(parts):
+            return None
+        street, locality, state, country = parts
+        number, sep, route = street.partition(' ')
+        if not (sep and number[:1].isdigit()):
+            number, route = '', street
+        return dict(street_number=number, route=route, locality=locality, state=state, country=country)
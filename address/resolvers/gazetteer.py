@@ -0,0 +1,147 @@
+from collections import namedtuple
+import io
+import re
+import threading
+import unicodedata
+
+from django.utils.encoding import force_text
+
+from . import BaseResolver
+
+__all__ = ['Place', 'GazetteerResolver']
+
+Place = namedtuple('Place', 'country_code postal_code name state state_code latitude longitude')
+
+_STREET = re.compile(r'^(\S*\d\S*)\s+(.+)$')
+
+##
+## Reduce a string to lower case alphanumeric words separated by single
+## spaces, with accents removed.
+##
+def _norm(value):
+    value = unicodedata.normalize('NFKD', force_text(value))
+    value = ''.join(c for c in value if not unicodedata.combining(c)).lower()
+    return ' '.join(re.findall(r'\w+', value, re.UNICODE))
+
+def _float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+##
+## Read the country names of a GeoNames `countryInfo.txt` file.
+##
+def read_countries(path, encoding='utf-8'):
+    names = {}
+    with io.open(path, encoding=encoding) as f:
+        for line in f:
+            if line.startswith('#') or not line.strip():
+                continue
+            row = line.rstrip('\r\n').split('\t')
+            names[row[0]] = row[4]
+    return names
+
+##
+## Resolve addresses offline from a GeoNames postal code dump
+## (http://download.geonames.org/export/zip/), a tab separated file of
+## country code, postal code, place name, state name and code, three more
+## admin levels, latitude, longitude and accuracy. The file is loaded once,
+## on first use, into dictionaries keyed by postal code and place name so a
+## lookup doesn't touch the disk or the network.
+##
+## `countries` is a mapping of country codes to names, or the path to a
+## GeoNames `countryInfo.txt`; without it countries are named by their code.
+## `country` restricts the places loaded to a single country code.
+##
+class GazetteerResolver(BaseResolver):
+
+    def __init__(self, path, countries=None, country=None, encoding='utf-8'):
+        self.path = path
+        self.countries = countries
+        self.country = country
+        self.encoding = encoding
+        self._postal = None
+        self._places = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._postal is not None:
+            return
+        with self._lock:
+            if self._postal is not None:
+                return
+            countries = self.countries or {}
+            if not isinstance(countries, dict):
+                countries = read_countries(countries, self.encoding)
+            postal, places = {}, {}
+            with io.open(self.path, encoding=self.encoding) as f:
+                for line in f:
+                    row = line.rstrip('\r\n').split('\t')
+                    if len(row) < 11 or (self.country and row[0] != self.country):
+                        continue
+                    place = Place(row[0], row[1], row[2], row[3], row[4], _float(row[9]), _float(row[10]))
+                    if place.postal_code:
+                        postal.setdefault(_norm(place.postal_code), []).append(place)
+                    places.setdefault(_norm(place.name), []).append(place)
+            self._country_names = countries
+            self._places = places
+            self._postal = postal
+
+    def _find(self, text, parts):
+        padded = ' %s '%text
+        words = text.split()
+
+        # Postal codes, of one or two words, narrowed by the place name.
+        found = []
+        for ii in range(len(words)):
+            for key in (words[ii], ' '.join(words[ii:ii + 2])):
+                found.extend(self._postal.get(key, ()))
+        if found:
+            named = [p for p in found if ' %s '%_norm(p.name) in padded]
+            if named:
+                return named
+            if len(set(p.postal_code for p in found)) == 1:
+                return found
+            return []
+
+        # Place names, narrowed by the state.
+        for part in reversed(parts):
+            found = self._places.get(_norm(part))
+            if found:
+                named = [p for p in found if ' %s '%_norm(p.state) in padded or
+                         (p.state_code and ' %s '%_norm(p.state_code) in padded)]
+                return named or found
+        return []
+
+    def resolve(self, raw):
+        self.load()
+        parts = [p.strip() for p in raw.split(',') if p.strip()]
+        found = self._find(_norm(raw), parts)
+
+        # Give up on ambiguous matches.
+        if not found or len(set((p.country_code, p.state, p.name) for p in found)) > 1:
+            return None
+        place = found[0]
+        postal_codes = set(p.postal_code for p in found)
+
+        value = dict(
+            raw=raw,
+            locality=place.name,
+            postal_code=place.postal_code if len(postal_codes) == 1 else '',
+            state=place.state,
+            state_code=place.state_code,
+            country=self._country_names.get(place.country_code, place.country_code),
+            country_code=place.country_code,
+            latitude=place.latitude,
+            longitude=place.longitude,
+        )
+
+        # The street is taken to be the first part of a comma separated address.
+        if len(parts) > 1 and _norm(parts[0]) != _norm(place.name):
+            match = _STREET.match(parts[0])
+            if match:
+                value['street_number'], value['route'] = match.groups()
+            else:
+                value['route'] = parts[0]
+        return value
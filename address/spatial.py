@@ -0,0 +1,154 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+from .geo import EARTH_RADIUS
+from .models import Address
+
+__all__ = ['AddressSpatialIndex']
+
+# The most query/point pairs compared at once, bounding memory use.
+CHUNK_ELEMENTS = 4000000
+
+def _xyz(latitudes, longitudes):
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lng = np.radians(np.asarray(longitudes, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat*np.cos(lng), cos_lat*np.sin(lng), np.sin(lat)))
+
+##
+## Great circle distances between unit vectors, from the chord length,
+## which unlike the dot product is accurate for nearby points.
+##
+def _distances(a, b):
+    chord = np.sqrt(((a - b)**2).sum(axis=-1))
+    return 2*EARTH_RADIUS*np.arcsin(np.minimum(1.0, chord/2))
+
+def _chord(km):
+    return 2*np.sin(min(np.pi, km/EARTH_RADIUS)/2)
+
+##
+## An in-memory index of address coordinates for proximity queries in
+## bulk. Points are held as unit vectors in a contiguous NumPy array, and
+## can be saved to files that other processes memory-map rather than
+## reload. Straight line distances between unit vectors order points as
+## great circle distances do, so when SciPy is installed queries go
+## through a KD-tree built over the vectors on first use. Otherwise a
+## batch of queries is answered with matrix products.
+##
+## Requires NumPy (`pip install django-address[spatial]`).
+##
+class AddressSpatialIndex(object):
+    use_tree = True
+
+    def __init__(self, pks, xyz):
+        if np is None:
+            raise ImportError('AddressSpatialIndex requires NumPy.')
+        self.pks = pks
+        self.xyz = xyz
+        self._tree = None
+
+    @property
+    def tree(self):
+        if not (self.use_tree and cKDTree is not None and len(self)):
+            return None
+        if self._tree is None:
+            self._tree = cKDTree(self.xyz)
+        return self._tree
+
+    @classmethod
+    def from_queryset(cls, queryset=None):
+        """
+        Index the addresses of `queryset` having coordinates.
+        """
+        if np is None:
+            raise ImportError('AddressSpatialIndex requires NumPy.')
+        if queryset is None:
+            queryset = Address.objects.all()
+        rows = list(queryset.exclude(latitude=None).exclude(longitude=None)
+                    .values_list('pk', 'latitude', 'longitude').order_by('pk').iterator())
+        pks = np.array([r[0] for r in rows], dtype=np.int64)
+        if not rows:
+            return cls(pks, np.empty((0, 3)))
+        return cls(pks, _xyz([r[1] for r in rows], [r[2] for r in rows]))
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Load an index written by `save`, memory-mapping it unless `mmap` is
+        false.
+        """
+        if np is None:
+            raise ImportError('AddressSpatialIndex requires NumPy.')
+        mode = 'r' if mmap else None
+        return cls(np.load(path + '.pk.npy', mmap_mode=mode), np.load(path + '.xyz.npy', mmap_mode=mode))
+
+    def save(self, path):
+        np.save(path + '.pk.npy', np.ascontiguousarray(self.pks))
+        np.save(path + '.xyz.npy', np.ascontiguousarray(self.xyz))
+
+    def __len__(self):
+        return len(self.pks)
+
+    def _chunks(self, latitudes, longitudes):
+        points = _xyz(latitudes, longitudes)
+        size = max(1, CHUNK_ELEMENTS//max(1, len(self)))
+        for start in range(0, len(points), size):
+            chunk = points[start:start + size]
+            yield chunk, chunk.dot(self.xyz.T)
+
+    def query(self, latitudes, longitudes, k=1):
+        """
+        The `k` nearest addresses to each point, as arrays of distances in
+        kilometres and of primary keys, both of shape `(points, k)` and
+        nearest first.
+        """
+        n = len(np.atleast_1d(latitudes))
+        k = min(k, len(self))
+        if self.tree is not None and k:
+            chords, indexes = self.tree.query(_xyz(latitudes, longitudes), k=k)
+            chords, indexes = chords.reshape((n, k)), indexes.reshape((n, k))
+            return 2*EARTH_RADIUS*np.arcsin(np.minimum(1.0, chords/2)), self.pks[indexes]
+        distances = np.empty((n, k))
+        indexes = np.empty((n, k), dtype=np.int64)
+        start = 0
+        for points, dots in self._chunks(latitudes, longitudes):
+            if k < len(self):
+                idx = np.argpartition(-dots, k - 1, axis=1)[:, :k]
+            else:
+                idx = np.tile(np.arange(len(self)), (len(points), 1))
+            dist = _distances(points[:, None, :], self.xyz[idx])
+            order = np.argsort(dist, axis=1)
+            rows = np.arange(len(points))[:, None]
+            distances[start:start + len(points)] = dist[rows, order]
+            indexes[start:start + len(points)] = idx[rows, order]
+            start += len(points)
+        return distances, self.pks[indexes]
+
+    def query_radius(self, latitudes, longitudes, km):
+        """
+        The addresses within `km` kilometres of each point, as a list of
+        `(distances, primary keys)` array pairs, nearest first.
+        """
+        if self.tree is not None:
+            points = _xyz(latitudes, longitudes)
+            found = self.tree.query_ball_point(points, _chord(km) + 1e-12)
+            return [self._within(p, np.array(idx, dtype=np.int64), km) for p, idx in zip(points, found)]
+        res = []
+        cutoff = np.cos(min(np.pi, km/EARTH_RADIUS)) - 1e-9
+        for points, dots in self._chunks(latitudes, longitudes):
+            for point, row in zip(points, dots):
+                res.append(self._within(point, np.nonzero(row >= cutoff)[0], km))
+        return res
+
+    def _within(self, point, idx, km):
+        dist = _distances(point, self.xyz[idx])
+        keep = dist <= km
+        idx, dist = idx[keep], dist[keep]
+        order = np.argsort(dist)
+        return dist[order], self.pks[idx[order]]
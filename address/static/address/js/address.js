@@ -1,19 +1,81 @@
 $(function(){
+    var cmp_names = ['country', 'country_code', 'locality', 'postal_code',
+		     'route', 'street_number', 'state', 'state_code',
+		     'formatted', 'latitude', 'longitude'];
+
     $('input.address').each(function(){
         var self = $(this);
-	var cmps = $('#' + self.attr('name') + '_components');
-	var fmtd = $('input[name="' + self.attr('name') + '_formatted"]');
-        self.geocomplete({
-            details: cmps,
-            detailsAttribute: 'data-geo'
-        }).change(function(){
-	    if(self.val() != fmtd.val()) {
-		var cmp_names = ['country', 'country_code', 'locality', 'postal_code',
-				 'route', 'street_number', 'state', 'state_code',
-				 'formatted', 'latitude', 'longitude'];
-		for(var ii = 0; ii < cmp_names.length; ++ii)
-		    $('input[name="' + self.attr('name') + '_' + cmp_names[ii] + '"]').val('');
-	    }
+	var name = self.attr('name');
+	var cmps = $('#' + name + '_components');
+	var fmtd = $('input[name="' + name + '_formatted"]');
+	var url = self.data('autocomplete-url');
+	var google = !!$.fn.geocomplete;
+	var attached = false;
+
+	// Google is used straight away, or when the autocomplete view has
+	// nothing to suggest.
+	var geocomplete = function(){
+	    if(!google || attached)
+		return;
+	    attached = true;
+            self.geocomplete({
+		details: cmps,
+		detailsAttribute: 'data-geo'
+            });
+	};
+
+	var clear = function(){
+	    for(var ii = 0; ii < cmp_names.length; ++ii)
+		$('input[name="' + name + '_' + cmp_names[ii] + '"]').val('');
+	};
+
+	if(url) {
+	    var list = $('<datalist></datalist>').attr('id', name + '_suggestions');
+	    var results = [];
+	    var timer = null;
+	    self.attr('list', list.attr('id')).attr('autocomplete', 'off').after(list);
+	    self.on('input', function(){
+		clearTimeout(timer);
+		timer = setTimeout(function(){
+		    var q = self.val();
+		    if(q.length < 2)
+			return;
+		    var kind = /^\d+\s+\S/.test(q) ? 'addresses' : 'localities';
+		    $.getJSON(url, {q: q, kind: kind}, function(data){
+			results = data.results;
+			list.empty();
+			for(var ii = 0; ii < results.length; ++ii)
+			    list.append($('<option></option>').attr('value', results[ii].label));
+			if(!results.length)
+			    geocomplete();
+		    }).fail(function(){
+			results = [];
+			list.empty();
+			geocomplete();
+		    });
+		}, 150);
+	    });
+	    self.on('change', function(){
+		for(var ii = 0; ii < results.length; ++ii) {
+		    if(results[ii].label == self.val()) {
+			clear();
+			for(var jj = 0; jj < cmp_names.length; ++jj) {
+			    var value = results[ii][cmp_names[jj]];
+			    if(value !== undefined && value !== null)
+				$('input[name="' + name + '_' + cmp_names[jj] + '"]').val(value);
+			}
+			fmtd.val(self.val());
+			return;
+		    }
+		}
+	    });
+	}
+	else
+	    geocomplete();
+
+	self.change(function(){
+	    if(self.val() != fmtd.val())
+		clear();
 	});
     });
 });
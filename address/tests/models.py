@@ -0,0 +1,54 @@
+from django.db import connection, models
+from django.test.utils import isolate_apps
+from address.models import Address, AddressField, AddressAwareManager
+
+##
+## Models with address fields for the tests, registered in an isolated
+## app registry rather than the project's. Their fields refer to `Address`
+## itself, as it isn't in that registry. Test cases using them
+## mix in `TestModelsMixin`, which creates their tables for the duration of
+## the test case.
+##
+with isolate_apps('address.tests'):
+
+    class Order(models.Model):
+        name = models.CharField(max_length=20, blank=True)
+        shipping = AddressField(to=Address, lazy=True, blank=True, null=True, related_name='+')
+        billing = AddressField(to=Address, blank=True, null=True, related_name='+')
+
+    class Shipment(models.Model):
+        name = models.CharField(max_length=20, blank=True)
+        origin = AddressField(to=Address, blank=True, null=True, related_name='+')
+        destination = AddressField(to=Address, blank=True, null=True, related_name='+')
+        returns = AddressField(to=Address, lazy=False, blank=True, null=True, related_name='+')
+
+        objects = AddressAwareManager()
+
+##
+## A model with a one to one field to `Address`. It's registered with the
+## project's models, so that `Address` sees the relation when merging
+## duplicates, but unmanaged and left alone when deleting addresses, as
+## only the test cases mixing in `TestModelsMixin` with it create its table.
+##
+class Account(models.Model):
+    address = models.OneToOneField(Address, on_delete=models.DO_NOTHING, related_name='+')
+
+    class Meta:
+        managed = False
+
+class TestModelsMixin(object):
+    test_models = (Order, Shipment)
+
+    @classmethod
+    def setUpClass(cls):
+        with connection.schema_editor() as editor:
+            for model in cls.test_models:
+                editor.create_model(model)
+        super(TestModelsMixin, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(TestModelsMixin, cls).tearDownClass()
+        with connection.schema_editor() as editor:
+            for model in cls.test_models:
+                editor.delete_model(model)
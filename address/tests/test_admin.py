@@ -0,0 +1,47 @@
+from django.contrib.admin.sites import AdminSite
+from django.test import TestCase, RequestFactory, override_settings
+from address.admin import AddressAdmin, LocalityAdmin, StateAdmin
+from address.models import *
+from address.prefix import locality_index
+
+# Python 3 fixes.
+import sys
+if sys.version > '3':
+    unicode = str
+
+class AdminQueryCountTestCase(TestCase):
+
+    def setUp(self):
+        self.site = AdminSite()
+        self.request = RequestFactory().get('/')
+        au = Country.objects.create(name='Australia', code='AU')
+        for ii in range(5):
+            state = State.objects.create(name='State %d'%ii, country=au)
+            loc = Locality.objects.create(name='Locality %d'%ii, state=state)
+            for jj in range(5):
+                Address.objects.create(street_number=str(jj), route='Street', locality=loc, raw='raw')
+
+    def assertConstantQueries(self, admin_class, model):
+        model_admin = admin_class(model, self.site)
+        with self.assertNumQueries(1):
+            txts = [unicode(o) for o in model_admin.get_queryset(self.request)]
+        self.assertEqual(len(txts), model.objects.count())
+
+    def test_address(self):
+        self.assertConstantQueries(AddressAdmin, Address)
+
+    def test_locality(self):
+        self.assertConstantQueries(LocalityAdmin, Locality)
+
+    def test_state(self):
+        self.assertConstantQueries(StateAdmin, State)
+
+    @override_settings(ADDRESS_LOCALITY_INDEX=True)
+    def test_locality_search(self):
+        locality_index.clear()
+        model_admin = LocalityAdmin(Locality, self.site)
+        qs, distinct = model_admin.get_search_results(self.request, model_admin.get_queryset(self.request), 'locality 3')
+        self.assertEqual([l.name for l in qs], ['Locality 3'])
+        qs, distinct = model_admin.get_search_results(self.request, model_admin.get_queryset(self.request), 'cality')
+        self.assertEqual(list(qs), [])
+        locality_index.clear()
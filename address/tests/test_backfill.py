@@ -0,0 +1,114 @@
+from django.core.management import call_command, CommandError
+from django.test import TestCase
+from django.utils.six import StringIO
+from address.backfill import BackfillTask, run_backfill
+from address.models import *
+from address.models import BackfillCheckpoint, make_dedupe_key
+
+class RawUpperTask(BackfillTask):
+    name = 'test_raw_upper'
+    fail_at = None
+
+    def process(self, objs):
+        for obj in objs:
+            if obj.raw == self.fail_at:
+                raise ValueError
+            Address.objects.filter(pk=obj.pk).update(raw=obj.raw.upper())
+
+class BackfillTestCase(TestCase):
+
+    def setUp(self):
+        self.ads = [Address.objects.create(raw='address %d'%ii) for ii in range(5)]
+
+    def raws(self):
+        return list(Address.objects.order_by('pk').values_list('raw', flat=True))
+
+    def test_run(self):
+        out = StringIO()
+        checkpoint = run_backfill(RawUpperTask(), batch_size=2, stdout=out)
+        self.assertEqual(self.raws(), ['ADDRESS %d'%ii for ii in range(5)])
+        self.assertEqual(checkpoint.rows, 5)
+        self.assertEqual(checkpoint.last_pk, self.ads[-1].pk)
+        self.assertTrue(checkpoint.finished)
+        self.assertEqual(len(out.getvalue().splitlines()), 3)
+        self.assertIn('rows/sec', out.getvalue())
+
+    def test_resume(self):
+        task = RawUpperTask()
+        task.fail_at = 'address 3'
+        self.assertRaises(ValueError, run_backfill, task, batch_size=2)
+        checkpoint = BackfillCheckpoint.objects.get(task=task.name)
+        self.assertEqual(checkpoint.last_pk, self.ads[1].pk)
+        self.assertEqual(checkpoint.finished, None)
+        self.assertEqual(self.raws()[:4], ['ADDRESS 0', 'ADDRESS 1', 'address 2', 'address 3'])
+
+        # Resuming doesn't reprocess the first batch.
+        Address.objects.filter(pk=self.ads[0].pk).update(raw='address 0')
+        task.fail_at = None
+        checkpoint = run_backfill(task, batch_size=2)
+        self.assertEqual(checkpoint.rows, 5)
+        self.assertEqual(self.raws(), ['address 0'] + ['ADDRESS %d'%ii for ii in range(1, 5)])
+
+    def test_restart(self):
+        run_backfill(RawUpperTask(), batch_size=2)
+        Address.objects.update(raw='x')
+        checkpoint = run_backfill(RawUpperTask(), restart=True)
+        self.assertEqual(checkpoint.rows, 5)
+        self.assertEqual(set(self.raws()), set(['X']))
+
+    def test_limit(self):
+        checkpoint = run_backfill(RawUpperTask(), batch_size=2, limit=3)
+        self.assertEqual(checkpoint.rows, 3)
+        self.assertEqual(checkpoint.finished, None)
+
+    def test_dedupe_key_task(self):
+        au = Country.objects.create(name='Australia', code='AU')
+        vic = State.objects.create(name='Victoria', code='VIC', country=au)
+        nco = Locality.objects.create(name='Northcote', postal_code='3070', state=vic)
+        Address.objects.bulk_create([Address(street_number='1', route='Some Street', locality=nco, raw='a'),
+                                     Address(street_number='1', route='Some Street', locality=nco, raw='b')])
+        out = StringIO()
+        call_command('address_backfill', 'dedupe_key', batch_size=3, stdout=out)
+        self.assertIn('finished, 7 rows', out.getvalue())
+        keys = dict(Address.objects.values_list('raw', 'dedupe_key'))
+        self.assertEqual(keys['a'], make_dedupe_key('1', 'Some Street', nco.pk, ''))
+        self.assertEqual(keys['b'], None)
+        self.assertEqual(keys['address 0'], make_dedupe_key('', '', None, 'address 0'))
+
+    def test_dedupe_key_task_swap(self):
+        au = Country.objects.create(name='Australia', code='AU')
+        vic = State.objects.create(name='Victoria', code='VIC', country=au)
+        nco = Locality.objects.create(name='Northcote', postal_code='3070', state=vic)
+        key = make_dedupe_key('1', 'Some Street', nco.pk, '')
+        Address.objects.bulk_create([Address(street_number='1', route='Some St', locality=nco, raw='a',
+                                             dedupe_key='old'),
+                                     Address(street_number='1', route='Some Street', locality=nco, raw='b',
+                                             dedupe_key=key),
+                                     Address(street_number='2', route='Some St', locality=nco, raw='c',
+                                             dedupe_key='old 2')])
+        call_command('address_backfill', 'dedupe_key', verbosity=0)
+        keys = dict(Address.objects.values_list('raw', 'dedupe_key'))
+        self.assertEqual(keys['a'], None)
+        self.assertEqual(keys['b'], key)
+        self.assertEqual(keys['c'], make_dedupe_key('2', 'Some Street', nco.pk, ''))
+
+    def test_prefix_key_tasks(self):
+        au = Country.objects.create(name='Australia', code='AU')
+        vic = State.objects.create(name='Victoria', code='VIC', country=au)
+        nco = Locality.objects.create(name='Northcote', postal_code='3070', state=vic)
+        Locality.objects.update(name_key=None, postal_code_key=None)
+        Address.objects.create(street_number='1', route='Some St.', locality=nco, raw='a')
+        Address.objects.update(route_key=None)
+        call_command('address_backfill', 'locality_keys', verbosity=0)
+        call_command('address_backfill', 'route_key', verbosity=0)
+        self.assertEqual(Locality.objects.values_list('name_key', 'postal_code_key').get(), ('northcote', '3070'))
+        self.assertEqual(Address.objects.get(raw='a').route_key, 'some st')
+        self.assertEqual(Address.objects.get(raw='address 0').route_key, '')
+
+    def test_command_list(self):
+        out = StringIO()
+        call_command('address_backfill', list=True, stdout=out)
+        self.assertIn('dedupe_key', out.getvalue())
+
+    def test_command_unknown(self):
+        self.assertRaises(CommandError, call_command, 'address_backfill', 'nothing')
@@ -0,0 +1,44 @@
+import json
+
+from django.core.management import call_command, CommandError
+from django.test import TestCase
+from django.utils.six import StringIO
+from address.management.commands import address_benchmark
+from address.models import *
+
+class BenchmarkCommandTestCase(TestCase):
+
+    def test_json(self):
+        Address.objects.create(raw='Elsewhere')
+        out = StringIO()
+        call_command('address_benchmark', scale=[200], calls=10, interactive=False, stdout=out)
+        runs = json.loads(out.getvalue())['runs']
+        self.assertEqual([r['scale'] for r in runs], [200])
+        results = dict((r['name'], r) for r in runs[0]['results'])
+        self.assertEqual(sorted(results), sorted([
+            'to_python', 'to_python (new)', '_to_python', 'Address.as_dict',
+            'AddressWidget.render', 'forms.AddressField.to_python',
+        ]))
+        for res in results.values():
+            self.assertEqual(res['count'], 10)
+            self.assertLessEqual(res['p50_ms'], res['p99_ms'])
+        self.assertEqual(results['Address.as_dict']['queries_per_call'], 0)
+        self.assertGreater(results['to_python (new)']['queries_per_call'], 0)
+
+        # The benchmark data is removed.
+        self.assertEqual(list(Address.objects.values_list('raw', flat=True)), ['Elsewhere'])
+        self.assertEqual(Country.objects.count(), 0)
+
+    def test_confirm(self):
+        prompts = []
+
+        def no(prompt):
+            prompts.append(prompt)
+            return 'no'
+        original, address_benchmark.input = address_benchmark.input, no
+        try:
+            self.assertRaises(CommandError, call_command, 'address_benchmark', scale=[200], calls=10, stdout=StringIO())
+        finally:
+            address_benchmark.input = original
+        self.assertIn('200 synthetic addresses', prompts[0])
+        self.assertEqual(Address.objects.count(), 0)
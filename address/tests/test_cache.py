@@ -0,0 +1,183 @@
+import os
+import tempfile
+from django.core.cache import caches
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.db import transaction
+from address.cache import KEY_VERSION, LRUCache, HierarchyCache, hierarchy_cache
+from address.models import *
+from address.models import to_python
+
+class LRUCacheTestCase(TestCase):
+
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(len(cache), 2)
+
+    def test_disabled(self):
+        cache = LRUCache(0)
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), None)
+
+class HierarchyCacheTestCase(TransactionTestCase):
+
+    def setUp(self):
+        hierarchy_cache.clear()
+        self.ad = {
+            'raw': '1 Somewhere Street, Northcote, Victoria 3070, VIC, AU',
+            'street_number': '1',
+            'route': 'Somewhere Street',
+            'locality': 'Northcote',
+            'postal_code': '3070',
+            'state': 'Victoria',
+            'state_code': 'VIC',
+            'country': 'Australia',
+            'country_code': 'AU'
+        }
+
+    def tearDown(self):
+        hierarchy_cache.clear()
+
+    def test_cached(self):
+        obj = to_python(self.ad)
+        with self.assertNumQueries(1):
+            self.assertEqual(to_python(self.ad), obj)
+
+    def test_new_address_cached_hierarchy(self):
+        to_python(self.ad)
+        # The address lookup, then the insert in a savepoint of the
+        # conversion's transaction.
+        with self.assertNumQueries(5):
+            to_python(dict(self.ad, street_number='2'))
+
+    def test_rename(self):
+        obj = to_python(self.ad)
+        loc = obj.locality
+        loc.name = 'Fitzroy'
+        loc.save()
+        res = to_python(self.ad)
+        self.assertNotEqual(res.locality.pk, loc.pk)
+        self.assertEqual(res.locality.name, 'Northcote')
+
+    def test_rename_parent(self):
+        to_python(self.ad)
+        state = State.objects.get(name='Victoria')
+        state.name = 'Vic2'
+        state.save()
+        res = to_python(dict(self.ad, street_number='2', state='Vic2'))
+        self.assertEqual(res.locality.state.pk, state.pk)
+        self.assertEqual(res.state_name, 'Vic2')
+        self.assertEqual(Address.objects.get(pk=res.pk).state_name, 'Vic2')
+
+    def test_fresh_instances(self):
+        to_python(self.ad)
+        loc = hierarchy_cache.get(Locality, ('Northcote', '3070', State.objects.get().pk))
+        loc.name = 'Changed'
+        self.assertEqual(hierarchy_cache.get(Locality, ('Northcote', '3070', loc.state_id)).name, 'Northcote')
+
+    def test_delete(self):
+        obj = to_python(self.ad)
+        obj.locality.state.country.delete()
+        res = to_python(self.ad)
+        self.assertNotEqual(res.locality.state.country.pk, obj.locality.state.country.pk)
+
+    def test_rollback_not_cached(self):
+        try:
+            with transaction.atomic():
+                to_python(self.ad)
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(hierarchy_cache.get(Country, ('Australia',)), None)
+        self.assertEqual(to_python(self.ad).locality.name, 'Northcote')
+
+    @override_settings(ADDRESS_HIERARCHY_CACHE_SIZE=0)
+    def test_disabled(self):
+        to_python(self.ad)
+        with self.assertNumQueries(4):
+            to_python(self.ad)
+
+class SharedHierarchyCacheTestCase(TransactionTestCase):
+    cache_settings = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+
+    def setUp(self):
+        hierarchy_cache.clear()
+        self.override = override_settings(
+            CACHES={'default': self.cache_settings, 'address': self.cache_settings},
+            ADDRESS_HIERARCHY_CACHE_ALIAS='address',
+            ADDRESS_HIERARCHY_CACHE_SIZE=0,
+        )
+        self.override.enable()
+        caches['address'].clear()
+        self.ad = {
+            'raw': '1 Somewhere Street, Northcote, Victoria 3070, VIC, AU',
+            'street_number': '1',
+            'route': 'Somewhere Street',
+            'locality': 'Northcote',
+            'postal_code': '3070',
+            'state': 'Victoria',
+            'state_code': 'VIC',
+            'country': 'Australia',
+            'country_code': 'AU'
+        }
+
+    def tearDown(self):
+        caches['address'].clear()
+        self.override.disable()
+        hierarchy_cache.clear()
+
+    def test_cached(self):
+        obj = to_python(self.ad)
+        with self.assertNumQueries(1):
+            res = to_python(self.ad)
+        self.assertEqual(res, obj)
+        self.assertEqual(res.locality, obj.locality)
+        self.assertEqual(res.locality.postal_code, '3070')
+
+    def test_rename(self):
+        obj = to_python(self.ad)
+        state = obj.locality.state
+        state.name = 'Tasmania'
+        state.save()
+        self.assertEqual(hierarchy_cache.get(State, ('Victoria', state.country_id)), None)
+        self.assertEqual(hierarchy_cache.get(Locality, ('Northcote', '3070', state.pk)), obj.locality)
+        res = to_python(self.ad)
+        self.assertNotEqual(res.locality.state.pk, state.pk)
+
+    def test_delete(self):
+        obj = to_python(self.ad)
+        obj.locality.delete()
+        self.assertEqual(hierarchy_cache.get(Locality, ('Northcote', '3070', obj.locality.state_id)), None)
+
+    def test_local_layer_populated(self):
+        to_python(self.ad)
+        with override_settings(ADDRESS_HIERARCHY_CACHE_SIZE=10):
+            self.assertTrue(hierarchy_cache.get(Country, ('Australia',)))
+            caches['address'].delete(hierarchy_cache._shared_key(Country, ('Australia',)), version=KEY_VERSION)
+            self.assertTrue(hierarchy_cache.get(Country, ('Australia',)))
+
+            # Without the generation the local entries can't be trusted.
+            caches['address'].clear()
+            self.assertEqual(hierarchy_cache.get(Country, ('Australia',)), None)
+
+    def test_other_process(self):
+        obj = to_python(self.ad)
+        with override_settings(ADDRESS_HIERARCHY_CACHE_SIZE=10):
+            other = HierarchyCache()
+            self.assertEqual(other.get(Country, ('Australia',)), obj.locality.state.country)
+            country = Country.objects.get()
+            country.name = 'Oz'
+            country.save()
+            self.assertEqual(other.get(Country, ('Australia',)), None)
+
+class FileSharedHierarchyCacheTestCase(SharedHierarchyCacheTestCase):
+    cache_settings = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'address_test_cache'),
+    }
@@ -0,0 +1,119 @@
+from django.core.management import call_command, CommandError
+from django.test import TestCase
+from django.utils.six import StringIO
+from address.dedupe import MergeError, similarity, find_duplicates, merge, dedupe
+from address.models import *
+from address.models import ResolvedRaw, make_dedupe_key, to_python
+from address.tests.models import Account, TestModelsMixin
+
+class DedupeTestCase(TestModelsMixin, TestCase):
+    test_models = (Account,)
+
+    def setUp(self):
+        self.au = Country.objects.create(name='Australia', code='AU')
+        self.vic = State.objects.create(name='Victoria', code='VIC', country=self.au)
+        self.vic2 = State.objects.create(name='Victoria.', code='', country=self.au)
+        self.nsw = State.objects.create(name='Victorie', code='NSW', country=self.au)
+        self.nco = Locality.objects.create(name='Northcote', postal_code='3070', state=self.vic)
+        self.nco2 = Locality.objects.create(name='Northcot', postal_code='3070', state=self.vic)
+        self.nco3 = Locality.objects.create(name='Northcote', postal_code='3070', state=self.vic2)
+        self.fitz = Locality.objects.create(name='Fitzroy', postal_code='3070', state=self.vic)
+        self.ad1 = Address.objects.create(street_number='1', route='Some Street', locality=self.nco, raw='a')
+        self.ad2 = Address.objects.create(street_number='1', route='Some Street', locality=self.nco2, raw='b')
+        self.ad3 = Address.objects.create(street_number='1', route='Some Stret', locality=self.nco3, raw='c')
+        self.ad4 = Address.objects.create(street_number='2', route='Some Street', locality=self.nco3, raw='d')
+        self.ad5 = Address.objects.create(street_number='1', route='Other Street', locality=self.nco, raw='e')
+
+    def test_similarity(self):
+        self.assertEqual(similarity('northcote', 'northcote'), 1.0)
+        self.assertGreater(similarity('northcote', 'northcot'), 0.9)
+        self.assertLess(similarity('northcote', 'fitzroy'), 0.5)
+
+    def test_find_duplicates(self):
+        states = list(find_duplicates('states'))
+        self.assertEqual([(s[0], [d[0][0] for d in ds]) for s, ds in states], [(self.vic.pk, [self.vic2.pk])])
+        localities = list(find_duplicates('localities'))
+        self.assertEqual([(s[0], [d[0][0] for d in ds]) for s, ds in localities], [(self.nco.pk, [self.nco2.pk])])
+        self.assertEqual(list(find_duplicates('addresses')), [])
+
+    def test_merge_locality(self):
+        ResolvedRaw.objects.create(key='x', raw='b', address=self.ad2)
+        merge(Locality, self.nco.pk, [self.nco2.pk])
+        self.assertFalse(Locality.objects.filter(pk=self.nco2.pk).exists())
+        ad2 = Address.objects.get(pk=self.ad2.pk)
+        self.assertEqual(ad2.locality, self.nco)
+        self.assertEqual(ad2.locality_name, 'Northcote')
+        self.assertEqual(ad2.dedupe_key, None)
+
+        # Now a duplicate address.
+        self.assertEqual(dedupe(['addresses']), {'addresses': 1})
+        self.assertFalse(Address.objects.filter(pk=self.ad2.pk).exists())
+        self.assertEqual(ResolvedRaw.objects.get().address, self.ad1)
+
+    def test_merge_state(self):
+        merge(State, self.vic.pk, [self.vic2.pk])
+        self.assertFalse(State.objects.filter(pk=self.vic2.pk).exists())
+        self.assertFalse(Locality.objects.filter(pk=self.nco3.pk).exists())
+        ad3 = Address.objects.get(pk=self.ad3.pk)
+        self.assertEqual(ad3.locality, self.nco)
+        self.assertEqual(ad3.state_name, 'Victoria')
+        self.assertEqual(ad3.dedupe_key, make_dedupe_key('1', 'Some Stret', self.nco.pk, ''))
+        self.assertEqual(Address.objects.get(pk=self.ad4.pk).locality, self.nco)
+
+    def test_merge_state_clash(self):
+        tas = State.objects.create(name='Tasmania', country=self.au)
+        hobarts = []
+        for name in ('Tasmania.', 'Tasmaniaa'):
+            state = State.objects.create(name=name, country=self.au)
+            hobart = Locality.objects.create(name='Hobart', postal_code='7000', state=state)
+            Address.objects.create(street_number='1', route='Some Street', locality=hobart, raw=name)
+            hobarts.append(state.pk)
+        merge(State, tas.pk, hobarts)
+        hobart = Locality.objects.get(name='Hobart')
+        self.assertEqual(hobart.state, tas)
+        self.assertEqual(sorted(Address.objects.filter(locality=hobart).values_list('raw', 'state_name')),
+                         [('Tasmania.', 'Tasmania'), ('Tasmaniaa', 'Tasmania')])
+
+    def test_merge_one_to_one(self):
+        account = Account.objects.create(address=self.ad2)
+        merge(Address, self.ad1.pk, [self.ad2.pk])
+        self.assertEqual(Account.objects.get(pk=account.pk).address_id, self.ad1.pk)
+
+        # Each would be left pointing at the survivor.
+        Account.objects.create(address=self.ad3)
+        with self.assertRaises(MergeError):
+            merge(Address, self.ad1.pk, [self.ad3.pk])
+        self.assertTrue(Address.objects.filter(pk=self.ad3.pk).exists())
+
+    def test_dedupe_skipped(self):
+        Account.objects.create(address=self.ad1)
+        Account.objects.create(address=self.ad2)
+        out = StringIO()
+        stats = dedupe(['localities', 'addresses'], stdout=out)
+        self.assertEqual(stats, {'localities': 1})
+        self.assertIn('Skipped: Address %d and its duplicates'%self.ad1.pk, out.getvalue())
+        self.assertTrue(Address.objects.filter(pk=self.ad2.pk).exists())
+
+    def test_dedupe(self):
+        out = StringIO()
+        stats = dedupe(stdout=out)
+        self.assertEqual(stats, {'states': 1, 'localities': 1, 'addresses': 2})
+        self.assertIn('Merging Locality %d "Northcot 3070" into %d "Northcote 3070"'%(self.nco2.pk, self.nco.pk),
+                      out.getvalue())
+        self.assertEqual(list(Address.objects.order_by('pk').values_list('pk', flat=True)),
+                         [self.ad1.pk, self.ad4.pk, self.ad5.pk])
+        self.assertEqual(to_python({'raw': 'x', 'street_number': '1', 'route': 'Some St', 'locality': 'Northcote',
+                                    'postal_code': '3070', 'state': 'Victoria', 'country': 'Australia'}), self.ad1)
+        self.assertEqual(dedupe(), {})
+
+    def test_command(self):
+        out = StringIO()
+        call_command('address_dedupe', dry_run=True, stdout=out)
+        self.assertIn('Would merge State %d "Victoria."'%self.vic2.pk, out.getvalue())
+        self.assertIn('localities: 1 to merge', out.getvalue())
+        self.assertEqual(Locality.objects.count(), 4)
+
+        out = StringIO()
+        call_command('address_dedupe', 'localities', threshold=0.8, stdout=out)
+        self.assertEqual(out.getvalue(), 'localities: 1 merged\n')
+        self.assertRaises(CommandError, call_command, 'address_dedupe', 'countries')
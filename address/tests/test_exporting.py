@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.six import StringIO
+from address.exporting import iter_addresses, export_addresses
+from address.models import *
+
+class ExportTestCase(TestCase):
+
+    def setUp(self):
+        au = Country.objects.create(name='Australia', code='AU')
+        vic = State.objects.create(name='Victoria', code='VIC', country=au)
+        nco = Locality.objects.create(name='Northcote', postal_code='3070', state=vic)
+        self.ad1 = Address.objects.create(street_number='1', route='Some Street', locality=nco,
+                                          raw='1 Some Street, Northcote')
+        self.ad2 = Address.objects.create(raw='Somewhere')
+
+    def test_iter_addresses(self):
+        Address.objects.filter(pk=self.ad1.pk).update(locality_name=None)
+        with self.assertNumQueries(1):
+            rows = list(iter_addresses())
+        self.assertEqual(rows, [Address.objects.get(pk=self.ad1.pk).as_dict(), self.ad2.as_dict()])
+        self.assertEqual(rows[0]['country_code'], 'AU')
+
+    def test_iter_queryset(self):
+        rows = list(iter_addresses(Address.objects.filter(locality=None)))
+        self.assertEqual([r['raw'] for r in rows], ['Somewhere'])
+
+    def test_csv(self):
+        out = StringIO()
+        self.assertEqual(export_addresses(out, format='csv'), 2)
+        rows = list(csv.DictReader(StringIO(out.getvalue())))
+        self.assertEqual(rows[0]['route'], 'Some Street')
+        self.assertEqual(rows[0]['state_code'], 'VIC')
+        self.assertEqual(rows[1]['locality'], '')
+
+    def test_jsonl(self):
+        out = StringIO()
+        export_addresses(out, format='ndjson')
+        rows = [json.loads(l) for l in out.getvalue().splitlines()]
+        self.assertEqual(rows, [self.ad1.as_dict(), self.ad2.as_dict()])
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, export_addresses, StringIO(), format='xml')
+
+    def test_command(self):
+        Address.objects.create(raw='Café Crème')
+        out = StringIO()
+        call_command('export_addresses', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 3)
+
+        dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(dir, 'out.csv')
+            out = StringIO()
+            call_command('export_addresses', path, stdout=out)
+            self.assertIn('Exported 3 addresses', out.getvalue())
+            with io.open(path, encoding='utf-8') as f:
+                self.assertEqual(f.readline().strip(), 'raw,formatted,street_number,route,locality,postal_code,'
+                                 'state,state_code,country,country_code,latitude,longitude')
+                self.assertEqual(f.read().splitlines()[-1].split(',')[0], 'Café Crème')
+            path = os.path.join(dir, 'out.ndjson')
+            call_command('export_addresses', path, stdout=StringIO())
+            with io.open(path, encoding='utf-8') as f:
+                self.assertEqual(json.loads(f.read().splitlines()[-1])['raw'], 'Café Crème')
+        finally:
+            shutil.rmtree(dir)
@@ -1,7 +1,7 @@
-from django.test import TestCase
-from django.forms import ValidationError, Form
-from address.forms import AddressField, AddressWidget
-from address.models import Address
+from django.test import TestCase, override_settings
+from django.forms import ValidationError, Form, formset_factory
+from address.forms import AddressField, AddressWidget, prefetch_addresses
+from address.models import Address, Country, State, Locality
 
 class TestForm(Form):
     address = AddressField()
@@ -71,3 +71,58 @@ class AddressWidgetTestCase(TestCase):
         self.assertEqual(wid.attrs['size'], '150')
         html = wid.render('test', None)
         self.assertNotEqual(html.find('size="150"'), -1)
+
+    def test_render_pk(self):
+        au = Country.objects.create(name='Australia', code='AU')
+        vic = State.objects.create(name='Victoria', code='VIC', country=au)
+        nco = Locality.objects.create(name='Northcote', postal_code='3070', state=vic)
+        ad = Address.objects.create(street_number='1', route='Some Street', locality=nco, raw='1 Some Street')
+        wid = AddressWidget()
+        with self.assertNumQueries(1):
+            html = wid.render('test', ad.pk)
+        self.assertIn('value="Australia"', html)
+        self.assertIn('value="VIC"', html)
+
+    def test_autocomplete_url(self):
+        html = AddressWidget(autocomplete_url='/address/autocomplete/').render('test', None)
+        self.assertIn('data-autocomplete-url="/address/autocomplete/"', html)
+        self.assertNotIn('data-autocomplete-url', AddressWidget().render('test', None))
+        with override_settings(ADDRESS_AUTOCOMPLETE_URL='/complete/'):
+            self.assertIn('data-autocomplete-url="/complete/"', AddressWidget().render('test', None))
+
+    def test_media(self):
+        self.assertIn('js/jquery.geocomplete.min.js', str(AddressWidget().media))
+        media = str(AddressWidget(use_google=False).media)
+        self.assertNotIn('geocomplete', media)
+        self.assertNotIn('googleapis', media)
+        self.assertIn('address/js/address.js', media)
+
+    def test_render_escapes(self):
+        html = AddressWidget().render('test', {'route': '"><script>', 'locality': None})
+        self.assertIn('name="test_route" data-geo="route" value="&quot;&gt;&lt;script&gt;"', html)
+        self.assertIn('name="test_locality" data-geo="locality" value=""', html)
+        self.assertNotIn('<script>', html)
+
+class PrefetchAddressesTestCase(TestCase):
+
+    def setUp(self):
+        au = Country.objects.create(name='Australia', code='AU')
+        vic = State.objects.create(name='Victoria', code='VIC', country=au)
+        nco = Locality.objects.create(name='Northcote', postal_code='3070', state=vic)
+        self.ads = [
+            Address.objects.create(street_number=str(ii), route='Some Street', locality=nco, raw='%d Some Street'%ii)
+            for ii in range(5)
+        ]
+        self.formset = formset_factory(TestForm, extra=0)(initial=[{'address': a.pk} for a in self.ads])
+
+    def test_prefetch(self):
+        prefetch_addresses(self.formset)
+        with self.assertNumQueries(0):
+            html = self.formset.as_table()
+        for ad in self.ads:
+            self.assertIn('name="form-%d-address_street_number" data-geo="street_number" value="%s"'%(
+                int(ad.street_number), ad.street_number), html)
+
+    def test_without_prefetch(self):
+        with self.assertNumQueries(len(self.ads)):
+            self.formset.as_table()
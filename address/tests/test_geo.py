@@ -0,0 +1,91 @@
+from django.test import SimpleTestCase, TestCase
+from address import geo
+from address.backfill import run_backfill
+from address.benchmarks import spatial
+from address.models import *
+
+class GeoTestCase(SimpleTestCase):
+
+    def test_encode(self):
+        self.assertEqual(geo.encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(geo.encode(-37.7702, 144.9973), geo.encode(-37.7702, 144.9973, 12))
+        self.assertEqual(geo.encode(90, 180, 2), 'zz')
+        self.assertEqual(geo.encode(-90, -180, 2), '00')
+
+    def test_distance(self):
+        self.assertEqual(geo.distance(-37.8, 145.0, -37.8, 145.0), 0)
+        self.assertAlmostEqual(geo.distance(-37.8136, 144.9631, -33.8688, 151.2093), 713.4, 0)
+
+    def test_bounding_box(self):
+        box = geo.bounding_box(-37.8, 145.0, 10)
+        self.assertAlmostEqual(box[2] - box[0], 2*10/111.195, 3)
+        self.assertLess(box[1], box[3])
+        box = geo.bounding_box(0, 179.99, 10)
+        self.assertGreater(box[1], box[3])
+        self.assertEqual(geo.bounding_box(89.99, 0, 10)[1:4:2], (-180.0, 180.0))
+
+    def test_cover(self):
+        lat, lng = -37.8, 145.0
+        box = geo.bounding_box(lat, lng, 5)
+        cells = geo.cover(*box)
+        self.assertLessEqual(len(cells), geo.MAX_CELLS)
+        self.assertTrue(any(geo.encode(lat, lng).startswith(c) for c in cells))
+        for corner in ((box[0], box[1]), (box[2], box[3]), (box[0], box[3]), (box[2], box[1])):
+            self.assertTrue(any(geo.encode(*corner).startswith(c) for c in cells))
+
+        # Across the antimeridian.
+        cells = geo.cover(*geo.bounding_box(0, 179.99, 10))
+        self.assertTrue(any(geo.encode(0, -179.99).startswith(c) for c in cells))
+        self.assertTrue(any(geo.encode(0, 179.99).startswith(c) for c in cells))
+
+class SpatialQueryTestCase(TestCase):
+
+    def setUp(self):
+        self.points = {
+            'cbd': (-37.8136, 144.9631),
+            'northcote': (-37.7702, 144.9973),
+            'fitzroy': (-37.7986, 144.9786),
+            'geelong': (-38.1499, 144.3617),
+            'sydney': (-33.8688, 151.2093),
+            'suva': (-18.1416, 178.4419),
+            'apia': (-13.8333, -171.7500),
+        }
+        for name, (lat, lng) in self.points.items():
+            Address.objects.create(raw=name, latitude=lat, longitude=lng)
+        Address.objects.create(raw='nowhere')
+
+    def test_geohash(self):
+        ad = Address.objects.get(raw='cbd')
+        self.assertEqual(ad.geohash, geo.encode(-37.8136, 144.9631))
+        ad.latitude = None
+        ad.save()
+        self.assertEqual(Address.objects.get(pk=ad.pk).geohash, None)
+
+    def test_within_radius(self):
+        res = Address.objects.within_radius(-37.8136, 144.9631, 10)
+        self.assertEqual([a.raw for a in res], ['cbd', 'fitzroy', 'northcote'])
+        self.assertEqual(res[0].distance, 0)
+        self.assertEqual([a.raw for a in Address.objects.within_radius(-37.8136, 144.9631, 1000)],
+                         ['cbd', 'fitzroy', 'northcote', 'geelong', 'sydney'])
+        self.assertEqual(Address.objects.filter(raw='cbd').within_radius(-37.8, 145.0, 1000)[0].raw, 'cbd')
+        self.assertEqual(Address.objects.within_radius(0, 0, 100), [])
+
+    def test_antimeridian(self):
+        res = Address.objects.within_radius(-16.0, 179.9, 1200)
+        self.assertEqual([a.raw for a in res], ['suva', 'apia'])
+
+    def test_nearest(self):
+        self.assertEqual([a.raw for a in Address.objects.nearest(-37.79, 144.98, 2)], ['fitzroy', 'northcote'])
+        self.assertEqual([a.raw for a in Address.objects.nearest(-33.9, 151.2)], ['sydney'])
+        self.assertEqual(len(Address.objects.nearest(0, 0, 10)), 7)
+
+    def test_backfill(self):
+        Address.objects.update(geohash=None)
+        run_backfill('geohash')
+        self.assertEqual(Address.objects.get(raw='suva').geohash, geo.encode(-18.1416, 178.4419))
+        self.assertEqual(Address.objects.get(raw='nowhere').geohash, None)
+
+    def test_benchmark(self):
+        res = spatial.run(200, queries=3)
+        self.assertEqual(res[0]['found'], res[1]['found'])
+        self.assertEqual(Address.objects.count(), 8)
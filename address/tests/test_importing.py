@@ -0,0 +1,79 @@
+import io
+import os
+import shutil
+import tempfile
+from django.core.management import call_command, CommandError
+from django.test import TestCase
+from django.utils.six import StringIO
+from address.importing import read_rows, map_row, import_rows
+from address.models import *
+
+class ImportTestCase(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        au = Country.objects.create(name='Australia', code='AU')
+        vic = State.objects.create(name='Victoria', code='VIC', country=au)
+        nco = Locality.objects.create(name='Northcote', postal_code='3070', state=vic)
+        self.existing = Address.objects.create(street_number='1', route='Some Street', locality=nco, raw='existing')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, text):
+        path = os.path.join(self.dir, name)
+        with io.open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    def test_read_csv(self):
+        path = self.write('a.csv', u'raw,city\n1 Some Street,Northcote\n"2, Other Street",Fitzroy\n')
+        rows = list(read_rows(path))
+        self.assertEqual(rows[1]['raw'], '2, Other Street')
+        self.assertEqual(rows[1]['city'], 'Fitzroy')
+
+    def test_read_jsonl(self):
+        path = self.write('a.jsonl', u'{"raw": "a"}\n\nnot json\n{"raw": "b"}\n')
+        self.assertEqual(list(read_rows(path)), [{'raw': 'a'}, None, {'raw': 'b'}])
+
+    def test_map_row(self):
+        value = map_row({'addr': 'x', 'city': 'Northcote', 'lat': '1.5', 'longitude': '', 'other': 'y'},
+                        {'addr': 'raw', 'city': 'locality', 'lat': 'latitude'})
+        self.assertEqual(value, {'raw': 'x', 'locality': 'Northcote', 'latitude': 1.5, 'longitude': None})
+
+    def test_import_rows(self):
+        rows = [
+            {'raw': 'x', 'street_number': '1', 'route': 'Some Street', 'locality': 'Northcote',
+             'postal_code': '3070', 'state': 'Victoria', 'country': 'Australia'},
+            {'raw': 'y', 'street_number': '2', 'route': 'Some Street', 'locality': 'Northcote',
+             'postal_code': '3070', 'state': 'Victoria', 'country': 'Australia'},
+            {'raw': ''},
+            {'raw': 'z', 'latitude': 'north'},
+            {'raw': 'w', 'locality': 'Hobart', 'state': 'Tasmania', 'country': 'Australia',
+             'state_code': 'Invalid code'},
+            {'raw': 'only raw'},
+        ]
+        out = StringIO()
+        stats, errors = import_rows(rows, batch_size=4, stdout=out)
+        self.assertEqual(stats['rows'], 6)
+        self.assertEqual(stats['created'], 2)
+        self.assertEqual(stats['reused'], 1)
+        self.assertEqual(stats['skipped'], 1)
+        self.assertEqual(stats['errors'], 2)
+        self.assertEqual([e[0] for e in errors], [4, 5])
+        self.assertIn('row 4: Invalid value for latitude', out.getvalue())
+        self.assertIn('rows/sec', out.getvalue())
+        self.assertTrue(Address.objects.filter(raw='only raw').exists())
+        self.assertFalse(State.objects.filter(name='Tasmania').exists())
+
+    def test_command(self):
+        path = self.write('a.csv', u'address,number,street\nx,1,Some Street\ny,3,Some Street\n')
+        out = StringIO()
+        call_command('import_addresses', path, map=['address=raw', 'number=street_number', 'street=route'],
+                     stdout=out)
+        self.assertIn('Imported 2 rows: 2 created, 0 reused, 0 skipped, 0 errors', out.getvalue())
+        self.assertEqual(Address.objects.filter(route='Some Street', locality=None).count(), 2)
+
+    def test_command_bad_mapping(self):
+        path = self.write('a.csv', u'raw\nx\n')
+        self.assertRaises(CommandError, call_command, 'import_addresses', path, map=['raw=nothing'])
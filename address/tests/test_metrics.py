@@ -0,0 +1,109 @@
+import logging
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, TestCase, override_settings
+from address.metrics import *
+from address.models import *
+from address.models import to_python
+
+class MetricsTestCase(TestCase):
+
+    def setUp(self):
+        self.metrics = MemoryMetrics()
+        self.override = override_settings(ADDRESS_METRICS=self.metrics)
+        self.override.enable()
+        self.value = {
+            'raw': '1 Somewhere Street, Northcote, Victoria 3070, VIC, AU',
+            'street_number': '1',
+            'route': 'Somewhere Street',
+            'locality': 'Northcote',
+            'postal_code': '3070',
+            'state': 'Victoria',
+            'state_code': 'VIC',
+            'country': 'Australia',
+            'country_code': 'AU'
+        }
+
+    def tearDown(self):
+        self.override.disable()
+
+    def test_to_python(self):
+        to_python(self.value)
+        for level in ('country', 'state', 'locality', 'address'):
+            self.assertEqual(self.metrics.count('created', level=level), 1)
+        self.assertEqual(self.metrics.count('hierarchy_cache', level='country', result='miss'), 1)
+        to_python(dict(self.value, street_number='2'))
+        for level in ('country', 'state', 'locality'):
+            self.assertEqual(self.metrics.count('reused', level=level), 1)
+        self.assertEqual(self.metrics.count('created', level='address'), 2)
+        timings = [e for e in self.metrics.events if e[0] == 'timing']
+        self.assertEqual(sorted(set(e[3].get('level') for e in timings if e[1] == 'level_seconds')),
+                         ['address', 'country', 'locality', 'state'])
+        self.assertEqual(len([e for e in timings if e[1] == 'to_python_seconds']), 2)
+
+    def test_inconsistent(self):
+        to_python({'raw': 'Somewhere', 'country': 'Australia'})
+        self.assertEqual(self.metrics.count('inconsistent_dict'), 1)
+
+    @override_settings(ADDRESS_RESOLUTION_CACHE=True)
+    def test_resolution_cache(self):
+        to_python('1 Somewhere Street')
+        to_python('1 Somewhere Street')
+        self.assertEqual(self.metrics.count('resolution_cache', result='miss'), 1)
+        self.assertEqual(self.metrics.count('resolution_cache', result='hit'), 1)
+
+class BackendsTestCase(SimpleTestCase):
+
+    def test_statsd(self):
+        lines = []
+        metrics = StatsdMetrics(sink=lines.append)
+        metrics.incr('created', level='country')
+        metrics.timing('level_seconds', 0.0015, level='state')
+        metrics.incr('inconsistent_dict', 2)
+        self.assertEqual(lines, ['address.created.country:1|c', 'address.level_seconds.state:1.500|ms',
+                                 'address.inconsistent_dict:2|c'])
+
+    def test_prometheus(self):
+        metrics = PrometheusMetrics(buckets=(0.001, 0.01))
+        metrics.incr('created', level='country')
+        metrics.incr('created', level='country')
+        metrics.incr('created', level='say "hi"')
+        metrics.timing('level_seconds', 0.005, level='state')
+        self.assertEqual(metrics.render(), '\n'.join([
+            '# TYPE address_created_total counter',
+            'address_created_total{level="country"} 2',
+            'address_created_total{level="say \\"hi\\""} 1',
+            '# TYPE address_level_seconds histogram',
+            'address_level_seconds_bucket{level="state",le="0.001"} 0',
+            'address_level_seconds_bucket{level="state",le="0.01"} 1',
+            'address_level_seconds_bucket{level="state",le="+Inf"} 1',
+            'address_level_seconds_sum{level="state"} 0.005',
+            'address_level_seconds_count{level="state"} 1',
+        ]) + '\n')
+
+    def test_logging(self):
+        records = []
+        handler = logging.Handler(logging.DEBUG)
+        handler.emit = records.append
+        logger = logging.getLogger('address.models')
+        level = logger.level
+        logger.addHandler(handler)
+        logger.setLevel(logging.DEBUG)
+        try:
+            LoggingMetrics().incr('created', level='country')
+        finally:
+            logger.removeHandler(handler)
+            logger.setLevel(level)
+        self.assertEqual([(r.levelno, r.getMessage()) for r in records],
+                         [(logging.DEBUG, 'metric created +1 level=country')])
+
+    def test_get_metrics(self):
+        self.assertIsInstance(get_metrics(), LoggingMetrics)
+        with override_settings(ADDRESS_METRICS='address.metrics.StatsdMetrics',
+                               ADDRESS_METRICS_OPTIONS={'prefix': 'x'}):
+            self.assertEqual(get_metrics().prefix, 'x')
+            self.assertIs(get_metrics(), get_metrics())
+        with override_settings(ADDRESS_METRICS=None):
+            self.assertIsInstance(get_metrics(), NullMetrics)
+        with override_settings(ADDRESS_METRICS='address.nothing.Metrics'):
+            self.assertRaises(ImproperlyConfigured, get_metrics)
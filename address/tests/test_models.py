@@ -1,9 +1,24 @@
-from django.test import TestCase
-from django.db import IntegrityError
+import importlib
+from unittest import skipUnless
+import threading
+import time
+from datetime import timedelta
+from django.apps import apps
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import IntegrityError, OperationalError, connection
+from django.db.backends.utils import CursorWrapper
 from django.core.exceptions import ValidationError
 from django.db.models import Model
+from django.utils import timezone
+from django.utils.six import StringIO
 from address.models import *
-from address.models import to_python
+from address.models import to_python, bulk_to_python, make_dedupe_key, prune_resolutions, resolution_stats
+from address.models import resolve_pending, unit_of_work
+from address.models import ResolvedRaw
+from address.cache import hierarchy_cache
+from address.tests.models import Order, Shipment, TestModelsMixin
 
 # Python 3 fixes.
 import sys
@@ -313,3 +328,635 @@ class AddressFieldTestCase(TestCase):
     #     self.assertEqual(test.address.locality.state.code, self.ad1_dict['state_code'])
     #     self.assertEqual(test.address.locality.state.country.name, self.ad1_dict['country'])
     #     self.assertEqual(test.address.locality.state.country.code, self.ad1_dict['country_code'])
+
+class BulkToPythonTestCase(TestCase):
+
+    def setUp(self):
+        self.au = Country.objects.create(name='Australia', code='AU')
+        self.au_vic = State.objects.create(name='Victoria', code='VIC', country=self.au)
+        self.au_vic_nco = Locality.objects.create(name='Northcote', postal_code='3070', state=self.au_vic)
+        self.ad1 = Address.objects.create(street_number='1', route='Somewhere Street', locality=self.au_vic_nco,
+                                          raw='1 Somewhere Street, Northcote, Victoria 3070, VIC, AU')
+        self.ad1_dict = {
+            'raw': '1 Somewhere Street, Northcote, Victoria 3070, VIC, AU',
+            'street_number': '1',
+            'route': 'Somewhere Street',
+            'locality': 'Northcote',
+            'postal_code': '3070',
+            'state': 'Victoria',
+            'state_code': 'VIC',
+            'country': 'Australia',
+            'country_code': 'AU'
+        }
+        self.new_dict = {
+            'raw': '2 Other Street, Hobart, Tasmania 7000, TAS, AU',
+            'street_number': '2',
+            'route': 'Other Street',
+            'locality': 'Hobart',
+            'postal_code': '7000',
+            'state': 'Tasmania',
+            'state_code': 'TAS',
+            'country': 'Australia',
+            'country_code': 'AU'
+        }
+
+    def test_passthrough(self):
+        res = bulk_to_python([None, self.ad1, 3, {'raw': ''}])
+        self.assertEqual(res, [None, self.ad1, 3, None])
+
+    def test_existing(self):
+        res = bulk_to_python([self.ad1_dict])
+        self.assertEqual(res, [self.ad1])
+
+    def test_new_hierarchy(self):
+        res = bulk_to_python([self.new_dict, self.ad1_dict, self.new_dict])
+        self.assertEqual(res[1], self.ad1)
+        self.assertEqual(res[0].pk, res[2].pk)
+        self.assertEqual(res[0].locality.name, 'Hobart')
+        self.assertEqual(res[0].locality.state.code, 'TAS')
+        self.assertEqual(res[0].locality.state.country, self.au)
+        self.assertEqual(res[0].formatted, '2 Other Street, Hobart, Tasmania 7000, Australia')
+        self.assertEqual(Address.objects.count(), 2)
+        self.assertEqual(State.objects.count(), 2)
+
+    def test_same_as_to_python(self):
+        ads = [
+            self.new_dict,
+            {'raw': 'Somewhere', 'locality': 'Northcote', 'country': 'Australia'},
+            {'raw': 'Only raw'},
+            {'raw': '3 Street', 'street_number': '3', 'route': 'Street'},
+            '1 Somewhere Street',
+        ]
+        res = bulk_to_python(ads)
+        for ad, obj in zip(ads, res):
+            self.assertTrue(obj.pk)
+            self.assertEqual(unicode(obj), unicode(to_python(ad)))
+        self.assertEqual(res[2], to_python({'raw': 'Only raw'}))
+        self.assertEqual(res[3], to_python(ads[3]))
+
+    def test_strings_always_create(self):
+        res = bulk_to_python(['Somewhere', 'Somewhere'])
+        self.assertNotEqual(res[0].pk, res[1].pk)
+
+    def test_invalid_country_code(self):
+        ad = dict(self.new_dict, country='Other', country_code='Something else')
+        self.assertRaises(ValueError, bulk_to_python, [self.ad1_dict, ad])
+        self.assertEqual(Country.objects.count(), 1)
+
+    def test_query_count(self):
+        ads = [dict(self.new_dict, street_number=str(ii), raw='%d Other Street'%ii) for ii in range(50)]
+        # Fetch and insert for each level, plus savepoints around the batch
+        # and each insert.
+        with self.assertNumQueries(18):
+            res = bulk_to_python(ads, batch_size=100)
+        self.assertEqual(len(set(r.pk for r in res)), 50)
+        with self.assertNumQueries(6):
+            self.assertEqual(bulk_to_python(ads, batch_size=100), res)
+
+    def test_batches(self):
+        ads = [dict(self.new_dict, street_number=str(ii), raw='%d Other Street'%ii) for ii in range(10)]
+        res = bulk_to_python(ads, batch_size=3)
+        self.assertEqual([r.street_number for r in res], [str(ii) for ii in range(10)])
+
+##
+## A cursor retrying the statements that fail as the database is locked.
+## The in-memory SQLite test database uses a shared cache, whose table locks
+## aren't subject to the busy timeout. These are not the conflicts being
+## tested, and leave the transaction as it was, so the statement is tried
+## again.
+##
+class RetryLockedCursorWrapper(CursorWrapper):
+
+    def execute(self, sql, params=None):
+        for ii in range(50):
+            try:
+                return super(RetryLockedCursorWrapper, self).execute(sql, params)
+            except OperationalError as e:
+                if 'locked' not in str(e):
+                    raise
+                time.sleep(0.01)
+        return super(RetryLockedCursorWrapper, self).execute(sql, params)
+
+##
+## Whether the threads of a test can share the test database. Python 2's
+## sqlite3 can't open a shared in-memory database, each thread would get
+## an empty one.
+##
+def _shared_test_db():
+    return connection.vendor != 'sqlite' or not connection.is_in_memory_db() or \
+        connection.features.can_share_in_memory_db
+
+@skipUnless(_shared_test_db(), 'The test database can\'t be shared between threads.')
+class ConcurrentToPythonTestCase(TransactionTestCase):
+
+    def setUp(self):
+        hierarchy_cache.clear()
+
+    def tearDown(self):
+        hierarchy_cache.clear()
+
+    def test_concurrent_hierarchy(self):
+        n_threads = 8
+        start = threading.Event()
+        results = []
+        errors = []
+
+        def convert(ii):
+            connection.make_cursor = lambda cursor: RetryLockedCursorWrapper(cursor, connection)
+            try:
+                start.wait()
+                results.append(to_python({
+                    'raw': '%d Somewhere Street, Northcote, Victoria 3070, VIC, AU'%ii,
+                    'street_number': str(ii),
+                    'route': 'Somewhere Street',
+                    'locality': 'Northcote',
+                    'postal_code': '3070',
+                    'state': 'Victoria',
+                    'state_code': 'VIC',
+                    'country': 'Australia',
+                    'country_code': 'AU'
+                }))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=convert, args=(ii,)) for ii in range(n_threads)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), n_threads)
+        self.assertEqual(len(set(r.locality_id for r in results)), 1)
+        self.assertEqual(Country.objects.count(), 1)
+        self.assertEqual(State.objects.count(), 1)
+        self.assertEqual(Locality.objects.count(), 1)
+        self.assertEqual(Address.objects.count(), n_threads)
+
+class UnitOfWorkTestCase(TransactionTestCase):
+
+    def setUp(self):
+        hierarchy_cache.clear()
+        self.ad = {
+            'raw': '1 Somewhere Street, Northcote, Victoria 3070, VIC, AU',
+            'street_number': '1',
+            'route': 'Somewhere Street',
+            'locality': 'Northcote',
+            'postal_code': '3070',
+            'state': 'Victoria',
+            'state_code': 'VIC',
+            'country': 'Australia',
+            'country_code': 'AU'
+        }
+
+    def tearDown(self):
+        hierarchy_cache.clear()
+
+    def test_commit(self):
+        with unit_of_work():
+            for ii in range(3):
+                to_python(dict(self.ad, street_number=str(ii)))
+            self.assertTrue(connection.in_atomic_block)
+        self.assertFalse(connection.in_atomic_block)
+        self.assertEqual(Locality.objects.count(), 1)
+        self.assertEqual(Address.objects.count(), 3)
+
+    def test_reuse(self):
+        with unit_of_work():
+            to_python(self.ad)
+            with CaptureQueriesContext(connection) as queries:
+                to_python(dict(self.ad, street_number='2'))
+        self.assertFalse([q for q in queries if 'address_locality' in q['sql']])
+
+    def test_rollback(self):
+        with self.assertRaises(RuntimeError):
+            with unit_of_work():
+                to_python(self.ad)
+                raise RuntimeError
+        self.assertEqual(Country.objects.count(), 0)
+        self.assertEqual(Address.objects.count(), 0)
+        obj = to_python(self.ad)
+        self.assertTrue(Country.objects.filter(pk=obj.locality.state.country.pk).exists())
+
+    def test_nested_rollback(self):
+        with unit_of_work():
+            to_python(self.ad)
+            with self.assertRaises(RuntimeError):
+                with unit_of_work():
+                    to_python(dict(self.ad, street_number='2', locality='Fitzroy', postal_code='3065'))
+                    raise RuntimeError
+            obj = to_python(dict(self.ad, street_number='3', locality='Fitzroy', postal_code='3065'))
+        self.assertEqual(Address.objects.count(), 2)
+        self.assertTrue(Locality.objects.filter(pk=obj.locality.pk).exists())
+
+    def test_lazy(self):
+        to_python(self.ad)
+        with CaptureQueriesContext(connection) as queries:
+            with unit_of_work(lazy=True):
+                pass
+        self.assertEqual(len(queries), 0)
+
+class DedupeKeyTestCase(TestCase):
+
+    def setUp(self):
+        self.au = Country.objects.create(name='Australia', code='AU')
+        self.au_vic = State.objects.create(name='Victoria', code='VIC', country=self.au)
+        self.au_vic_nco = Locality.objects.create(name='Northcote', postal_code='3070', state=self.au_vic)
+        self.ad1 = Address.objects.create(street_number='1', route='Somewhere Street', locality=self.au_vic_nco,
+                                          raw='1 Somewhere Street, Northcote, Victoria 3070, VIC, AU')
+        self.ad1_dict = {
+            'raw': '1 Somewhere Street, Northcote, Victoria 3070, VIC, AU',
+            'street_number': '1',
+            'route': 'Somewhere Street',
+            'locality': 'Northcote',
+            'postal_code': '3070',
+            'state': 'Victoria',
+            'state_code': 'VIC',
+            'country': 'Australia',
+            'country_code': 'AU'
+        }
+
+    def test_key_set_on_save(self):
+        self.assertEqual(self.ad1.dedupe_key, make_dedupe_key('1', 'Somewhere Street', self.au_vic_nco.pk, ''))
+        self.ad1.route = 'Other Street'
+        self.ad1.save()
+        self.assertEqual(self.ad1.dedupe_key, make_dedupe_key('1', 'Other Street', self.au_vic_nco.pk, ''))
+
+    def test_normalized(self):
+        value = dict(self.ad1_dict, route='SOMEWHERE  St.')
+        self.assertEqual(to_python(value), self.ad1)
+        self.assertEqual(bulk_to_python([dict(value, route='somewhere st')]), [self.ad1])
+        value = {'raw': '1 Somewhere St., Northcote'}
+        self.assertEqual(to_python(value), to_python({'raw': '1 somewhere street northcote'}))
+
+    def test_word_order(self):
+        ad = to_python({'raw': 'Unit 3, 12 Main St, Springfield'})
+        self.assertNotEqual(to_python({'raw': 'Unit 12, 3 Main St, Springfield'}), ad)
+        self.assertEqual(to_python({'raw': 'unit 3 12 main street springfield'}), ad)
+
+    def test_raw_only_not_keyed(self):
+        self.assertEqual(Address.objects.create(raw='Somewhere').dedupe_key, None)
+        self.assertNotEqual(to_python('Somewhere').pk, to_python('Somewhere').pk)
+
+    def test_unique(self):
+        self.assertRaises(IntegrityError, Address.objects.create, street_number='1', route='Somewhere Street',
+                          locality=self.au_vic_nco, raw='Elsewhere')
+
+    def test_lookup(self):
+        with self.assertNumQueries(4):
+            self.assertEqual(to_python(self.ad1_dict), self.ad1)
+
+    def test_raw_lookup(self):
+        obj = to_python({'raw': 'Somewhere'})
+        self.assertEqual(obj.dedupe_key, make_dedupe_key('', '', None, 'Somewhere'))
+        self.assertEqual(to_python({'raw': 'Somewhere'}), obj)
+
+    def test_backfill(self):
+        migration = importlib.import_module('address.migrations.0003_address_dedupe_key')
+        ad2 = Address.objects.create(raw='Somewhere')
+        ad3 = Address.objects.create(raw='Somewhere')
+        Address.objects.update(dedupe_key=None)
+        Address.objects.bulk_create([Address(street_number='1', route='Somewhere Street', locality=self.au_vic_nco,
+                                             raw='Elsewhere')])
+        ad4 = Address.objects.get(raw='Elsewhere')
+
+        class SchemaEditor(object):
+            connection = connection
+        migration.backfill_dedupe_key(apps, SchemaEditor())
+
+        # Keys as defined by the migration, which match the current definition.
+        keys = dict(Address.objects.values_list('pk', 'dedupe_key'))
+        self.assertEqual(keys[self.ad1.pk], migration.make_dedupe_key(self.ad1.street_number, self.ad1.route,
+                                                                      self.au_vic_nco.pk, ''))
+        self.assertEqual(keys[self.ad1.pk], self.ad1.dedupe_key)
+        self.assertEqual(keys[ad2.pk], migration.make_dedupe_key('', '', None, 'Somewhere'))
+        self.assertEqual(keys[ad2.pk], make_dedupe_key('', '', None, 'Somewhere'))
+        self.assertEqual(migration.make_dedupe_key('1', u'M\xfcllerstra\xdfe', None, ''),
+                         make_dedupe_key('1', u'M\xfcllerstra\xdfe', None, ''))
+        self.assertEqual(keys[ad3.pk], None)
+        self.assertEqual(keys[ad4.pk], None)
+
+class WithHierarchyTestCase(TestCase):
+
+    def setUp(self):
+        au = Country.objects.create(name='Australia', code='AU')
+        for ii in range(3):
+            state = State.objects.create(name='State %d'%ii, country=au)
+            for jj in range(3):
+                loc = Locality.objects.create(name='Locality %d'%jj, postal_code=str(jj), state=state)
+                for kk in range(3):
+                    Address.objects.create(street_number=str(kk), route='Street', locality=loc, raw='raw', formatted='')
+        Address.objects.create(raw='Unidentified')
+
+    def test_as_dict(self):
+        with self.assertNumQueries(1):
+            ads = [a.as_dict() for a in Address.objects.with_hierarchy()]
+        self.assertEqual(len(ads), 28)
+        self.assertEqual(ads[-1]['country'], 'Australia')
+
+    def test_str(self):
+        with self.assertNumQueries(1):
+            txts = [unicode(a) for a in Address.objects.with_hierarchy()]
+        self.assertIn('0 Street, Locality 0, State 0 0, Australia', txts)
+        with self.assertNumQueries(1):
+            [unicode(l) for l in Locality.objects.with_hierarchy()]
+        with self.assertNumQueries(1):
+            [unicode(s) for s in State.objects.with_hierarchy()]
+
+class DenormalizedTestCase(TestCase):
+
+    def setUp(self):
+        self.au = Country.objects.create(name='Australia', code='AU')
+        self.vic = State.objects.create(name='Victoria', code='VIC', country=self.au)
+        self.nco = Locality.objects.create(name='Northcote', postal_code='3070', state=self.vic)
+        self.ads = [
+            Address.objects.create(street_number='1', route='Some Street', locality=self.nco, raw='a'),
+            Address.objects.create(street_number='1', locality=self.nco, raw='b'),
+            Address.objects.create(route='Some Street', locality=self.nco, raw='c'),
+            Address.objects.create(locality=self.nco, raw='d', formatted='Formatted'),
+            Address.objects.create(raw='e'),
+        ]
+
+    def assertSynced(self):
+        for ad in Address.objects.order_by('pk'):
+            display = ad.display
+            ad.display = None
+            self.assertEqual(display, ad._display())
+            self.assertEqual(ad.locality_name, ad.locality.name if ad.locality else '')
+            self.assertEqual(ad.country_code, ad.locality.state.country.code if ad.locality else '')
+
+    def test_columns(self):
+        ad = Address.objects.get(pk=self.ads[0].pk)
+        self.assertEqual(ad.locality_name, 'Northcote')
+        self.assertEqual(ad.postal_code, '3070')
+        self.assertEqual(ad.state_name, 'Victoria')
+        self.assertEqual(ad.state_code, 'VIC')
+        self.assertEqual(ad.country_name, 'Australia')
+        self.assertEqual(ad.country_code, 'AU')
+        self.assertEqual(ad.display, '1 Some Street, Northcote, Victoria 3070, Australia')
+        self.assertSynced()
+
+    def test_no_joins(self):
+        with self.assertNumQueries(1):
+            ads = list(Address.objects.order_by('pk'))
+            txts = [unicode(a) for a in ads]
+            dicts = [a.as_dict() for a in ads]
+        self.assertEqual(txts, ['1 Some Street, Northcote, Victoria 3070, Australia',
+                                '1, Northcote, Victoria 3070, Australia',
+                                'Northcote, Victoria 3070, Australia',
+                                'Formatted',
+                                'e'])
+        self.assertEqual(dicts[0]['state_code'], 'VIC')
+        self.assertEqual(dicts[0]['country'], 'Australia')
+        self.assertNotIn('locality', dicts[4])
+
+    def test_fallback(self):
+        Address.objects.update(locality_name=None, display=None)
+        ad = Address.objects.get(pk=self.ads[0].pk)
+        self.assertEqual(unicode(ad), '1 Some Street, Northcote, Victoria 3070, Australia')
+        self.assertEqual(ad.as_dict()['country'], 'Australia')
+
+    def test_rename_locality(self):
+        self.nco.name = 'Fitzroy'
+        self.nco.postal_code = '3065'
+        self.nco.save()
+        self.assertEqual(Address.objects.get(pk=self.ads[0].pk).display,
+                         '1 Some Street, Fitzroy, Victoria 3065, Australia')
+        self.assertSynced()
+
+    def test_rename_state(self):
+        self.vic.code = 'V'
+        self.vic.save()
+        self.assertEqual(Address.objects.get(pk=self.ads[0].pk).state_code, 'V')
+        self.assertSynced()
+
+    def test_rename_country(self):
+        self.au.name = 'Oz'
+        self.au.save()
+        self.assertEqual(Address.objects.get(pk=self.ads[1].pk).display, '1, Northcote, Victoria 3070, Oz')
+        self.assertSynced()
+
+    def test_blank_names(self):
+        self.vic.name = ''
+        self.vic.save()
+        self.au.name = ''
+        self.au.save()
+        self.assertEqual(Address.objects.get(pk=self.ads[0].pk).display, '1 Some Street, Northcote, VIC 3070, AU')
+        self.assertSynced()
+        self.nco.name = ''
+        self.nco.postal_code = ''
+        self.nco.save()
+        self.assertSynced()
+
+    def test_move(self):
+        nsw = State.objects.create(name='New South Wales', code='NSW', country=self.au)
+        self.nco.state = nsw
+        self.nco.save()
+        self.assertEqual(Address.objects.get(pk=self.ads[0].pk).state_code, 'NSW')
+        self.assertSynced()
+
+    def test_unchanged(self):
+        for ii in range(20):
+            Locality.objects.create(name='Locality %d'%ii, postal_code='3000', state=self.vic)
+        au = Country.objects.get(pk=self.au.pk)
+        with self.assertNumQueries(1):
+            au.save()
+        with self.assertNumQueries(1):
+            self.vic.save()
+        au.name = 'Oz'
+        with self.assertNumQueries(3):
+            au.save()
+        self.assertSynced()
+
+    def test_rebuild(self):
+        Address.objects.update(locality_name=None, postal_code=None, state_name=None, state_code=None,
+                               country_name=None, country_code=None, display=None)
+        call_command('address_backfill', 'denormalize', batch_size=2, verbosity=0)
+        self.assertSynced()
+
+@override_settings(ADDRESS_RESOLUTION_CACHE=True)
+class ResolutionCacheTestCase(TestCase):
+
+    def setUp(self):
+        resolution_stats.clear()
+
+    def test_string(self):
+        ad = to_python('1 Some Street')
+        self.assertEqual(resolution_stats['misses'], 1)
+        with self.assertNumQueries(2):
+            self.assertEqual(to_python('  1 some   STREET '), ad)
+        self.assertEqual(resolution_stats['hits'], 1)
+        self.assertEqual(Address.objects.count(), 1)
+        entry = ResolvedRaw.objects.get()
+        self.assertEqual(entry.raw, '1 Some Street')
+        self.assertEqual(entry.hits, 1)
+
+    def test_word_order(self):
+        ad = to_python('Unit 3, 12 Main St, Springfield')
+        self.assertNotEqual(to_python('Unit 12, 3 Main St, Springfield'), ad)
+        self.assertEqual(ResolvedRaw.objects.count(), 2)
+
+    def test_dict(self):
+        value = {'raw': '1 Some Street, Northcote', 'street_number': '1', 'route': 'Some Street',
+                 'locality': 'Northcote', 'state': 'Victoria', 'country': 'Australia'}
+        ad = to_python(value)
+        with self.assertNumQueries(2):
+            self.assertEqual(to_python(value), ad)
+        self.assertEqual(to_python({'raw': ''}), None)
+        self.assertEqual(ResolvedRaw.objects.count(), 1)
+
+    def test_dict_components(self):
+        raw = to_python({'raw': '1 Some Street, Northcote'})
+        self.assertEqual(to_python('1 Some Street, Northcote'), raw)
+        value = {'raw': '1 Some Street, Northcote', 'street_number': '1', 'route': 'Some Street',
+                 'locality': 'Northcote', 'state': 'Victoria', 'country': 'Australia'}
+        ad = to_python(value)
+        self.assertNotEqual(ad, raw)
+        self.assertEqual(ad.locality.name, 'Northcote')
+        self.assertEqual(to_python(dict(value, route='Some St')), ad)
+        self.assertEqual(to_python('1 Some Street, Northcote'), raw)
+
+    def test_disabled(self):
+        with self.settings(ADDRESS_RESOLUTION_CACHE=False):
+            self.assertNotEqual(to_python('1 Some Street'), to_python('1 Some Street'))
+        self.assertEqual(ResolvedRaw.objects.count(), 0)
+
+    def test_deleted_address(self):
+        to_python('1 Some Street').delete()
+        self.assertEqual(ResolvedRaw.objects.count(), 0)
+        self.assertEqual(to_python('1 Some Street').raw, '1 Some Street')
+
+    @override_settings(ADDRESS_RESOLUTION_CACHE_TTL=60)
+    def test_ttl(self):
+        ad = to_python('1 Some Street')
+        ResolvedRaw.objects.update(created=timezone.now() - timedelta(seconds=120))
+        self.assertNotEqual(to_python('1 Some Street'), ad)
+        self.assertEqual(resolution_stats['misses'], 2)
+        self.assertEqual(ResolvedRaw.objects.count(), 1)
+
+    def test_prune(self):
+        now = timezone.now()
+        for ii in range(5):
+            to_python('%d Some Street'%ii)
+        for ii, entry in enumerate(ResolvedRaw.objects.order_by('raw')):
+            ResolvedRaw.objects.filter(pk=entry.pk).update(created=now - timedelta(hours=ii),
+                                                           last_used=now - timedelta(minutes=ii))
+        self.assertEqual(prune_resolutions(ttl=3*3600 + 60), 1)
+        self.assertEqual(prune_resolutions(max_entries=2), 2)
+        self.assertEqual(list(ResolvedRaw.objects.order_by('raw').values_list('raw', flat=True)),
+                         ['0 Some Street', '1 Some Street'])
+        self.assertEqual(prune_resolutions(max_entries=2), 0)
+
+        out = StringIO()
+        call_command('address_prune_resolutions', max_entries=0, stdout=out)
+        self.assertIn('Removed 2 entries', out.getvalue())
+
+class LazyAddressFieldTestCase(TestModelsMixin, TestCase):
+
+    def setUp(self):
+        self.value = {
+            'raw': '1 Somewhere Street, Northcote, Victoria 3070, VIC, AU',
+            'street_number': '1',
+            'route': 'Somewhere Street',
+            'locality': 'Northcote',
+            'postal_code': '3070',
+            'state': 'Victoria',
+            'state_code': 'VIC',
+            'country': 'Australia',
+            'country_code': 'AU'
+        }
+
+    def test_assignment(self):
+        with self.assertNumQueries(0):
+            order = Order(shipping=self.value)
+            order.shipping = '2 Somewhere Street'
+        self.assertEqual(Address.objects.count(), 0)
+        self.assertEqual(order.shipping_id, None)
+        order.save()
+        self.assertEqual(Order.objects.get().shipping.raw, '2 Somewhere Street')
+
+    def test_read(self):
+        order = Order(shipping=self.value)
+        self.assertEqual(order.shipping.route, 'Somewhere Street')
+        self.assertEqual(order.shipping_id, order.shipping.pk)
+        order.shipping = None
+        self.assertEqual(order.shipping, None)
+
+    def test_eager(self):
+        order = Order(billing='1 Somewhere Street')
+        self.assertEqual(Address.objects.count(), 1)
+        with self.settings(ADDRESS_LAZY=True):
+            order.billing = '2 Somewhere Street'
+        self.assertEqual(Address.objects.count(), 1)
+        order.save()
+        self.assertEqual(Address.objects.count(), 2)
+
+    def test_bulk_create(self):
+        orders = [Order(name=str(ii), shipping=dict(self.value, street_number=str(ii % 2))) for ii in range(4)]
+        Order.objects.bulk_create(orders)
+        self.assertEqual(Address.objects.count(), 2)
+
+    def test_resolve_pending(self):
+        orders = [Order(name=str(ii), shipping=dict(self.value, street_number=str(ii))) for ii in range(10)]
+        with self.assertNumQueries(22):
+            self.assertEqual(resolve_pending(orders), 10)
+        self.assertEqual([o.shipping.street_number for o in orders], [str(ii) for ii in range(10)])
+        self.assertEqual(resolve_pending(orders), 0)
+        with self.assertNumQueries(1):
+            Order.objects.bulk_create(orders)
+        self.assertEqual(sorted(Order.objects.values_list('shipping__street_number', flat=True)),
+                         [str(ii) for ii in range(10)])
+
+class AddressAwareQuerySetTestCase(TestModelsMixin, TestCase):
+
+    def setUp(self):
+        self.value = {
+            'raw': '1 Somewhere Street, Northcote, Victoria 3070, VIC, AU',
+            'street_number': '1',
+            'route': 'Somewhere Street',
+            'locality': 'Northcote',
+            'postal_code': '3070',
+            'state': 'Victoria',
+            'state_code': 'VIC',
+            'country': 'Australia',
+            'country_code': 'AU'
+        }
+
+    def make(self, ii):
+        return Shipment(
+            name=str(ii),
+            origin=dict(self.value, street_number=str(ii)),
+            destination=dict(self.value, street_number=str(ii + 100)),
+        )
+
+    def test_lazy(self):
+        with self.assertNumQueries(0):
+            Shipment(origin=self.value)
+        Shipment(returns=self.value)
+        self.assertEqual(Address.objects.count(), 1)
+
+    def test_bulk_create(self):
+        with self.assertNumQueries(23):
+            Shipment.objects.bulk_create([self.make(ii) for ii in range(10)])
+        with self.assertNumQueries(11):
+            Shipment.objects.bulk_create([self.make(ii) for ii in range(10, 20)])
+        self.assertEqual(Address.objects.count(), 40)
+        ship = Shipment.objects.get(name='3')
+        self.assertEqual((ship.origin.street_number, ship.destination.street_number), ('3', '103'))
+
+    def test_bulk_update(self):
+        Shipment.objects.bulk_create([self.make(ii) for ii in range(5)])
+        ships = list(Shipment.objects.order_by('name'))
+        for ship in ships:
+            ship.name = 'x' + ship.name
+            ship.origin = dict(self.value, street_number='2%s'%ship.name)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(Shipment.objects.bulk_update(ships, ['name', 'origin'], batch_size=2), 5)
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('UPDATE')]), 3)
+        self.assertEqual(list(Shipment.objects.order_by('name').values_list('name', 'origin__street_number')),
+                         [('x%d'%ii, '2x%d'%ii) for ii in range(5)])
+        self.assertEqual(list(Shipment.objects.order_by('name').values_list('destination__street_number', flat=True)),
+                         [str(ii + 100) for ii in range(5)])
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+from django.test import SimpleTestCase
+from address.benchmarks.normalize import run
+from address.normalize import tokens, normalize, fingerprint
+
+class NormalizeTestCase(SimpleTestCase):
+
+    def test_case_and_whitespace(self):
+        self.assertEqual(normalize('  1 Some   STREET '), '1 some street')
+
+    def test_abbreviations(self):
+        self.assertEqual(normalize('1 Some St.'), normalize('1 Some Street'))
+        self.assertEqual(normalize('12 Amphitheatre Pkwy'), '12 amphitheatre parkway')
+
+    def test_country(self):
+        self.assertEqual(normalize('12 St Paul St'), '12 street paul street')
+        self.assertEqual(normalize('12 r. St Honoré', 'fr'), '12 rue saint honore')
+        self.assertEqual(normalize('Hauptstr. 5', 'DE'), 'hauptstr 5')
+        self.assertEqual(normalize('Haupt Str. 5', 'DE'), 'haupt strasse 5')
+
+    def test_unicode(self):
+        self.assertEqual(normalize('Café Crème'), 'cafe creme')
+        self.assertEqual(normalize('Café'), 'cafe')
+        self.assertEqual(normalize('Müllerstraße'), 'mullerstrasse')
+        self.assertEqual(normalize('ｓｏｍｅ　ｓｔ'), 'some street')
+        self.assertEqual(normalize(b'1 Some St'), '1 some street')
+
+    def test_tokens(self):
+        self.assertEqual(tokens('1/23 Some-St, Northcote'), ['1', '23', 'some', 'street', 'northcote'])
+
+    def test_fingerprint(self):
+        self.assertEqual(fingerprint('1 Some St, Northcote'), fingerprint('northcote 1 some street'))
+        self.assertEqual(fingerprint('2 2 Some St'), '2 2 some street')
+        self.assertNotEqual(fingerprint('2 Some St'), fingerprint('2 2 Some St'))
+
+    def test_benchmark(self):
+        results = run(100)
+        self.assertEqual([r['name'] for r in results], ['normalize', 'fingerprint'])
+        self.assertEqual(results[0]['count'], 100)
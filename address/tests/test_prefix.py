@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.test import TestCase
+from address.models import *
+from address.models import bulk_to_python
+from address.prefix import PrefixIndex, prefix_key, locality_index
+
+class PrefixIndexTestCase(TestCase):
+
+    def test_prefix_key(self):
+        self.assertEqual(prefix_key('  Saint-Étienne '), 'saint etienne')
+
+    def test_search(self):
+        index = PrefixIndex([('northcote', 1), ('fitzroy', 2), ('north melbourne', 3), ('northcote', 4)])
+        self.assertEqual(index.search('north'), [3, 1, 4])
+        self.assertEqual(index.search('north', 2), [3, 1])
+        self.assertEqual(index.search('x'), [])
+        index.add('north', 5)
+        index.remove('northcote', 1)
+        index.remove('northcote', 9)
+        self.assertEqual(index.search('north'), [5, 3, 4])
+        self.assertEqual(len(index), 4)
+
+class LocalityIndexTestCase(TestCase):
+
+    def setUp(self):
+        locality_index.clear()
+        self.au = Country.objects.create(name='Australia', code='AU')
+        self.vic = State.objects.create(name='Victoria', code='VIC', country=self.au)
+        self.nco = Locality.objects.create(name='Northcote', postal_code='3070', state=self.vic)
+        self.nmb = Locality.objects.create(name='North Melbourne', postal_code='3051', state=self.vic)
+        self.fitz = Locality.objects.create(name='Fitzroy', postal_code='3065', state=self.vic)
+
+    def tearDown(self):
+        locality_index.clear()
+
+    def test_search(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(locality_index.search('North'), [self.nmb.pk, self.nco.pk])
+        with self.assertNumQueries(0):
+            self.assertEqual(locality_index.search('30'), [self.nmb.pk, self.fitz.pk, self.nco.pk])
+            self.assertEqual(locality_index.search('fitz', 1), [self.fitz.pk])
+            self.assertEqual(locality_index.search(' '), [])
+            self.assertEqual(locality_index.suggest('northc'), [
+                ('Northcote', '3070', 'Victoria', 'VIC', 'Australia', 'AU'),
+            ])
+        self.assertIs(locality_index.get(self.nco.pk)[2], locality_index.get(self.fitz.pk)[2])
+
+    def test_signals(self):
+        len(locality_index)
+        self.nco.name = 'Thornbury'
+        self.nco.save()
+        abb = Locality.objects.create(name='Abbotsford', postal_code='3067', state=self.vic)
+        self.fitz.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(locality_index.search('north'), [self.nmb.pk])
+            self.assertEqual(locality_index.search('th'), [self.nco.pk])
+            self.assertEqual(locality_index.search('306'), [abb.pk])
+        self.vic.name = 'Vic'
+        self.vic.save()
+        self.assertEqual(locality_index.get(abb.pk)[2], 'Vic')
+
+    def test_new_state(self):
+        len(locality_index)
+        nsw = State.objects.create(name='New South Wales', code='NSW', country=self.au)
+        Country.objects.create(name='New Zealand', code='NZ')
+        syd = Locality.objects.create(name='Sydney', postal_code='2000', state=nsw)
+        with self.assertNumQueries(0):
+            self.assertEqual(locality_index.search('syd'), [syd.pk])
+            self.assertEqual(locality_index.search('north'), [self.nmb.pk, self.nco.pk])
+
+    def test_bulk_created(self):
+        len(locality_index)
+        bulk_to_python([{'raw': '1 Some Street, Hobart TAS 7000', 'street_number': '1', 'route': 'Some Street',
+                         'locality': 'Hobart', 'postal_code': '7000', 'state': 'Tasmania', 'state_code': 'TAS',
+                         'country': 'Australia', 'country_code': 'AU'}])
+        hobart = Locality.objects.get(name='Hobart')
+        with self.assertNumQueries(0):
+            self.assertEqual(locality_index.search('hob'), [hobart.pk])
+            self.assertEqual(locality_index.get(hobart.pk)[2:4], ('Tasmania', 'TAS'))
@@ -0,0 +1,195 @@
+import io
+import os
+import shutil
+import tempfile
+import time
+from django.core.management import call_command, CommandError
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, override_settings
+from django.utils.six import StringIO
+from address.models import *
+from address.backfill import ResolveTask, run_backfill
+from address.models import to_python, bulk_to_python, bulk_attach
+from address.resolvers import BaseResolver, RateLimiter, get_resolver, resolve_concurrently
+from address.resolvers.fake import FakeResolver
+from address.resolvers.gazetteer import GazetteerResolver
+
+GAZETTEER = u'''\
+AU\t3070\tNorthcote\tVictoria\tVIC\t\t\t\t\t-37.7702\t144.9973\t4
+AU\t3070\tNorthcote South\tVictoria\tVIC\t\t\t\t\t-37.7747\t144.9903\t4
+AU\t3065\tFitzroy\tVictoria\tVIC\t\t\t\t\t-37.7986\t144.9786\t4
+AU\t2000\tSydney\tNew South Wales\tNSW\t\t\t\t\t-33.8678\t151.2073\t4
+AU\t2001\tSydney\tNew South Wales\tNSW\t\t\t\t\t-33.8678\t151.2073\t4
+AU\t4000\tBrisbane\tQueensland\tQLD\t\t\t\t\t-27.4679\t153.0281\t4
+NZ\t6011\tWellington\tWellington\tG2\t\t\t\t\t-41.2866\t174.7756\t4
+'''
+
+COUNTRIES = u'''\
+# ISO\tISO3\tISO-Numeric\tfips\tCountry
+AU\tAUS\t036\tAS\tAustralia
+NZ\tNZL\t554\tNZ\tNew Zealand
+'''
+
+class StaticResolver(BaseResolver):
+
+    def __init__(self, value=None):
+        self.value = value
+
+    def resolve(self, raw):
+        return self.value
+
+class GazetteerTestCase(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(GazetteerTestCase, cls).setUpClass()
+        cls.dir = tempfile.mkdtemp()
+        cls.path = os.path.join(cls.dir, 'postal.txt')
+        cls.countries = os.path.join(cls.dir, 'countries.txt')
+        for path, text in ((cls.path, GAZETTEER), (cls.countries, COUNTRIES)):
+            with io.open(path, 'w', encoding='utf-8') as f:
+                f.write(text)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.dir)
+        super(GazetteerTestCase, cls).tearDownClass()
+
+    def setUp(self):
+        self.resolver = GazetteerResolver(self.path, countries=self.countries)
+
+    def test_postal_code(self):
+        value = self.resolver.resolve('1 Some Street, Northcote VIC 3070')
+        self.assertEqual(value['street_number'], '1')
+        self.assertEqual(value['route'], 'Some Street')
+        self.assertEqual(value['locality'], 'Northcote')
+        self.assertEqual(value['postal_code'], '3070')
+        self.assertEqual(value['state'], 'Victoria')
+        self.assertEqual(value['state_code'], 'VIC')
+        self.assertEqual(value['country'], 'Australia')
+        self.assertEqual(value['country_code'], 'AU')
+        self.assertEqual(value['latitude'], -37.7702)
+
+    def test_postal_code_only(self):
+        value = self.resolver.resolve('Unit 4, 3065')
+        self.assertEqual(value['locality'], 'Fitzroy')
+        self.assertEqual(value['route'], 'Unit 4')
+
+    def test_ambiguous_postal_code(self):
+        self.assertEqual(self.resolver.resolve('3070'), None)
+
+    def test_place_name(self):
+        value = self.resolver.resolve('12 Queen St, Brisbane')
+        self.assertEqual(value['locality'], 'Brisbane')
+        self.assertEqual(value['postal_code'], '4000')
+        value = self.resolver.resolve('Sydney, NSW')
+        self.assertEqual(value['locality'], 'Sydney')
+        self.assertEqual(value['postal_code'], '')
+        self.assertNotIn('route', value)
+
+    def test_unknown(self):
+        self.assertEqual(self.resolver.resolve('Somewhere'), None)
+        self.assertEqual(self.resolver.resolve(''), None)
+
+    def test_country(self):
+        resolver = GazetteerResolver(self.path, country='NZ')
+        self.assertEqual(resolver.resolve('Brisbane'), None)
+        self.assertEqual(resolver.resolve('Wellington 6011')['country'], 'NZ')
+
+    def test_to_python(self):
+        with override_settings(ADDRESS_RESOLVER='address.resolvers.gazetteer.GazetteerResolver',
+                               ADDRESS_RESOLVER_OPTIONS={'path': self.path, 'countries': self.countries}):
+            ad = to_python('1 Some Street, Northcote VIC 3070')
+            self.assertEqual(ad.locality.name, 'Northcote')
+            self.assertEqual(ad.locality.state.country.name, 'Australia')
+            self.assertEqual(ad.raw, '1 Some Street, Northcote VIC 3070')
+            self.assertEqual(to_python({'raw': '1 Some Street, Northcote VIC 3070'}), ad)
+            self.assertEqual(to_python('Somewhere').locality, None)
+
+            res = bulk_to_python(['Somewhere', '2 Some Street, Northcote 3070', {'raw': 'Fitzroy, VIC'}])
+            self.assertEqual(res[0].locality, None)
+            self.assertEqual(res[1].locality, ad.locality)
+            self.assertEqual(res[2].locality.name, 'Fitzroy')
+        self.assertEqual(to_python('1 Some Street, Northcote VIC 3070').locality, None)
+
+class GetResolverTestCase(TestCase):
+
+    def test_unconfigured(self):
+        self.assertEqual(get_resolver(), None)
+
+    def test_configured(self):
+        with override_settings(ADDRESS_RESOLVER='address.tests.test_resolvers.StaticResolver',
+                               ADDRESS_RESOLVER_OPTIONS={'value': {'locality': 'Northcote'}}):
+            self.assertIs(get_resolver(), get_resolver())
+            self.assertEqual(get_resolver().value, {'locality': 'Northcote'})
+
+            # Inconsistent components are stored raw.
+            self.assertEqual(to_python('Northcote').locality, None)
+
+    def test_invalid(self):
+        with override_settings(ADDRESS_RESOLVER='address.tests.nothing.Resolver'):
+            self.assertRaises(ImproperlyConfigured, get_resolver)
+
+class ResolveTestCase(TestCase):
+
+    def setUp(self):
+        self.existing = to_python({'raw': 'existing', 'street_number': '1', 'route': 'Some Street',
+                                   'locality': 'Northcote', 'state': 'Victoria', 'country': 'Australia'})
+        self.raws = [
+            '2 Some Street, Northcote, Victoria, Australia',
+            'Somewhere',
+            '1 Some Street, Northcote, Victoria, Australia',
+            'Main Road, Fitzroy, Victoria, Australia',
+        ]
+        self.ads = [Address.objects.create(raw=r) for r in self.raws]
+
+    def test_fake_resolver(self):
+        resolver = FakeResolver()
+        self.assertEqual(resolver.resolve('Somewhere'), None)
+        self.assertEqual(resolver.resolve(self.raws[0])['street_number'], '2')
+        self.assertEqual(resolver.resolve(self.raws[3])['route'], 'Main Road')
+        self.assertEqual(resolver.calls, 3)
+
+    def test_resolve_concurrently(self):
+        resolver = FakeResolver()
+        expected = [resolver.resolve(r) for r in self.raws]*5
+        self.assertEqual(resolve_concurrently(resolver, self.raws*5, concurrency=4), expected)
+        self.assertEqual(resolve_concurrently(resolver, self.raws, limiter=RateLimiter(1000)), expected[:4])
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(100)
+        start = time.time()
+        for ii in range(6):
+            limiter.wait()
+        self.assertGreaterEqual(time.time() - start, 0.05)
+
+    def test_bulk_attach(self):
+        values = FakeResolver().resolve_many(self.raws)
+        self.assertEqual(len(bulk_attach(self.ads, values)), 3)
+        ads = [Address.objects.get(pk=a.pk) for a in self.ads]
+        self.assertEqual(ads[0].locality, self.existing.locality)
+        self.assertEqual(ads[0].street_number, '2')
+        self.assertEqual(ads[0].locality_name, 'Northcote')
+        self.assertEqual(ads[0].formatted, '2 Some Street, Northcote, Victoria, Australia')
+        self.assertEqual(ads[0].raw, self.raws[0])
+        self.assertEqual(ads[1].locality, None)
+        self.assertEqual(ads[2].locality, self.existing.locality)
+        self.assertEqual(ads[2].dedupe_key, None)
+        self.assertEqual(ads[3].locality.name, 'Fitzroy')
+        self.assertEqual(ads[3].street_number, '')
+
+    def test_task(self):
+        task = ResolveTask(FakeResolver(), concurrency=2)
+        out = StringIO()
+        checkpoint = run_backfill(task, batch_size=3, stdout=out)
+        self.assertTrue(checkpoint.finished)
+        self.assertEqual(task.stats['resolved'], 3)
+        self.assertEqual(task.stats['unresolved'], 1)
+        self.assertEqual(Address.objects.filter(locality=None).count(), 1)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('address_resolve', resolver='address.resolvers.fake.FakeResolver', concurrency=2,
+                     rate=1000, stdout=out)
+        self.assertIn('Finished, 4 rows: 3 resolved, 1 unresolved', out.getvalue())
+        self.assertRaises(CommandError, call_command, 'address_resolve')
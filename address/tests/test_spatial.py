@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+from unittest import skipIf
+from django.test import TestCase
+from address import geo
+from address.models import *
+from address.benchmarks.spatial import run_index
+from address.spatial import AddressSpatialIndex, cKDTree, np
+
+POINTS = (
+    ('cbd', -37.8136, 144.9631),
+    ('northcote', -37.7702, 144.9973),
+    ('fitzroy', -37.7986, 144.9786),
+    ('geelong', -38.1499, 144.3617),
+    ('sydney', -33.8688, 151.2093),
+    ('suva', -18.1416, 178.4419),
+    ('apia', -13.8333, -171.7500),
+)
+
+@skipIf(np is None, 'NumPy is not installed')
+class AddressSpatialIndexTestCase(TestCase):
+
+    def setUp(self):
+        self.ads = dict((n, Address.objects.create(raw=n, latitude=lat, longitude=lng)) for n, lat, lng in POINTS)
+        Address.objects.create(raw='nowhere')
+        self.index = AddressSpatialIndex.from_queryset()
+
+    def test_tree(self):
+        if cKDTree is not None:
+            self.assertIs(self.index.tree, self.index.tree)
+
+    def test_from_queryset(self):
+        self.assertEqual(len(self.index), 7)
+        self.assertEqual(len(AddressSpatialIndex.from_queryset(Address.objects.filter(raw='cbd'))), 1)
+        self.assertEqual(len(AddressSpatialIndex.from_queryset(Address.objects.none())), 0)
+
+    def test_query(self):
+        dist, pks = self.index.query([-37.79, -16.0], [144.98, 179.9], k=2)
+        self.assertEqual(pks.shape, (2, 2))
+        self.assertEqual(list(pks[0]), [self.ads['fitzroy'].pk, self.ads['northcote'].pk])
+        self.assertEqual(list(pks[1]), [self.ads['suva'].pk, self.ads['apia'].pk])
+        self.assertAlmostEqual(dist[0][0], geo.distance(-37.79, 144.98, -37.7986, 144.9786), 6)
+        self.assertAlmostEqual(dist[1][1], geo.distance(-16.0, 179.9, -13.8333, -171.75), 6)
+
+        # More neighbours than points.
+        dist, pks = self.index.query(-37.8136, 144.9631, k=10)
+        self.assertEqual(pks.shape, (1, 7))
+        self.assertEqual(dist[0][0], 0)
+        self.assertEqual(pks[0][-1], self.ads['apia'].pk)
+
+    def test_query_chunked(self):
+        from address import spatial
+        old, spatial.CHUNK_ELEMENTS = spatial.CHUNK_ELEMENTS, 10
+        try:
+            dist, pks = self.index.query([p[1] for p in POINTS], [p[2] for p in POINTS])
+            res = self.index.query_radius([p[1] for p in POINTS], [p[2] for p in POINTS], 10)
+        finally:
+            spatial.CHUNK_ELEMENTS = old
+        self.assertEqual(list(pks[:, 0]), [self.ads[p[0]].pk for p in POINTS])
+        self.assertEqual([len(r[1]) for r in res], [3, 3, 3, 1, 1, 1, 1])
+
+    def test_query_radius(self):
+        res = self.index.query_radius([-37.8136, 0], [144.9631, 0], 10)
+        self.assertEqual(list(res[0][1]), [self.ads[n].pk for n in ('cbd', 'fitzroy', 'northcote')])
+        self.assertEqual(len(res[1][0]), 0)
+        expected = Address.objects.within_radius(-37.8136, 144.9631, 1000)
+        self.assertEqual(list(self.index.query_radius(-37.8136, 144.9631, 1000)[0][1]), [a.pk for a in expected])
+
+    def test_save_load(self):
+        dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(dir, 'index')
+            self.index.save(path)
+            index = AddressSpatialIndex.load(path)
+            self.assertIsInstance(index.xyz, np.memmap)
+            self.assertEqual(list(index.query(-37.79, 144.98)[1][0]), [self.ads['fitzroy'].pk])
+            self.assertFalse(isinstance(AddressSpatialIndex.load(path, mmap=False).xyz, np.memmap))
+            del index
+        finally:
+            shutil.rmtree(dir)
+
+    def test_benchmark(self):
+        self.assertEqual(run_index(100, 10)['count'], 10)
+
+@skipIf(np is None, 'NumPy is not installed')
+class BruteForceSpatialIndexTestCase(AddressSpatialIndexTestCase):
+
+    def setUp(self):
+        super(BruteForceSpatialIndexTestCase, self).setUp()
+        self.index.use_tree = False
+
+    def test_tree(self):
+        self.assertEqual(self.index.tree, None)
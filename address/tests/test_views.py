@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+from unittest import skipUnless
+from django.contrib.auth.models import Permission, User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.core.urlresolvers import reverse
+from address.models import *
+from address.prefix import locality_index
+from address.views import _prefixed
+
+@override_settings(ROOT_URLCONF='address.urls', ADDRESS_AUTOCOMPLETE_ADDRESSES=True)
+class AutocompleteTestCase(TestCase):
+
+    def setUp(self):
+        self.au = Country.objects.create(name='Australia', code='AU')
+        self.vic = State.objects.create(name='Victoria', code='VIC', country=self.au)
+        self.nco = Locality.objects.create(name='Northcote', postal_code='3070', state=self.vic)
+        self.nmb = Locality.objects.create(name='North Melbourne', postal_code='3051', state=self.vic)
+        self.fitz = Locality.objects.create(name='Fitzroy', postal_code='3065', state=self.vic)
+        self.ad1 = Address.objects.create(street_number='1', route='Some Street', locality=self.nco, raw='a')
+        self.ad2 = Address.objects.create(street_number='12', route='Some Street', locality=self.nco, raw='b')
+        self.ad3 = Address.objects.create(raw='Somewhere')
+
+    def get(self, **params):
+        return self.client.get(reverse('address-autocomplete'), params)
+
+    def results(self, **params):
+        res = self.get(**params)
+        self.assertEqual(res.status_code, 200)
+        return res.json()['results']
+
+    def test_localities(self):
+        res = self.results(q='north')
+        self.assertEqual([r['locality'] for r in res], ['North Melbourne', 'Northcote'])
+        self.assertEqual(res[1], {
+            'label': 'Northcote, VIC 3070, Australia', 'locality': 'Northcote', 'postal_code': '3070',
+            'state': 'Victoria', 'state_code': 'VIC', 'country': 'Australia', 'country_code': 'AU',
+        })
+
+    def test_postal_code(self):
+        self.assertEqual([r['locality'] for r in self.results(q='30')], ['North Melbourne', 'Fitzroy', 'Northcote'])
+        self.assertEqual([r['locality'] for r in self.results(q='3065')], ['Fitzroy'])
+
+    def test_addresses(self):
+        res = self.results(q='some', kind='addresses')
+        self.assertEqual([r['street_number'] for r in res], ['1', '12'])
+        self.assertEqual(res[0]['locality'], 'Northcote')
+        self.assertEqual(res[0]['state_code'], 'VIC')
+        self.assertEqual([r['street_number'] for r in self.results(q='12 so', kind='addresses')], ['12'])
+
+    @override_settings(ADDRESS_AUTOCOMPLETE_ADDRESSES=False)
+    def test_addresses_not_allowed(self):
+        self.assertEqual(self.get(q='some', kind='addresses').status_code, 403)
+        self.assertEqual(len(self.results(q='north')), 2)
+
+    @override_settings(ADDRESS_AUTOCOMPLETE_ADDRESSES='address.change_address', MIDDLEWARE=[
+        'django.contrib.sessions.middleware.SessionMiddleware',
+        'django.contrib.auth.middleware.AuthenticationMiddleware',
+    ])
+    def test_addresses_permission(self):
+        self.assertEqual(self.get(q='some', kind='addresses').status_code, 403)
+        user = User.objects.create_user('clerk')
+        self.client.force_login(user)
+        self.assertEqual(self.get(q='some', kind='addresses').status_code, 403)
+        user.user_permissions.add(Permission.objects.get(codename='change_address'))
+        self.assertEqual(len(self.results(q='some', kind='addresses')), 2)
+
+    def test_limit(self):
+        self.assertEqual(len(self.results(q='30', limit='2')), 2)
+        self.assertEqual(len(self.results(q='30', limit='1000')), 3)
+        self.assertEqual(self.get(q='30', limit='x').status_code, 400)
+
+    def test_empty(self):
+        self.assertEqual(self.results(q=''), [])
+        self.assertEqual(self.results(q='zzz'), [])
+        self.assertEqual(self.get(q='a', kind='x').status_code, 400)
+
+    def test_queries(self):
+        with self.assertNumQueries(1):
+            self.results(q='north')
+        with self.assertNumQueries(1):
+            self.results(q='some', kind='addresses')
+
+    def test_folded(self):
+        Locality.objects.create(name='Saint-Étienne', postal_code='42000', state=self.vic)
+        self.assertEqual([r['locality'] for r in self.results(q='saint eti')], ['Saint-Étienne'])
+        self.assertEqual([r['street_number'] for r in self.results(q='12 SOME st', kind='addresses')], ['12'])
+        self.assertEqual(self.results(q='--'), [])
+
+    @skipUnless(connection.vendor == 'sqlite', 'Query plans are checked on SQLite.')
+    def test_index_range(self):
+        for qs in (_prefixed(Locality.objects.all(), 'name_key', 'north'),
+                   _prefixed(Locality.objects.all(), 'postal_code_key', '30'),
+                   _prefixed(Address.objects.filter(street_number='1'), 'route_key', 'some')):
+            sql, params = qs.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                plan = ' '.join(r[-1] for r in cursor.fetchall())
+            self.assertIn('USING INDEX', plan)
+            self.assertNotIn('SCAN', plan)
+
+    def test_locality_index(self):
+        locality_index.clear()
+        with override_settings(ADDRESS_LOCALITY_INDEX=True):
+            self.assertEqual(self.results(q='north'), self.results(q='north'))
+            with self.assertNumQueries(0):
+                res = self.results(q='north')
+            self.assertEqual([r['locality'] for r in res], ['North Melbourne', 'Northcote'])
+            self.assertEqual(res[1]['label'], 'Northcote, VIC 3070, Australia')
+            self.assertEqual([r['locality'] for r in self.results(q='3065')], ['Fitzroy'])
+        locality_index.clear()
@@ -0,0 +1,108 @@
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils import six
+
+from .models import Locality, Address
+from .normalize import prefix_key
+from .prefix import locality_index
+
+__all__ = ['autocomplete']
+
+# The most results a single request may ask for.
+MAX_LIMIT = 50
+
+##
+## Filter the rows whose `field`, a key folded with `prefix_key`, starts
+## with `key`, as a range of its index.
+##
+def _prefixed(qs, field, key):
+    upper = key[:-1] + six.unichr(ord(key[-1]) + 1)
+    return qs.filter(**{'%s__gte'%field: key, '%s__lt'%field: upper})
+
+##
+## Suggestions for a partially entered address, found by prefix from the
+## folded keys of the address tables, or for localities from the
+## in-process index when the `ADDRESS_LOCALITY_INDEX` setting is set. Each
+## is a dictionary of the components used by the address widget, plus a
+## `label` to show.
+##
+def suggest_localities(query, limit):
+    if getattr(settings, 'ADDRESS_LOCALITY_INDEX', False):
+        return [_locality(row) for row in locality_index.suggest(query, limit)]
+    key = prefix_key(query)
+    if not key:
+        return []
+    if key[0].isdigit():
+        qs = _prefixed(Locality.objects.all(), 'postal_code_key', key).order_by('postal_code_key', 'name_key')
+    else:
+        qs = _prefixed(Locality.objects.all(), 'name_key', key).order_by('name_key', 'postal_code_key')
+    return [_locality(row) for row in qs.values_list(*locality_index.fields)[:limit]]
+
+def _locality(row):
+    name, postal_code, state, state_code, country, country_code = row
+    label = ', '.join(p for p in (name, ' '.join(p for p in (state_code or state, postal_code) if p), country) if p)
+    return dict(
+        label=label, locality=name, postal_code=postal_code, state=state,
+        state_code=state_code, country=country, country_code=country_code,
+    )
+
+def suggest_addresses(query, limit):
+    parts = query.split(None, 1)
+    qs = Address.objects.exclude(locality=None)
+    if len(parts) == 2 and parts[0].isdigit():
+        qs = qs.filter(street_number=parts[0])
+        query = parts[1]
+    key = prefix_key(query)
+    if not key:
+        return []
+    qs = _prefixed(qs, 'route_key', key)
+    fields = ('street_number', 'route', 'locality_name', 'postal_code', 'state_name',
+              'state_code', 'country_name', 'country_code', 'formatted', 'latitude',
+              'longitude', 'display')
+    rows = qs.order_by('route_key', 'street_number', 'pk').values_list(*fields)[:limit]
+    res = []
+    for row in rows:
+        ad = dict(zip(('street_number', 'route', 'locality', 'postal_code', 'state',
+                       'state_code', 'country', 'country_code', 'formatted', 'latitude',
+                       'longitude'), row))
+        ad['label'] = ad['formatted'] or row[-1] or ''
+        res.append(ad)
+    return res
+
+SUGGESTERS = {
+    'localities': suggest_localities,
+    'addresses': suggest_addresses,
+}
+
+##
+## Whether `request` may search the stored addresses, which is off unless
+## the setting `ADDRESS_AUTOCOMPLETE_ADDRESSES` is `True`, or the name of a
+## permission the user holds.
+##
+def can_suggest_addresses(request):
+    allowed = getattr(settings, 'ADDRESS_AUTOCOMPLETE_ADDRESSES', False)
+    if isinstance(allowed, six.string_types):
+        user = getattr(request, 'user', None)
+        return user is not None and user.has_perm(allowed)
+    return allowed is True
+
+##
+## A JSON view of the suggestions for the `q` parameter. `kind` chooses
+## between `localities` (the default) and `addresses`, and `limit` the
+## number returned.
+##
+def autocomplete(request):
+    query = request.GET.get('q', '').strip()
+    kind = request.GET.get('kind', 'localities')
+    if kind not in SUGGESTERS:
+        return JsonResponse({'error': 'Unknown kind "%s".'%kind}, status=400)
+    if kind == 'addresses' and not can_suggest_addresses(request):
+        return JsonResponse({'error': 'Address suggestions are not allowed.'}, status=403)
+    try:
+        limit = int(request.GET.get('limit', getattr(settings, 'ADDRESS_AUTOCOMPLETE_LIMIT', 10)))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid limit.'}, status=400)
+    limit = max(0, min(limit, MAX_LIMIT))
+    if not query or not limit:
+        return JsonResponse({'results': []})
+    return JsonResponse({'results': SUGGESTERS[kind](query, limit)})